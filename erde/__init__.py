@@ -107,6 +107,20 @@ def read_stream(path, geometry_filter=None, chunk_size=10_000, pbar=False, sync=
 		Show progress bar.
 	sync : bool, default True
 		Don't create a new process, read the file in the main process.
+	workers : int, default 1
+		Number of background processes, each reads its own range of rows of the source. Works only when the reader is used as context manager and not in sync mode. PostgreSQL tables are split by `partition_by` column values, or by ctid, if it's not set.
+	ordered : bool, default True
+		With several workers, yield chunks in the source order. If False, chunks are yielded as soon as any worker reads them.
+	exact_filter : bool, default True
+		Check that objects intersect `geometry_filter` exactly. If False, all the objects intersecting the filter bbox are returned, which is faster.
+	batch_filter : bool, default False
+		If `geometry_filter` has many geometries, read the source once (not once per each filter geometry), matching rows to all filters with STRtree. Each row gets `filter_index` column (number of the matching filter geometry), rows matching several filters are repeated.
+	dedup : bool, default False
+		With `batch_filter`, return each row once, with the first filter it matches.
+	columns : list of str, optional
+		Read only these columns (and geometry). Supported by GPKG, FGB, SHP, GeoJSON, CSV, Parquet, Arrow, Excel and PostgreSQL readers, other columns are not read from the source at all.
+	where : str, optional
+		Read only rows matching this condition, e.g. `"population > 1000"`. In OGR formats (including FGB and GeoJSONSeq, unless `engine='native'` is given) it's OGR SQL, in PostgreSQL it's SQL, in CSV, Excel, Parquet and Arrow it's pandas `DataFrame.query` expression.
 
 	`args` and `kwargs` are passed to drivers, see modules in erde.io.
 
@@ -150,6 +164,51 @@ def write_stream(path, sync=True, *args, **kwargs):
 	return dr.write_stream(path, sync=sync, *args, **kwargs)
 
 
+_job_func = None
+
+
+def _init_job(func):
+	"""Sets the function in a `_map_jobs` worker process. It's passed here, not with each chunk, because functions defined in `__main__` script can't be pickled."""
+	global _job_func
+	_job_func = func
+
+
+def _run_job(args, kwargs):
+	import inspect
+	retval = _job_func(*args, **kwargs)
+	return list(retval) if inspect.isgeneratorfunction(_job_func) else retval
+
+
+def _map_jobs(func, args_iter, kwargs, jobs, keep_order=False):
+	"""Calls func on each arguments set from args_iter in a pool of `jobs` processes, and yields the results. To keep memory bounded, at most 2 * jobs chunks are in processing at once.
+
+	With `keep_order=True`, results are yielded in the order of args_iter, otherwise as soon as they're ready.
+	"""
+	from collections import deque
+	from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+	max_in_flight = jobs * 2
+
+	def _ready(pending, wait_all=False):
+		while pending and (wait_all or len(pending) >= max_in_flight):
+			if keep_order:
+				yield pending.popleft().result()
+				continue
+
+			done, _ = wait(pending, return_when=FIRST_COMPLETED)
+			for future in done:
+				pending.remove(future)
+				yield future.result()
+
+	with ProcessPoolExecutor(max_workers=jobs, initializer=_init_job, initargs=(func,)) as ppe:
+		pending = deque()
+		for args in args_iter:
+			pending.append(ppe.submit(_run_job, args, kwargs))
+			yield from _ready(pending)
+
+		yield from _ready(pending, wait_all=True)
+
+
 @contextmanager
 def _handle_pudb():
 	"""A context manager to capture errors with PUDB, which does not have such feature."""
@@ -167,6 +226,9 @@ TYPE_OPENERS = {
 	gpd.GeoDataFrame: read_df
 }
 
+# options added by @autocli to scripts with read_stream input, with their defaults
+STREAM_OPTIONS = {'jobs': 1, 'keep_order': False, 'select': None, 'where': None}
+
 
 def autocli(func):
 	"""
@@ -194,6 +256,14 @@ def autocli(func):
 
 	If there's an exception, you'll see IPDB shell to debug the error immediately. Note: it can't work with multiprocessing apps.
 
+	If the input is `read_stream`, the script gets `--jobs N` option to run the function on chunks in N processes (by default results are written as soon as they're ready, add `--keep-order` to write them in the input order):
+
+		$ python3 myscript.py source.gpkg --jobs 8 target.gpkg
+
+	Options `--select col1,col2` and `--where "condition"` are passed to the reader as `columns` and `where` (see `read_stream`), so that the columns and rows the script doesn't need are not read at all:
+
+		$ python3 myscript.py source.gpkg --select name,population --where "population > 1000" target.gpkg
+
 	If you import the function or entire module, it is not altered:
 
 		> from myscript.py import main
@@ -246,9 +316,22 @@ def autocli(func):
 				output_path = getattr(known_args[0], 'output-path', None) or known_args[1][-1]
 				kwargs.pop('output-path', None)  # output-path leaks into kwargs when it's added to parser, so pop it from there just in case
 
+			# streaming options are added only to functions with read_stream input, others may have params with these names
+			jobs, keep_order = 1, False
 			if input_streams == 1:
+				jobs = kwargs.pop('jobs', 1)
+				keep_order = kwargs.pop('keep_order', False)
+				select = kwargs.pop('select', None)
+				where = kwargs.pop('where', None)
+
 				def reader():
-					with read_stream(args[stream_arg_id], sync=False) as rd:
+					read_options = {}
+					if select is not None:
+						read_options['columns'] = select.split(',')
+					if where is not None:
+						read_options['where'] = where
+
+					with read_stream(args[stream_arg_id], sync=False, **read_options) as rd:
 						for df in rd:
 							args2 = list(args)
 							args2[stream_arg_id] = df
@@ -265,8 +348,12 @@ def autocli(func):
 			else:
 				writer = lambda df: None
 
-			for args2 in reader():
-				retval = func(*args2, **kwargs)
+			if input_streams == 1 and jobs > 1:
+				results = _map_jobs(func, reader(), kwargs, jobs, keep_order)
+			else:
+				results = (func(*args2, **kwargs) for args2 in reader())
+
+			for retval in results:
 				retval = retval if inspect.isgeneratorfunction(func) else [retval]
 
 				for df in retval:
@@ -295,7 +382,8 @@ def autocli(func):
 			if an == read_stream:  # streaming cli app
 				input_streams += 1  # must count number of read_stream, as only 1 is allowed
 				stream_arg_id = i
-				decorated = yaargh.decorators.arg(par.name.replace('_', '-'), type=TYPE_OPENERS.get(an, an))(decorated)
+				# the path is passed as is, the decorated function opens the stream itself
+				decorated = yaargh.decorators.arg(par.name.replace('_', '-'))(decorated)
 				continue
 
 			# argument with default vaulue = optional, & it must start with dashes
@@ -311,6 +399,22 @@ def autocli(func):
 			if an != bool:
 				decorated = yaargh.decorators.arg(*names, type=TYPE_OPENERS.get(an, an))(decorated)
 
+	if input_streams == 1:
+		clashing = [k for k in STREAM_OPTIONS if k in sig.parameters]
+		if clashing:
+			raise ErdeDecoratorError(f"function decorated with @autocli has read_stream in input, and parameters {', '.join(clashing)}, which clash with the streaming options ({', '.join(STREAM_OPTIONS)}). Rename them.")
+
+		# jobs and reader options are not in func signature, so argh must see them in signature of decorated, not of the wrapped func
+		params = list(sig.parameters.values())
+		stream_params = [inspect.Parameter(name, inspect.Parameter.KEYWORD_ONLY, default=default) for name, default in STREAM_OPTIONS.items()]
+		varkw = [p for p in params if p.kind == inspect.Parameter.VAR_KEYWORD]
+		del decorated.__wrapped__
+		decorated.__signature__ = sig.replace(parameters=[p for p in params if p.kind != inspect.Parameter.VAR_KEYWORD] + stream_params + varkw)
+		decorated = yaargh.decorators.arg('--jobs', type=int, default=1, help='number of processes running the function on input chunks in parallel')(decorated)
+		decorated = yaargh.decorators.arg('--keep-order', default=False, help='with --jobs, write results in the order of input chunks')(decorated)
+		decorated = yaargh.decorators.arg('--select', default=None, help='comma-separated columns to read from the input, others are skipped by the reader')(decorated)
+		decorated = yaargh.decorators.arg('--where', default=None, help='read only input rows matching this condition (SQL for OGR formats and PostgreSQL, pandas query for CSV, Excel, Parquet and Arrow)')(decorated)
+
 	if input_streams > 1:
 		raise ErdeDecoratorError(f'Argument of read_stream type can be only one, got {input_streams} instead')
 
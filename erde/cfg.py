@@ -8,6 +8,17 @@ USER_CONFIG_PATH = os.path.join(os.path.expanduser("~"), '.erde.yml')
 CONFIG = {
 	'routers': {
 		'local': 'http://localhost:5000'
+	},
+	# keep-alive connections to routers, see erde.utils.http_session
+	'http': {
+		'pool_size': 10,  # connections kept open per host and process
+		'timeout': None,  # seconds to wait for a response, None means forever
+	},
+	# router responses cache, see erde.op.cache
+	'cache': {
+		'path': os.path.join('~', '.cache', 'erde'),  # directory of caches given by name
+		'ttl': None,  # seconds an entry is valid, None means forever
+		'max_entries': None,  # the least recently used entries above this are evicted
 	}
 }
 
@@ -1,11 +1,30 @@
-from shapely import wkt
 import geopandas as gpd
 import os
 import sys
 
 
+def _decode_geometry(values):
+	"""Decodes WKT or hex WKB strings (the format is detected by the first value) into an array of shapely geometries, in one vectorized call. Empty values become None. Raises ValueError if values are not geometries."""
+	import numpy as np
+	import pandas as pd
+	import re
+	import shapely
+	values = pd.Series(values, dtype=object)
+	empty = values.isna().values
+	values = np.where(empty, None, values.values)
+	filled = values[~empty]
+	if pd.api.types.infer_dtype(filled, skipna=True) not in ('string', 'empty'):
+		raise ValueError('values are not strings')
+
+	try:
+		if len(filled) > 0 and re.fullmatch('[0-9A-Fa-f]+', filled[0]):
+			return shapely.from_wkb(values)
+		return shapely.from_wkt(values)
+	except (TypeError, shapely.errors.GEOSException) as e:
+		raise ValueError(f'values are not WKT or WKB geometries: {e}')
+
+
 def _try_gdf(df, geometry_columns=('geometry', 'WKT'), crs=None):
-	from shapely.errors import WKTReadingError
 	if isinstance(geometry_columns, str):
 		geometry_columns = [geometry_columns]
 
@@ -13,8 +32,8 @@ def _try_gdf(df, geometry_columns=('geometry', 'WKT'), crs=None):
 	for k in geometry_columns:
 		if k in df:
 			try:
-				df['geometry'] = df[k].apply(wkt.loads)
-			except (TypeError, AttributeError, WKTReadingError):
+				df['geometry'] = _decode_geometry(df[k])
+			except ValueError:
 				print("warning: can't transform empty or broken geometry", file=sys.stderr)
 			else:
 				if k != 'geometry': df.pop(k)
@@ -40,5 +59,5 @@ def check_path_exists(path):
 	if not os.path.exists(path):  # immediately raise error to avoid crashing much later
 			raise FileNotFoundError(f'file {path} does not exist')
 
-from . import csv, fgb, gpkg, geojson, geojsonseq, postgres, shp, xls
-drivers = {'csv': csv.driver, 'fgb': fgb.driver, 'gpkg': gpkg.driver, 'geojson': geojson.driver, 'geojsonl.json': geojsonseq.driver, 'postgres': postgres.driver, 'shp': shp.driver, 'xls': xls.driver}
+from . import arrow, csv, fgb, gpkg, geojson, geojsonseq, parquet, postgres, shp, xls
+drivers = {'arrow': arrow.driver, 'csv': csv.driver, 'fgb': fgb.driver, 'gpkg': gpkg.driver, 'geojson': geojson.driver, 'geojsonl.json': geojsonseq.driver, 'parquet': parquet.driver, 'postgres': postgres.driver, 'shp': shp.driver, 'xls': xls.driver}
@@ -0,0 +1,148 @@
+"""
+Arrow IPC files (Feather v2): a cheap format for intermediate results between scripts. The file is memory-mapped when read, so attribute columns are not copied from the file (numeric columns without nulls become numpy arrays over the mapped memory), and only WKB geometries are decoded. Geometry columns and crs are stored in GeoParquet `geo` schema metadata, so `geopandas.read_feather` reads these files too.
+
+Requires pyarrow.
+"""
+from . import check_path_exists
+from .base import BaseDriver, BaseReader, BaseWriter, FileWriterMixin
+from .parquet import ArrowSchemaMixin, _bbox_mask, _covering_column, _column_crs, _read_geo_metadata, _to_geodataframe
+import numpy as np
+
+PATH_REGEXP = r'^.*\.(arrow|feather|ipc)$'
+
+
+def _open_file(path):
+	"""Memory-maps the file and opens it as Arrow IPC file (random access to record batches)."""
+	import pyarrow as pa
+	return pa.ipc.open_file(pa.memory_map(path, 'r'))
+
+
+def _to_pandas(table):
+	# split_blocks keeps columns separate, so that they are not copied into consolidated 2D blocks
+	return table.to_pandas(split_blocks=True)
+
+
+class ArrowReader(BaseReader):
+	"""Reads Arrow IPC (Feather) files by `chunk_size` rows. The file is memory-mapped, columns not in `columns` are never touched, and `where` is applied with `DataFrame.query` before geometries are decoded.
+
+	If the file has bbox column (`ArrowWriter(bbox=True)`), rows are prefiltered by it for `geometry_filter`. With `workers=N`, record batches are split between workers.
+	"""
+	source_regexp = PATH_REGEXP
+	can_partition = True
+
+	def __init__(self, source, geometry_filter=None, chunk_size: int = 10_000, sync: bool = False, pbar: bool = True, **kwargs):
+		check_path_exists(source)
+		super().__init__(source, geometry_filter, chunk_size, sync, pbar, **kwargs)
+
+		reader = _open_file(self.source)
+		self.geo = _read_geo_metadata(reader.schema)
+		self.covering = None if self.geo is None else _covering_column(self.geo)
+		self.geometry_columns = [] if self.geo is None else list(self.geo['columns'])
+		if self.geo is not None:
+			self.crs = _column_crs(self.geo['columns'][self.geo['primary_column']])
+		elif self.geometry_filter != [None]:
+			raise ValueError(f'{source} has no geometry metadata, can\'t filter it by geometry')
+
+		self.fieldnames = [c for c in reader.schema.names if c != self.covering]
+		self._check_columns(self.fieldnames)
+		self.batch_rows = [reader.get_batch(i).num_rows for i in range(reader.num_record_batches)]  # reads only batch headers from the map
+		self.total_rows = sum(self.batch_rows)
+
+	def partitions(self):
+		"""Splits record batches between workers: (start row, stop row, first batch, stop batch)."""
+		if self.workers == 1:
+			return [None]
+
+		batches = len(self.batch_rows)
+		bounds = sorted({batches * i // self.workers for i in range(self.workers)})
+		rows = np.cumsum([0] + self.batch_rows).tolist()
+		stops = bounds[1:] + [batches]
+		return [(rows[a], rows[b] if b < batches else None, a, b) for a, b in zip(bounds, stops)]
+
+	def _rows_pbar(self):
+		if self._partition is None:
+			return self._pbar(desc=f'rows in {self.source}', total=self.total_rows)
+
+		start, stop, *_ = self._partition
+		return self._pbar(desc=f'rows {start}-{stop or ""} in {self.source}', total=(stop or self.total_rows) - start)
+
+	def _read_sync(self):
+		import pyarrow as pa
+
+		reader = _open_file(self.source)
+		batches = range(len(self.batch_rows)) if self._partition is None else range(*self._partition[2:])
+		table = pa.Table.from_batches([reader.get_batch(i) for i in batches], schema=reader.schema)  # no copying, the batches point to the map
+		if self.columns is not None:
+			table = table.select([c for c in table.schema.names if c in self.columns or c in self.geometry_columns or c == self.covering])
+
+		chunk_size = self.chunk_size or max(table.num_rows, 1)
+		for geometry_filter in self.geometry_filter_pbar:
+			bounds = None if geometry_filter is None else geometry_filter.bounds
+			with self._rows_pbar() as reader_bar:
+				for offset in range(0, table.num_rows, chunk_size):
+					if self.emergency_stop.value: return
+					chunk = table.slice(offset, chunk_size)
+					reader_bar.update(chunk.num_rows)
+					if bounds is not None and self.covering is not None:
+						chunk = chunk.filter(_bbox_mask(chunk, self.covering, bounds))
+
+					data = _to_pandas(chunk)
+					if self.where is not None:
+						data = data.query(self.where)
+
+					if len(data) == 0: continue
+
+					gdf = self._filter_chunk(_to_geodataframe(data, self.geo), geometry_filter)
+					if len(gdf) == 0: continue
+
+					gdf.index = self._range_index(gdf)
+					yield gdf
+
+
+class ArrowWriter(ArrowSchemaMixin, FileWriterMixin, BaseWriter):
+	"""Writes Arrow IPC (Feather v2) file, appending one record batch per chunk. Geometries are written as WKB. Columns and their types are taken from the first dataframe, other columns are skipped (columns without values get types from the next chunks, see `ArrowSchemaMixin`).
+
+	`compression` ('lz4' or 'zstd') makes files smaller, but then the buffers have to be decompressed when read, instead of being used from the map. `bbox=True` adds bbox column (as in GeoParquet) to prefilter rows by `geometry_filter` when reading.
+	"""
+	target_regexp = PATH_REGEXP
+
+	def __init__(self, target, sync: bool = False, compression: str = None, bbox: bool = False, **kwargs):
+		super().__init__(target, sync, **kwargs)
+		self.compression = compression
+		self.bbox = bbox
+
+	def _new_file(self, schema):
+		import pyarrow as pa
+		return pa.ipc.new_file(self.target, schema, options=pa.ipc.IpcWriteOptions(compression=self.compression))
+
+	def _write_table(self, table):
+		self._handler.write_table(table, max_chunksize=len(table))
+
+
+class ArrowDriver(BaseDriver):
+	path_regexp = PATH_REGEXP
+	reader = ArrowReader
+	writer = ArrowWriter
+
+	@classmethod
+	def read_df(cls, path, path_match, crs=None, columns=None, *args, **kwargs):
+		reader = _open_file(path)
+		table = reader.read_all()
+		geo = _read_geo_metadata(table.schema)
+		if columns is not None:
+			keep = set(columns) | set(geo['columns'] if geo is not None else [])
+			table = table.select([c for c in table.schema.names if c in keep])
+
+		df = _to_geodataframe(_to_pandas(table), geo)
+		if crs is not None:
+			df.crs = crs
+
+		return df
+
+	@classmethod
+	def write_df(cls, df, path, path_match, *args, **kwargs):
+		with ArrowWriter(path, sync=True, **kwargs) as wr:
+			wr(df)
+
+
+driver = ArrowDriver
@@ -3,6 +3,7 @@ Base driver for parallel, streaming io. Does not implement actual reading/writin
 """
 
 from erde import ESYNC, dprint
+from erde.io.shm import QUEUE_TRANSPORT, SHM_TRANSPORT, check_transport, dump_chunk, load_chunk, release_chunk
 from multiprocessing import Process, Value, Queue
 from shapely.geometry.base import BaseGeometry
 from time import sleep
@@ -15,6 +16,35 @@ import sys
 import types
 
 
+class GeometryFilterTree:
+	"""All geometries of `geometry_filter` in one STRtree, to filter the source in one scan (see `BaseReader`, `batch_filter` option)."""
+	def __init__(self, geometries):
+		import shapely
+		self.geometries = [g for g in geometries if g is not None]
+		self.bounds = tuple(shapely.total_bounds(self.geometries)) if self.geometries else None
+		self._tree = None
+
+	@property
+	def tree(self):
+		# made in the process that reads the source
+		if self._tree is None:
+			import shapely
+			self._tree = shapely.STRtree(self.geometries)
+		return self._tree
+
+	def query(self, geometry, exact=True, dedup=False):
+		"""Finds filter geometries matching each of `geometry`. Returns arrays of (row numbers, filter numbers) sorted by row, one pair per match. With `dedup=True`, only the first matching filter is kept for each row."""
+		import numpy as np
+		rows, filters = self.tree.query(np.asarray(geometry), predicate='intersects' if exact else None)
+		order = np.lexsort((filters, rows))
+		rows, filters = rows[order], filters[order]
+		if dedup and len(rows) > 0:
+			first = np.r_[True, rows[1:] != rows[:-1]]
+			rows, filters = rows[first], filters[first]
+
+		return rows, filters
+
+
 class BaseReader:
 	"""Base class for chunk-streaming format drivers.
 
@@ -32,11 +62,22 @@ class BaseReader:
 
 		for gdf in GpkgReader(path_to_file):
 			print(gdf)
+
+	With `transport='shm'`, chunks are passed from the background process through shared memory instead of being pickled into the queue (see `erde.io.shm`).
+
+	With `workers=N` (N > 1), the source is split into N row ranges (by `estimated_rows`), and each range is read by its own background process. If `ordered=True` (default), chunks come in the same order and with the same index as from one process. If `ordered=False`, chunks come as soon as any process reads them, and the index of each range starts from its first row number (so it's still unique; readers that don't know row numbers of ranges may start it from another unique base, e.g. CSV uses byte offsets). Subclasses that can read a range set `can_partition = True` and read only `self._partition` rows (start, stop) in `_read_sync`.
+
+	`geometry_filter` is applied in two steps: the source gives the candidates by the filter bbox (using the spatial index, if the format has one), then they're checked exactly for intersection, vectorized per chunk with prepared filter geometry (see `_filter_chunk`). With `exact_filter=False`, the second step is skipped, and all the rows intersecting the filter bbox are returned.
+
+	If `geometry_filter` has many geometries (a dataframe, a path, etc.), the source is read once per each filter geometry, and objects intersecting several of them are returned several times. With `batch_filter=True`, all the filter geometries are put in one STRtree, the source is read once (by the bbox of all filters), and each row gets `filter_column` (default `'filter_index'`) with the number of matching filter geometry. Rows matching several filters are repeated, one for each filter, unless `dedup=True` (then the first matching filter is kept).
+
+	`columns` (list of column names) and `where` (condition on attributes) are pushed down to the source by readers that support them, so that other columns and rows are not read at all. Geometry is always read.
 	"""
 	
 	source_regexp = None
+	can_partition = False
 
-	def __init__(self, source, geometry_filter=None, chunk_size: int = 10_000, sync: bool = False, pbar: bool = True, queue_size=10, **kwargs):
+	def __init__(self, source, geometry_filter=None, chunk_size: int = 10_000, sync: bool = False, pbar: bool = True, queue_size=10, transport: str = QUEUE_TRANSPORT, workers: int = 1, ordered: bool = True, columns: list = None, where: str = None, exact_filter: bool = True, batch_filter: bool = False, filter_column: str = 'filter_index', dedup: bool = False, **kwargs):
 		if self.source_regexp:
 			self.source_match = re.match(self.source_regexp, source)
 			assert self.source_match, f'File name {source} is not a valid {self.fiona_driver} path.'
@@ -45,6 +86,20 @@ class BaseReader:
 		assert chunk_size is None or chunk_size > 0, "chunk_size must be positive int or None"
 		self.chunk_size = chunk_size
 		self.queue_size = queue_size
+		check_transport(transport)
+		self.transport = transport
+		if workers < 1:
+			raise ValueError(f'workers must be positive int, got {workers}')
+		if workers > 1 and not self.can_partition:
+			raise ValueError(f'{self.__class__.__name__} can\'t read a source with several workers')
+		self.workers = workers
+		self.ordered = ordered
+		self._partition = None  # (start, stop) rows range read by this process, None means all rows
+		self.columns = None if columns is None else list(columns)
+		self.where = where
+		self.exact_filter = exact_filter
+		self.filter_column = filter_column
+		self.dedup = dedup
 		self._sync = sync or ESYNC
 		self.pbar = pbar
 		self.index_start = 0  # dataframes should have different indice, otherwise they'll be merged incorrectly
@@ -55,7 +110,9 @@ class BaseReader:
 		self._reader = None
 		self.err_q = None
 		self.out_q = None
+		self.out_qs = []
 		self.background_process = None
+		self.background_processes = []
 		self._entered_context = False
 		self.emergency_stop = Value(ctypes.c_bool, False)
 
@@ -84,6 +141,10 @@ class BaseReader:
 		else:
 			raise TypeError('geometry filter can be: None, shapely.geometry.BaseGeometry, generator, DfReader')
 
+		if batch_filter and geometry_filter is not None:
+			g_ = [GeometryFilterTree(g_)]
+			geo_filter_total = 1
+
 		self.geometry_filter = g_
 		self.geometry_filter_total = geo_filter_total
 
@@ -98,13 +159,65 @@ class BaseReader:
 		kwargs.update({'disable': disable, 'unit_scale': 1})
 		return tqdm(iterable, **kwargs)
 
+	def _rows_pbar(self):
+		if self._partition is None:
+			return self._pbar(desc=f'rows in {self.source}', total=self.total_rows)
+
+		start, stop = self._partition
+		return self._pbar(desc=f'rows {start}-{stop or ""} in {self.source}', total=(stop or self.total_rows) - start)
+
+	def _filter_chunk(self, gdf, geometry_filter):
+		"""Keeps rows of the chunk (candidates from the source by bbox) that match the geometry filter exactly. With `GeometryFilterTree` filter, adds filter numbers column."""
+		if geometry_filter is None:
+			return gdf
+
+		if isinstance(geometry_filter, GeometryFilterTree):
+			rows, filters = geometry_filter.query(gdf['geometry'].values, self.exact_filter, self.dedup)
+			return gdf.iloc[rows].assign(**{self.filter_column: filters})
+
+		import numpy as np
+		import shapely
+		if not self.exact_filter:
+			# sources without spatial index (e.g. CSV) give all the rows, not only the bbox candidates
+			geometry_filter = shapely.box(*geometry_filter.bounds)
+
+		shapely.prepare(geometry_filter)
+		return gdf[shapely.intersects(geometry_filter, np.asarray(gdf['geometry'].values))]
+
+	def _check_columns(self, fieldnames):
+		if self.columns is None:
+			return
+
+		missing = set(self.columns) - set(fieldnames)
+		if missing:
+			raise ValueError(f"columns not found in {self.source}: {', '.join(sorted(missing))}")
+
+	# main process
+	def partitions(self):
+		"""Splits the source into `workers` row ranges (start, stop). The last one is open (stop is None), so `estimated_rows` may be not exact."""
+		if self.workers == 1:
+			return [None]
+
+		total_rows = self.estimated_rows
+		step = max(-(-total_rows // self.workers), 1)  # ceil division
+		starts = list(range(0, max(total_rows, 1), step))
+		return [(start, stop) for start, stop in zip(starts, starts[1:] + [None])]
+
 	# main process
 	def __enter__(self):
 		dprint('base reader __enter__')
 		# multiprocessing features can be used only if the object is used as contex manager. Otherwise there's no safe shutdown mechanism.
-		self.err_q = Queue(maxsize=2)
-		self.out_q = Queue(maxsize=self.queue_size)
-		self.background_process = Process(target=self._worker, name=f'reader of {self.source}')
+		partitions = self.partitions()
+		self.err_q = Queue(maxsize=len(partitions) + 1)
+		if self.ordered:
+			# each process has its own queue, they're read one after another
+			self.out_qs = [Queue(maxsize=self.queue_size) for p in partitions]
+		else:
+			self.out_qs = [Queue(maxsize=self.queue_size)] * len(partitions)
+
+		self.background_processes = [Process(target=self._worker, args=(p, q), name=f'reader of {self.source}' + (f' rows {p[0]}-{p[1] or ""}' if p else '')) for p, q in zip(partitions, self.out_qs)]
+		self.out_q = self.out_qs[0]
+		self.background_process = self.background_processes[0]
 		self._entered_context = True
 		return self
 
@@ -116,15 +229,17 @@ class BaseReader:
 				dprint('base reader exit: sending emergency stop')
 				sleep(0)
 				self.emergency_stop.value = True  # both sync/async
-				while not self.out_q.empty():
-					sleep(0)
-					self.out_q.get()
-					sleep(0)
+				for q in {id(q): q for q in self.out_qs + [self.out_q]}.values():
+					while not q.empty():
+						sleep(0)
+						release_chunk(q.get())
+						sleep(0)
 			else:
 				dprint('base reader: normal exit')
 
-			if self.background_process.is_alive():
-				self.background_process.join()
+			for process in self.background_processes:
+				if process.is_alive():
+					process.join()
 			sleep(0)
 			dprint('base reader: exit background process joined')
 		dprint('base reader: exit done')
@@ -136,6 +251,11 @@ class BaseReader:
 	def __len__(self):
 		return self.total_rows
 
+	@property
+	def estimated_rows(self):
+		"""Number of rows, which may be approximate, but cheap to get. Readers that count rows lazily override it."""
+		return self.total_rows
+
 	# main process
 	def __next__(self):
 		if self.__class__ == BaseReader:
@@ -145,13 +265,22 @@ class BaseReader:
 			if self._sync or not self._entered_context:  # if this object is not used as context manager, run in sync mode
 				self._reader = self._read_sync()
 			else:
-				self.background_process.start()  # start the process only here, in case nothing is read from the stream
+				# start the processes only here, in case nothing is read from the stream
+				for process in self.background_processes:
+					process.start()
 				self._reader = self._read_parallel()
 
 		return next(self._reader)
 
 	# background process
-	def _worker(self):
+	def _worker(self, partition=None, out_q=None):
+		if out_q is None:
+			out_q = self.out_q
+
+		if partition is not None:
+			self._partition = partition
+			self.index_start = partition[0]
+
 		try:
 			for i, gdf in enumerate(self._read_sync()):
 				dprint('reader worker: reading done')
@@ -160,14 +289,14 @@ class BaseReader:
 					break
 				dprint('reader worker: putting to q')
 				sleep(0)
-				self.out_q.put(gdf)
+				out_q.put(dump_chunk(gdf) if self.transport == SHM_TRANSPORT else gdf)
 				sleep(0)  # required to yield to queue's thread!!!
 				dprint('reader worker: put to q done')
 				if self.emergency_stop.value: # check for stop before read, bc it can take a while
 					dprint('reader worker: emergency')
 					break
 			else:
-				self.out_q.put(None)
+				out_q.put(None)
 
 		except Exception as e:
 			dprint('reader worker: exception')
@@ -178,21 +307,50 @@ class BaseReader:
 		dprint('reader worker: ending')
 		sleep(0)
 
+	# main process
+	def _get(self, q):
+		# waiting with timeout, because with several processes, the one that crashed may be not the one we're waiting for
+		from queue import Empty
+		while not self.emergency_stop.value:
+			try:
+				return q.get(timeout=.1)
+			except Empty:
+				sleep(0)
+
 	# main process
 	def _read_parallel(self):
-		while True:
-			if self.emergency_stop.value: break
-			sleep(0)
-			item = self.out_q.get()
-			sleep(0)
-			if self.emergency_stop.value or item is None: break
-			yield item
-			if self.emergency_stop.value: break
+		# ordered: each process has its own queue, read them one by one. unordered: all processes share one queue and each sends None at the end
+		if self.ordered:
+			queues = [(q, 1) for q in self.out_qs or [self.out_q]]
+		else:
+			queues = [(self.out_q, len(self.out_qs))]
+
+		renumber = self.ordered and len(self.out_qs) > 1
+		for q, producers in queues:
+			while producers > 0:
+				if self.emergency_stop.value: break
+				sleep(0)
+				item = self._get(q)
+				sleep(0)
+				if self.emergency_stop.value:
+					release_chunk(item)
+					break
+				if item is None:
+					producers -= 1
+					continue
+
+				df = load_chunk(item)
+				if renumber:
+					df.index = self._range_index(df)
+				yield df
+				if self.emergency_stop.value: break
 
 		if self.emergency_stop.value:
 			t, e, tb = self.err_q.get()
 			print('exception in reading process, printing its traceback', file=sys.stderr)
-			raise t(*e).with_traceback(tb)
+			if tb:
+				print(tb, file=sys.stderr)
+			raise t(*e)
 
 	# background process
 	def _read_sync(self):
@@ -209,9 +367,11 @@ class BaseReader:
 
 
 class BaseWriter:
-	def __init__(self, target, sync: bool = False, **kwargs):
+	def __init__(self, target, sync: bool = False, transport: str = QUEUE_TRANSPORT, **kwargs):
 		self.target = target
 		self._sync = sync
+		check_transport(transport)
+		self.transport = transport
 		self._handler = None
 		self.kwargs = kwargs
 		self.emergency_stop = Value(ctypes.c_bool, False)  # used both in sync/async
@@ -283,7 +443,7 @@ class BaseWriter:
 		if self._sync:
 			self._write_sync(df)
 		else:
-			self.in_q.put(df)
+			self.in_q.put(dump_chunk(df) if self.transport == SHM_TRANSPORT else df)
 			sleep(0)  # unlock the queue thread
 
 	# is called only in the background process
@@ -298,10 +458,11 @@ class BaseWriter:
 				dprint('base writer worker: q read')
 				if self.emergency_stop.value:
 					dprint('base writer worker: emergency')
+					release_chunk(df)
 					break
 				if df is None: break
 				dprint('base writer worker: item from q not empty')
-				self._write_sync(df)
+				self._write_sync(load_chunk(df))
 				dprint('base writer worker: item written')
 				if self.emergency_stop.value:
 					dprint('base writer worker: emergency')
@@ -309,6 +470,9 @@ class BaseWriter:
 
 			if self.emergency_stop.value:
 				self._cancel()
+				if self.transport == SHM_TRANSPORT:
+					while not self.in_q.empty():
+						release_chunk(self.in_q.get())
 			else:
 				self._close_handler()
 			dprint('base writer worker: handler closed')
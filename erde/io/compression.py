@@ -0,0 +1,174 @@
+"""
+Transparent compression of text formats (CSV, GeoJSONSeq): `.gz`, `.bz2` and `.zst` files are read and written as streams, without unpacking to disk.
+
+Decompression and compression run in a background thread, connected to the parser by a queue of blocks, so they overlap with parsing (zlib, bz2 and zstd release the GIL while working). zstd files are compressed with all CPU cores (`threads=-1`). zstd requires `zstandard` package.
+"""
+
+import io
+import os
+import re
+import threading
+from queue import Queue
+
+COMPRESSIONS = ('gz', 'bz2', 'zst')
+PATH_SUFFIX = r'(?:\.(?:' + '|'.join(COMPRESSIONS) + '))?'  # to add to drivers' path regexps
+BLOCK_SIZE = 2 ** 20  # bytes passed between the thread and the parser at once
+QUEUE_SIZE = 16  # blocks waiting in the queue
+GZIP_LEVEL = 6  # as gzip utility, python's default 9 is several times slower
+ZSTD_LEVEL = 3
+
+
+def compression_of(path):
+	"""Returns compression extension of the path (`gz`, `bz2` or `zst`), or None."""
+	if not isinstance(path, str):
+		return None
+
+	match = re.match(r'^.*\.(' + '|'.join(COMPRESSIONS) + ')$', path)
+	return match and match.group(1)
+
+
+def _codec(raw, compression, mode):
+	"""Wraps binary file `raw` into decompressing (mode 'r') or compressing (mode 'w') stream."""
+	if compression == 'gz':
+		import gzip
+		return gzip.GzipFile(fileobj=raw, mode=mode + 'b', compresslevel=GZIP_LEVEL)
+
+	if compression == 'bz2':
+		import bz2
+		return bz2.BZ2File(raw, mode=mode)
+
+	import zstandard
+	if mode == 'r':
+		return zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+
+	return zstandard.ZstdCompressor(level=ZSTD_LEVEL, threads=-1).stream_writer(raw)
+
+
+class ThreadedDecompressor(io.RawIOBase):
+	"""Binary file object that gives decompressed data, decompressed by a background thread."""
+	def __init__(self, path):
+		self.raw = open(path, 'rb')
+		self.codec = _codec(self.raw, compression_of(path), 'r')
+		self.queue = Queue(maxsize=QUEUE_SIZE)
+		self.stop = threading.Event()
+		self.error = None
+		self.block = memoryview(b'')
+		self.finished = False
+		self.thread = threading.Thread(target=self._decompress, name=f'decompressing {path}', daemon=True)
+		self.thread.start()
+
+	def _decompress(self):
+		try:
+			while not self.stop.is_set():
+				block = self.codec.read(BLOCK_SIZE)
+				self.queue.put(block)
+				if not block:
+					return
+		except Exception as e:
+			self.error = e
+			self.queue.put(b'')
+
+	def readable(self):
+		return True
+
+	def readinto(self, buffer):
+		while len(self.block) == 0:
+			if self.finished:
+				return 0
+
+			self.block = memoryview(self.queue.get())
+			if len(self.block) == 0:
+				self.finished = True
+				if self.error is not None:
+					raise self.error
+
+		size = min(len(buffer), len(self.block))
+		buffer[:size] = self.block[:size]
+		self.block = self.block[size:]
+		return size
+
+	def compressed_tell(self):
+		"""Position in the compressed file, a bit ahead of the data given by `read`. Used for progress bars."""
+		return self.raw.tell()
+
+	def close(self):
+		if self.closed:
+			return
+
+		self.stop.set()
+		while self.thread.is_alive():
+			# unblock the thread if it waits for the queue
+			while not self.queue.empty():
+				self.queue.get()
+			self.thread.join(.01)
+
+		self.codec.close()
+		self.raw.close()
+		super().close()
+
+
+class ThreadedCompressor(io.RawIOBase):
+	"""Binary file object that passes written data to a background thread, which compresses it into the file."""
+	def __init__(self, path):
+		self.raw = open(path, 'wb')
+		self.codec = _codec(self.raw, compression_of(path), 'w')
+		self.queue = Queue(maxsize=QUEUE_SIZE)
+		self.error = None
+		self.thread = threading.Thread(target=self._compress, name=f'compressing {path}', daemon=True)
+		self.thread.start()
+
+	def _compress(self):
+		while True:
+			block = self.queue.get()
+			if block is None:
+				return
+
+			if self.error is None:
+				try:
+					self.codec.write(block)
+				except Exception as e:
+					self.error = e  # keep reading the queue, so that the writer is not blocked
+
+	def writable(self):
+		return True
+
+	def write(self, data):
+		if self.error is not None:
+			raise self.error
+
+		self.queue.put(bytes(data))
+		return len(data)
+
+	def close(self):
+		if self.closed:
+			return
+
+		self.queue.put(None)
+		self.thread.join()
+		try:
+			self.codec.close()  # writes the end of compressed stream
+		finally:
+			if not self.raw.closed:
+				self.raw.close()
+			super().close()
+
+		if self.error is not None:
+			raise self.error
+
+
+def open_compressed(path, mode='rb'):
+	"""Opens compressed file for streaming reading ('rb') or writing ('wb'/'w'), with (de)compression in a background thread. Text mode 'w' gives utf-8 text stream."""
+	if mode == 'rb':
+		return io.BufferedReader(ThreadedDecompressor(path), BLOCK_SIZE)
+
+	if mode not in ('wb', 'w'):
+		raise ValueError(f"mode must be 'rb', 'wb' or 'w', got '{mode}'")
+
+	if os.path.exists(path):
+		os.unlink(path)
+
+	f = io.BufferedWriter(ThreadedCompressor(path), BLOCK_SIZE)
+	if mode == 'w':
+		f = io.TextIOWrapper(f, encoding='utf-8', newline='')
+
+	return f
@@ -1,27 +1,154 @@
 from . import check_path_exists
 from .base import BaseDriver, BaseReader, BaseWriter, FileWriterMixin
+from .compression import PATH_SUFFIX, compression_of, open_compressed
 from csv import field_size_limit
-from shapely.wkt import loads
 import geopandas as gpd
+import io
 import os
 import pandas as pd
-import shapely.errors
 
 
-PATH_REGEXP = r'^.*\.(csv|txt)$'
+PATH_REGEXP = r'^.*\.(csv|txt)' + PATH_SUFFIX + '$'
+GEOMETRY_FORMATS = ('wkt', 'wkb')
+ESTIMATE_SAMPLE = 2 ** 20  # bytes read from the file start to estimate bytes per row
+SCAN_BLOCK = 2 ** 24  # bytes read at once when looking for partition boundaries
+
+
+def _encode_geometry(df, geometry_format='wkt'):
+	"""Returns a copy of dataframe with geometry column as WKT or hex WKB strings, encoded in one vectorized call."""
+	import numpy as np
+	import shapely
+	geometry = np.asarray(df['geometry'].values)
+	df = pd.DataFrame(df)
+	if geometry_format == 'wkb':
+		df['geometry'] = shapely.to_wkb(geometry, hex=True)
+	else:
+		# same as shapely.wkt.dumps, full precision
+		df['geometry'] = shapely.to_wkt(geometry, rounding_precision=-1, trim=False)
+
+	return df
+
+
+class _ByteRange(io.RawIOBase):
+	"""Binary file object that reads bytes [start, stop) of another binary file. stop=None means till the end."""
+	def __init__(self, f, start, stop=None):
+		self.f = f
+		self.f.seek(start)
+		self.remaining = None if stop is None else stop - start
+
+	def readable(self):
+		return True
+
+	def readinto(self, buffer):
+		size = len(buffer) if self.remaining is None else min(len(buffer), self.remaining)
+		data = self.f.read(size)
+		buffer[:len(data)] = data
+		if self.remaining is not None:
+			self.remaining -= len(data)
+		return len(data)
+
+
+def _row_starts(f, start, offsets):
+	"""For each of sorted byte `offsets`, finds the start of the first row at or after it: the position after the first line break outside quotes. Quotes are counted from `start` (which must be a row start), so that line breaks in quoted values (like long WKT) are not taken for row ends. Returns list of (byte position, rows before it), rows are counted as line breaks since `start`, so they're exact unless values have line breaks, and never less than the real number."""
+	pos = start
+	quotes = rows = 0
+	result = []
+	for offset in offsets:
+		if offset > pos:
+			f.seek(pos)
+			remaining = offset - pos
+			while remaining > 0:
+				block = f.read(min(SCAN_BLOCK, remaining))
+				if not block:
+					break
+				quotes += block.count(b'"')
+				rows += block.count(b'\n')
+				remaining -= len(block)
+
+			pos = offset
+			found = False
+			while not found:
+				block = f.read(SCAN_BLOCK)
+				if not block:
+					break
+				i = 0
+				while True:
+					line_end = block.find(b'\n', i)
+					if line_end == -1:
+						quotes += block.count(b'"', i)
+						pos += len(block) - i
+						break
+
+					quotes += block.count(b'"', i, line_end)
+					rows += 1
+					pos += line_end + 1 - i
+					i = line_end + 1
+					if quotes % 2 == 0:
+						found = True
+						break
+
+		result.append((pos, rows))
+
+	return result
+
+
+def _quotes(f, start, stop=None):
+	"""Number of quote characters in bytes [start, stop) of the file."""
+	f.seek(start)
+	quotes = 0
+	remaining = float('inf') if stop is None else stop - start
+	while remaining > 0:
+		block = f.read(int(min(SCAN_BLOCK, remaining)))
+		if not block:
+			break
+		quotes += block.count(b'"')
+		remaining -= len(block)
+
+	return quotes
+
+
+def _next_row_start(f, offset):
+	"""Position of the first line start at or after `offset`: the offset itself, if it follows a line break, or the position after the next line break."""
+	f.seek(offset - 1)
+	f.readline()
+	return f.tell()
+
+
+def _has_multiline_values(sample):
+	"""Whether any line of the sample has an odd number of quotes, i.e. a quoted value goes on to the next line."""
+	return any(line.count(b'"') % 2 for line in sample.split(b'\n'))
+
 
 class CsvReader(BaseReader):
+	"""Reads CSV files in chunks. If there's `geometry` or `WKT` column, it's parsed and GeoDataFrames are returned. Geometries may be WKT or hex WKB (detected automatically), each chunk is decoded in one vectorized call.
+
+	Files compressed with gzip, bzip2 or zstd (`.csv.gz`, `.csv.bz2`, `.csv.zst`) are decompressed on the fly in a background thread (see `erde.io.compression`). They can't be split between workers.
+
+	Rows are not counted upfront: `len()` counts them on the first call (reading the whole file), and `estimated_rows` gives a quick estimate by the file size and the first rows. The progress bar tracks bytes read.
+
+	With `workers=N`, the file is split into N equal byte ranges, and each range is parsed and its geometries decoded in its own process. Each worker moves its range start and end to the next line starts, so the file is not scanned beforehand. If quoted values in the first megabyte have line breaks, line starts may be inside values, so the range bounds are found by counting quotes from the file start instead (see `_row_starts`). Otherwise each worker checks that its range has even number of quotes before parsing it, so that if a range bound turns out to be inside a quoted value, reading fails with ValueError. In unordered mode, the index of each range starts from its start byte, so it's unique, but not continuous.
+
+	CSV has no spatial index, so `geometry_filter` is checked on each parsed chunk. With many filter geometries, use `batch_filter=True` to parse the file once instead of once per filter geometry.
+
+	`columns` are passed to pandas as `usecols` (the geometry column is added to them), and `where` is applied to each chunk with `DataFrame.query` before geometries are parsed (so it's pandas expression, but simple comparisons like `population > 1000` work the same as in SQL).
+	"""
 	source_regexp = PATH_REGEXP
+	can_partition = True
 
-	def __init__(self, source, geometry_filter=None, chunk_size:int=10_000, sync:bool=False, skip=0, sep=',', pbar=True):
+	def __init__(self, source, geometry_filter=None, chunk_size:int=10_000, sync:bool=False, skip=0, sep=',', pbar=True, transport='queue', workers=1, ordered=True, columns=None, where=None, exact_filter=True, batch_filter=False, filter_column='filter_index', dedup=False):
 		check_path_exists(source)
 		self.sep = sep  # needed in _read_schema
-		super().__init__(source, geometry_filter, chunk_size or 10_000, sync=sync, pbar=pbar)
+		super().__init__(source, geometry_filter, chunk_size or 10_000, sync=sync, pbar=pbar, transport=transport, workers=workers, ordered=ordered, columns=columns, where=where, exact_filter=exact_filter, batch_filter=batch_filter, filter_column=filter_column, dedup=dedup)
+		self.compression = compression_of(source)
+		if self.compression and workers > 1:
+			raise ValueError(f'compressed file {source} can\'t be read with several workers')
 
 		# reading schema, should be like fiona schema
-		df = pd.read_csv(self.source, nrows=1, sep=self.sep, engine='c')
+		with self._open() as f:
+			df = pd.read_csv(f, nrows=1, sep=self.sep, engine='c')
 
 		self.fieldnames = list(df)
+		self._check_columns(self.fieldnames + ['geometry'])
 		properties = {k: df[k].dtype for k in self.fieldnames}
 		self.schema = {'properties': properties}
 
@@ -32,54 +159,162 @@ class CsvReader(BaseReader):
 			self.geom_col = 'WKT'
 
 		if self.geom_col:
+			from erde.io import _decode_geometry
 			properties.pop(self.geom_col)
-			self.schema['geometry'] = loads(df.pop(self.geom_col)[0]).geom_type
+			self.schema['geometry'] = _decode_geometry(df.pop(self.geom_col))[0].geom_type
+
+		self.total_bytes = os.path.getsize(self.source)
+		self._total_rows = None
+
+	@property
+	def total_rows(self):
+		"""Exact number of rows, counted on first access (reads the whole file)."""
+		if self._total_rows is None:
+			with self._open() as f:
+				self._total_rows = max(sum(1 for i in f if i.strip(b'\r\n')) - 1, 0)
+
+		return self._total_rows
+
+	@property
+	def estimated_rows(self):
+		"""Number of rows estimated by the file size and the average length of rows in its first megabyte. Exact if the file is smaller, or if rows were already counted. Compressed files are counted."""
+		if self._total_rows is not None or self.compression:
+			return self.total_rows
+
+		with open(self.source, 'rb') as f:
+			header = f.readline()
+			sample = f.read(ESTIMATE_SAMPLE)
+
+		if len(header) + len(sample) >= self.total_bytes:
+			return self.total_rows
+
+		sample = sample[:sample.rfind(b'\n') + 1]  # whole lines only
+		rows = sum(1 for i in sample.splitlines() if i)
+		if rows == 0:
+			return self.total_rows
+
+		return round((self.total_bytes - len(header)) * rows / len(sample))
 
-		with open(self.source) as f:
-			self.total_rows = sum(1 for i in f if len(i) > 1) - 1
+	def _open(self):
+		if self.compression:
+			return open_compressed(self.source)
+
+		return open(self.source, 'rb')
+
+	def partitions(self):
+		"""Splits the file into `workers` byte ranges (at most one per estimated row). Each partition is (index start, index stop, start byte, stop byte, aligned), the last one has stop byte None. Unless `aligned`, the bounds are approximate, and the worker moves them to the next line starts. Byte offsets are used as index starts in unordered mode: rows are at least 1 byte long, so the index is unique."""
+		if self.workers == 1:
+			return [None]
+
+		parts = max(min(self.workers, self.estimated_rows), 1)
+		with open(self.source, 'rb') as f:
+			header_end = len(f.readline())
+			step = (self.total_bytes - header_end) / parts
+			offsets = [header_end + round(step * i) for i in range(1, parts)]
+			aligned = _has_multiline_values(f.read(ESTIMATE_SAMPLE))
+			if aligned:
+				starts = [header_end] + [pos for pos, rows in _row_starts(f, header_end, offsets)]
+			else:
+				starts = [header_end] + offsets
+
+		starts = [pos for i, pos in enumerate(starts) if pos < self.total_bytes and (i == 0 or pos > starts[i - 1])]
+		stops = starts[1:] + [None]
+		return [(start - header_end, stop and stop - header_end, start, stop, aligned) for start, stop in zip(starts, stops)]
+
+	def _rows_pbar(self):
+		if self._partition is None:
+			return self._pbar(desc=f'bytes of {self.source}', total=self.total_bytes, unit='B')
+
+		start_byte, stop_byte = self._partition[2:4]
+		return self._pbar(desc=f'bytes {start_byte}-{stop_byte or ""} of {self.source}', total=(stop_byte or self.total_bytes) - start_byte, unit='B')
 
 	def _read_sync(self):
-		for geometry in self.geometry_filter_pbar:
-			with open(self.source) as f:
-				self.reader = pd.read_csv(f, chunksize=self.chunk_size, sep=self.sep, engine='c')
+		from erde.io import _decode_geometry
+
+		usecols = None
+		if self.columns is not None:
+			usecols = [c for c in self.columns if c in self.fieldnames]
+			if self.geom_col is not None and self.geom_col not in usecols:
+				usecols.append(self.geom_col)
+
+		for geometry_filter in self.geometry_filter_pbar:
+			with self._open() as f:
+				# progress is tracked by position in the file, compressed files are read by another thread, ahead of the parser
+				position = f.raw.compressed_tell if self.compression else f.tell
+				if self._partition is None:
+					start_byte = 0
+					self.reader = pd.read_csv(f, chunksize=self.chunk_size, sep=self.sep, engine='c', usecols=usecols)
+				else:
+					start_byte, stop_byte, aligned = self._partition[2:]
+					if not aligned:
+						start_byte = _next_row_start(f, start_byte)
+						stop_byte = stop_byte and _next_row_start(f, stop_byte)
+						if start_byte >= self.total_bytes or (stop_byte is not None and start_byte >= stop_byte):
+							continue  # the range is inside one row, which the previous worker reads
+
+						# quoted values come in whole, with even number of quotes, unless a range bound is inside one
+						if _quotes(f, start_byte, stop_byte) % 2:
+							raise ValueError(f"{self.source} has a quoted value with line breaks at byte {start_byte} or {stop_byte or self.total_bytes} (not in the first {ESTIMATE_SAMPLE} bytes, where it would be detected), the file can't be split between workers by line breaks. Read it with workers=1.")
+
+					byte_range = io.BufferedReader(_ByteRange(f, start_byte, stop_byte))
+					self.reader = pd.read_csv(byte_range, chunksize=self.chunk_size, sep=self.sep, engine='c', header=None, names=self.fieldnames, usecols=usecols)
 				self._stopped_iteration = False
 
-				with self._pbar(desc=f'rows in {self.source}', total=self.total_rows) as reader_bar:
+				with self._rows_pbar() as reader_bar:
 					try:
 						while True:
 							data = self.reader.get_chunk()
-							data.index = self._range_index(data)
+							# pandas reads the file in blocks, so the position is a bit ahead of the chunk end
+							reader_bar.update(position() - start_byte - reader_bar.n)
+							if self.where is not None:
+								data = data.query(self.where)
+								if len(data) == 0:
+									continue
 
 							if self.geom_col is None:
+								data.index = self._range_index(data)
 								yield data
-								reader_bar.update(len(data))
 								continue
 
 							try:
-								geom = data[self.geom_col].apply(loads)
-							except shapely.errors.WKTReadingError:
+								geom = _decode_geometry(data[self.geom_col])
+							except ValueError:
 								# ignore bad WKT (might be not wkt at all)
+								data.index = self._range_index(data)
 								yield data
-								reader_bar.update(len(data))
 								continue
 
 							data.pop(self.geom_col)
 							data['geometry'] = geom
 
-							yield gpd.GeoDataFrame(data, crs=self.crs)
-							reader_bar.update(len(data))
+							gdf = self._filter_chunk(gpd.GeoDataFrame(data, crs=self.crs), geometry_filter)
+							if len(gdf) == 0:
+								continue
+
+							gdf.index = self._range_index(gdf)
+							yield gdf
 					except StopIteration:
 						pass
 
 
 class CsvWriter(FileWriterMixin, BaseWriter):
+	"""Writes dataframes to CSV file or text buffer. Columns are taken from the first dataframe, other columns are skipped.
+
+	If the target path ends with `.gz`, `.bz2` or `.zst`, the file is compressed in a background thread (zstd uses all CPU cores).
+
+	Geometry is written as WKT (default), or as hex WKB with `geometry_format='wkb'`, which is much faster to write and read back (CsvReader detects it).
+	"""
 	target_regexp = PATH_REGEXP
 
-	def __init__(self, target, sync:bool=True, **kwargs):
+	def __init__(self, target, sync:bool=True, geometry_format:str='wkt', **kwargs):
+		if geometry_format not in GEOMETRY_FORMATS:
+			raise ValueError(f"geometry_format must be one of: {', '.join(GEOMETRY_FORMATS)}, got '{geometry_format}'")
+
 		super().__init__(target, sync, **kwargs)
 		field_size_limit(10000000)
 		self._file_handler = None
 		self.header = kwargs.get('header', True)
+		self.geometry_format = geometry_format
 
 	def _open_handler(self, df=None):
 		if self._handler is not None:
@@ -87,29 +322,28 @@ class CsvWriter(FileWriterMixin, BaseWriter):
 
 		if df is None:
 			df = pd.DataFrame()
-		from csv import DictWriter
 		from io import TextIOBase
 
 		self.fieldnames = list(df)
 		if isinstance(self.target, str):
-			self._file_handler = open(self.target, 'w')
+			if compression_of(self.target):
+				self._file_handler = open_compressed(self.target, 'w')
+			else:
+				self._file_handler = open(self.target, 'w')
 
 		elif isinstance(self.target, TextIOBase):
 			self._file_handler = self.target
 
-		self._handler = DictWriter(self._file_handler, fieldnames=self.fieldnames, extrasaction='ignore')
+		self._handler = self._file_handler
 		if self.header:
-			self._handler.writeheader()
+			pd.DataFrame(columns=self.fieldnames).to_csv(self._file_handler, index=False)
 
 	def _write_sync(self, df):
 		self._open_handler(df)
 		if 'geometry' in df:
-			wkt = df['geometry'].apply(shapely.wkt.dumps)
-			df = pd.DataFrame(df)
-			df['geometry'] = wkt
+			df = _encode_geometry(df, self.geometry_format)
 
-		self._handler.writerows(df.to_dict(orient='records'))
-		# df.to_csv(self._handler, header=False, index=False)
+		df.reindex(columns=self.fieldnames).to_csv(self._file_handler, header=False, index=False)
 		self._file_handler.flush()
 
 	def _close_handler(self):
@@ -125,14 +359,26 @@ class CsvDriver(BaseDriver):
 	@classmethod
 	def read_df(cls, path, path_match, crs=None, geometry_columns=('geometry', 'WKT'), *args, **kwargs):
 		from erde.io import _try_gdf
-		source_df = pd.read_csv(path, **kwargs)
+		if compression_of(path):
+			with open_compressed(path) as f:
+				source_df = pd.read_csv(f, **kwargs)
+		else:
+			source_df = pd.read_csv(path, **kwargs)
+
 		return _try_gdf(source_df, geometry_columns, crs)
 
 	@classmethod
-	def write_df(cls, df, path, path_match, *args, **kwargs):
+	def write_df(cls, df, path, path_match, *args, geometry_format='wkt', **kwargs):
 		if os.path.exists(path):
 			os.unlink(path)
 
-		df.to_csv(path, index=False)
+		if 'geometry' in df:
+			df = _encode_geometry(df, geometry_format)
+
+		if compression_of(path):
+			with open_compressed(path, 'w') as f:
+				df.to_csv(f, index=False)
+		else:
+			df.to_csv(path, index=False)
 
 driver = CsvDriver
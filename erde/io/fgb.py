@@ -1,32 +1,358 @@
+"""
+FlatGeobuf. The reader parses the file itself (no GDAL): the file is memory-mapped, `geometry_filter` bbox is looked up in the packed Hilbert R-tree, and only the features it points to are decoded, a chunk of geometries at once as WKB.
+"""
 from . import check_path_exists
 from .gpkg import GpkgDriver, GpkgReader, GpkgWriter
 from .base import FileWriterMixin
 import fiona
+import geopandas as gpd
+import numpy as np
+import pandas as pd
 import os
 import re
+import struct
 
 FIONA_DRIVER = 'FlatGeobuf'
 PATH_REGEXP = r'^(?P<file_path>(?:.*/)?(?P<file_own_name>.*)\.(?P<extension>fgb))$'
+ENGINES = ('native', 'fiona')
+
+MAGIC = b'fgb\x03'  # and 'fgb' and patch version byte
+NODE_DTYPE = np.dtype([('minx', '<f8'), ('miny', '<f8'), ('maxx', '<f8'), ('maxy', '<f8'), ('offset', '<u8')])
+POINT, LINESTRING, POLYGON, MULTIPOINT, MULTILINESTRING, MULTIPOLYGON, GEOMETRYCOLLECTION = range(1, 8)  # same codes as WKB
+STRING, JSON, DATETIME, BINARY = 11, 12, 13, 14
+# pandas < 2 has no 'ISO8601' format, it parses ISO strings without format
+DATETIME_FORMAT = 'ISO8601' if int(pd.__version__.split('.')[0]) >= 2 else None
+# struct formats of fixed size column types, by FlatGeobuf ColumnType: Byte, UByte, Bool, Short, UShort, Int, UInt, Long, ULong, Float, Double
+COLUMN_STRUCTS = [struct.Struct(f) for f in ('<b', '<B', '<?', '<h', '<H', '<i', '<I', '<q', '<Q', '<f', '<d')]
+
+_u16 = struct.Struct('<H').unpack_from
+_u32 = struct.Struct('<I').unpack_from
+_i32 = struct.Struct('<i').unpack_from
+
+
+class _Table:
+	"""Flatbuffers table in a buffer. Fields are read by their number in the schema."""
+	__slots__ = ('buf', 'pos', 'vtable', 'vtable_size')
+
+	def __init__(self, buf, pos):
+		self.buf = buf
+		self.pos = pos
+		self.vtable = pos - _i32(buf, pos)[0]
+		self.vtable_size = _u16(buf, self.vtable)[0]
+
+	def _offset(self, field):
+		o = 4 + 2 * field
+		return 0 if o >= self.vtable_size else _u16(self.buf, self.vtable + o)[0]
+
+	def _target(self, field):
+		o = self._offset(field)
+		if o == 0:
+			return None
+
+		return self.pos + o + _u32(self.buf, self.pos + o)[0]
+
+	def scalar(self, field, fmt, default=0):
+		o = self._offset(field)
+		return default if o == 0 else struct.unpack_from(fmt, self.buf, self.pos + o)[0]
+
+	def string(self, field):
+		p = self._target(field)
+		return None if p is None else bytes(self.buf[p + 4:p + 4 + _u32(self.buf, p)[0]]).decode()
+
+	def vector(self, field, dtype):
+		"""Numpy array over the buffer (no copy), or None."""
+		p = self._target(field)
+		return None if p is None else np.frombuffer(self.buf, dtype, _u32(self.buf, p)[0], p + 4)
+
+	def table(self, field):
+		p = self._target(field)
+		return None if p is None else _Table(self.buf, p)
+
+	def tables(self, field):
+		p = self._target(field)
+		if p is None:
+			return []
+
+		return [_Table(self.buf, q + _u32(self.buf, q)[0]) for q in range(p + 4, p + 4 + 4 * _u32(self.buf, p)[0], 4)]
+
+
+def _level_bounds(num_items, node_size):
+	"""Node ranges of packed R-tree levels, from leaves (the last nodes) to the root (node 0)."""
+	n = num_items
+	level_nodes = [n]
+	while True:
+		n = -(-n // node_size)
+		level_nodes.append(n)
+		if n == 1:
+			break
+
+	bounds = []
+	end = sum(level_nodes)
+	for size in level_nodes:
+		bounds.append((end - size, end))
+		end -= size
+
+	return bounds
+
+
+def _wkb_head(geometry_type, has_z):
+	return struct.pack('<BI', 1, geometry_type + (1000 if has_z else 0))
+
+
+def _wkb(geometry, geometry_type, has_z):
+	"""ISO WKB of FlatGeobuf Geometry table, or None if it's empty. Geometry types are stored in each geometry only in heterogeneous layers, otherwise `geometry_type` of the layer is used."""
+	geometry_type = geometry.scalar(6, '<B') or geometry_type
+	head = _wkb_head(geometry_type, has_z)
+	if geometry_type in (MULTIPOLYGON, GEOMETRYCOLLECTION):
+		parts = [_wkb(p, POLYGON if geometry_type == MULTIPOLYGON else 0, has_z) for p in geometry.tables(7)]
+		parts = [p for p in parts if p is not None]
+		return head + struct.pack('<I', len(parts)) + b''.join(parts) if parts else None
+
+	xy = geometry.vector(1, '<f8')
+	if xy is None or len(xy) == 0:
+		return None
+
+	coords = xy.reshape(-1, 2)
+	if has_z:
+		coords = np.column_stack([coords, geometry.vector(2, '<f8')])
+
+	if geometry_type == POINT:
+		return head + coords[0].tobytes()
+
+	if geometry_type == LINESTRING:
+		return head + struct.pack('<I', len(coords)) + coords.tobytes()
+
+	if geometry_type == MULTIPOINT:
+		point_head = _wkb_head(POINT, has_z)
+		return head + struct.pack('<I', len(coords)) + b''.join(point_head + c.tobytes() for c in coords)
+
+	if geometry_type in (POLYGON, MULTILINESTRING):
+		ends = geometry.vector(0, '<u4')
+		rings = [coords] if ends is None or len(ends) < 2 else np.split(coords, ends[:-1].astype(np.int64))
+		ring_head = b'' if geometry_type == POLYGON else _wkb_head(LINESTRING, has_z)
+		return head + struct.pack('<I', len(rings)) + b''.join(ring_head + struct.pack('<I', len(r)) + r.tobytes() for r in rings)
+
+	raise ValueError(f'FlatGeobuf geometry type {geometry_type} is not supported')
+
+
+def _to_datetime(values):
+	"""Parses ISO 8601 strings of DateTime column, as datetime64 (tz-aware if the strings have offsets, in UTC if the offsets differ)."""
+	import warnings
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore', FutureWarning)  # pandas 2 warns about mixed offsets, they're handled below
+		try:
+			result = pd.to_datetime(values, format=DATETIME_FORMAT)
+		except ValueError:  # mixed offsets, in newer pandas
+			result = None
+
+	if result is None or result.dtype == object:  # mixed offsets give datetime objects
+		result = pd.to_datetime(values, format=DATETIME_FORMAT, utc=True)
+
+	return result
+
+
+class FgbFile:
+	"""Memory-mapped FlatGeobuf file: header, spatial index and features decoding."""
+	def __init__(self, path):
+		import mmap
+		with open(path, 'rb') as f:
+			try:
+				self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+			except ValueError:  # empty file
+				self.buf = b''
+
+		if self.buf[:4] != MAGIC:
+			raise RuntimeError(f'{path} is not a FlatGeobuf v3 file')
+
+		header_size = _u32(self.buf, 8)[0]
+		header = _Table(self.buf, 12 + _u32(self.buf, 12)[0])
+		self.geometry_type = header.scalar(2, '<B')
+		self.has_z = header.scalar(3, '<?', False)
+		self.columns = [(c.string(0), c.scalar(1, '<B')) for c in header.tables(7)]
+		self.features_count = header.scalar(8, '<Q')
+		self.node_size = header.scalar(9, '<H', 16)
+		self.crs = self._crs(header.table(10))
+
+		index_start = 12 + header_size
+		self.nodes = None
+		if self.node_size > 0 and self.features_count > 0:
+			self.level_bounds = _level_bounds(self.features_count, self.node_size)
+			self.nodes = np.frombuffer(self.buf, NODE_DTYPE, self.level_bounds[0][1], index_start)
+			index_start += self.nodes.nbytes
+
+		self.features_start = index_start
+
+	@staticmethod
+	def _crs(crs):
+		import pyproj
+		if crs is None:
+			return None
+
+		code, wkt = crs.scalar(1, '<i'), crs.string(4)
+		if code != 0:
+			return pyproj.CRS(f"{crs.string(0) or 'EPSG'}:{code}")
+
+		return None if wkt is None else pyproj.CRS(wkt)
+
+	def offsets(self, numbers=None):
+		"""Positions of the features in the file (all of them, or with `numbers`), in file order. Taken from the index leaves, or found by hopping over feature sizes."""
+		if self.nodes is not None:
+			leaves = self.nodes['offset'][self.level_bounds[0][0]:]
+			return self.features_start + (leaves if numbers is None else leaves[numbers]).astype(np.int64)
+
+		if numbers is not None:
+			return self.offsets()[numbers]
+
+		offsets = []
+		pos, end = self.features_start, len(self.buf)
+		while pos < end:
+			offsets.append(pos)
+			pos += 4 + _u32(self.buf, pos)[0]
+
+		return np.array(offsets, dtype=np.int64)
+
+	def search(self, bounds):
+		"""Numbers of the features whose bboxes intersect `bounds` (sorted), found through the index level by level, or None if the file has no index."""
+		if self.nodes is None:
+			return None
+
+		minx, miny, maxx, maxy = bounds
+		starts = np.zeros(1, dtype=np.int64)
+		for level in range(len(self.level_bounds) - 1, -1, -1):
+			level_start, level_end = self.level_bounds[level]
+			# children of each matched node are node_size nodes in a row (fewer at the end of the level)
+			candidates = (starts[:, None] + np.arange(self.node_size)).ravel()
+			candidates = candidates[candidates < level_end]
+			nodes = self.nodes[candidates]
+			candidates = candidates[(nodes['minx'] <= maxx) & (nodes['miny'] <= maxy) & (nodes['maxx'] >= minx) & (nodes['maxy'] >= miny)]
+			if level == 0:
+				return np.sort(candidates - level_start)
+
+			starts = self.nodes['offset'][candidates].astype(np.int64)
+
+	def read(self, offsets, columns=None):
+		"""Decodes features at `offsets` into GeoDataFrame. Features without geometry are skipped, as fiona does."""
+		names = [name for name, _ in self.columns if columns is None or name in columns]
+		wanted = set(names)
+		buf = self.buf
+		records, wkbs = [], []
+		for pos in offsets.tolist():
+			feature = _Table(buf, pos + 4 + _u32(buf, pos + 4)[0])
+			geometry = feature.table(0)
+			wkb = None if geometry is None else _wkb(geometry, self.geometry_type, self.has_z)
+			if wkb is None:
+				continue
+
+			wkbs.append(wkb)
+			records.append(self._properties(buf, feature, wanted) if wanted else {})
+
+		data = pd.DataFrame.from_records(records, columns=names, nrows=len(records)) if names else pd.DataFrame(index=range(len(records)))
+		for name, kind in self.columns:
+			if kind == DATETIME and name in wanted:
+				data[name] = _to_datetime(data[name])
+
+		return gpd.GeoDataFrame(data, geometry=gpd.GeoSeries.from_wkb(wkbs, crs=self.crs), crs=self.crs)
+
+	def _properties(self, buf, feature, wanted):
+		"""Decodes properties buffer of the feature: column number (uint16) and value, for each set property."""
+		pos = feature._target(1)
+		if pos is None:
+			return {}
+
+		end = pos + 4 + _u32(buf, pos)[0]
+		pos += 4
+		record = {}
+		while pos < end:
+			name, kind = self.columns[_u16(buf, pos)[0]]
+			pos += 2
+			if kind < STRING:
+				st = COLUMN_STRUCTS[kind]
+				value = st.unpack_from(buf, pos)[0]
+				pos += st.size
+			else:
+				size = _u32(buf, pos)[0]
+				value = bytes(buf[pos + 4:pos + 4 + size])
+				pos += 4 + size
+				if kind != BINARY:
+					value = value.decode()
+
+			if name in wanted:
+				record[name] = value
+
+		return record
+
 
 class FgbReader(GpkgReader):
+	"""Reads FlatGeobuf files. With `engine='native'`, the file is parsed directly: features matching `geometry_filter` bbox are found in the packed Hilbert R-tree, and a chunk of them is decoded from the memory-mapped file at once. `columns` skips the other properties, and `where` is applied with `DataFrame.query`. With `workers=N`, each worker reads its own range of features.
+
+	With `engine='fiona'`, the file is read through fiona, and `where` is OGR SQL, as in other OGR formats. By default, the native engine is used, unless there's `where` condition.
+	"""
 	fiona_driver = FIONA_DRIVER
 	source_regexp = PATH_REGEXP
 	layername = None
 
-	def __init__(self, source, geometry_filter=None, chunk_size:int=10_000, sync:bool=False, pbar:bool=True, **kwargs):
+	def __init__(self, source, geometry_filter=None, chunk_size:int=10_000, sync:bool=False, pbar:bool=True, engine:str=None, **kwargs):
 		# this __init__ repeats part of GPKG driver
 		check_path_exists(source)
+		if engine is None:
+			# where is OGR SQL, unless native engine is asked explicitly
+			engine = 'native' if kwargs.get('where') is None else 'fiona'
+
+		if engine not in ENGINES:
+			raise ValueError(f"engine must be one of: {', '.join(ENGINES)}, got '{engine}'")
+
 		super(GpkgReader, self).__init__(source, geometry_filter, chunk_size, sync, pbar, **kwargs)
+		self.engine = engine
+		if engine == 'fiona':
+			try:
+				self._read_schema()
+			except fiona.errors.DriverError as e:
+				raise RuntimeError(*e.args)
 
-		try:
-			self._read_schema()
-		except fiona.errors.DriverError as e:
-			raise RuntimeError(*e.args)
+			return
+
+		fgb = FgbFile(self.source)
+		self.crs = fgb.crs
+		self.fieldnames = [name for name, _ in fgb.columns] + ['geometry']
+		self._check_columns(self.fieldnames)
+		self.total_rows = fgb.features_count or len(fgb.offsets())
+
+	def _read_sync(self):
+		if self.engine == 'fiona':
+			yield from super()._read_sync()
+			return
+
+		fgb = FgbFile(self.source)
+		start, stop = self._partition or (0, None)
+		columns = None if self.columns is None else set(self.columns)
+		for geometry_filter in self.geometry_filter_pbar:
+			numbers = None if geometry_filter is None else fgb.search(geometry_filter.bounds)
+			if numbers is None:
+				selected = fgb.offsets()[start:stop]
+			else:
+				selected = fgb.offsets(numbers[(numbers >= start) & (numbers < (self.total_rows if stop is None else stop))])
+
+			chunk_size = self.chunk_size or max(len(selected), 1)
+			with self._pbar(desc=f'rows in {self.source}', total=len(selected)) as reader_bar:
+				for i in range(0, len(selected), chunk_size):
+					if self.emergency_stop.value: return
+					batch = selected[i:i + chunk_size]
+					gdf = fgb.read(batch, columns)
+					reader_bar.update(len(batch))
+					if self.where is not None:
+						gdf = gdf.query(self.where)
+
+					gdf = self._filter_chunk(gdf, geometry_filter)
+					if len(gdf) == 0: continue
+
+					gdf.index = self._range_index(gdf)
+					yield gdf
 
 
 class FgbWriter(GpkgWriter, FileWriterMixin):
 	fiona_driver = FIONA_DRIVER
 	target_regexp = PATH_REGEXP
+	engine = 'fiona'
 	layername = None
 
 	def __init__(self, target, sync:bool=False, **kwargs):
@@ -42,8 +368,26 @@ class FgbDriver(GpkgDriver):
 	fiona_driver = FIONA_DRIVER
 
 	@classmethod
-	def read_df(cls, path, path_match, crs=None, *args, **kwargs):
-		return cls.gpd_read(path, crs, driver=cls.fiona_driver, *args, **kwargs)
+	def read_df(cls, path, path_match, crs=None, *args, bbox=None, columns=None, **kwargs):
+		"""Reads the file natively, only the features in `bbox` ((minx, miny, maxx, maxy) sequence, geometry or GeoSeries, by the spatial index) and only `columns`. Other options are passed to `geopandas.read_file`."""
+		if args or kwargs:
+			return cls.gpd_read(path, crs, driver=cls.fiona_driver, *args, bbox=bbox, columns=columns, **kwargs)
+
+		fgb = FgbFile(path)
+		numbers = None
+		if bbox is not None:
+			bounds = tuple(float(v) for v in getattr(bbox, 'total_bounds', getattr(bbox, 'bounds', bbox)))
+			numbers = fgb.search(bounds)
+
+		df = fgb.read(fgb.offsets(numbers), None if columns is None else set(columns))
+		if bbox is not None:
+			import shapely
+			df = df[shapely.intersects(np.asarray(df.geometry.values), shapely.box(*bounds))]
+
+		if crs is not None:
+			df.crs = crs
+
+		return df
 
 	@classmethod
 	def write_df(cls, df, path, path_match, *args, driver=None, **kwargs):
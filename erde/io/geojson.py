@@ -27,6 +27,7 @@ class GeoJsonReader(GpkgReader):
 class GeoJsonWriter(GpkgWriter, FileWriterMixin):
 	fiona_driver = FIONA_DRIVER
 	target_regexp = PATH_REGEXP
+	engine = 'fiona'
 	layername = None
 
 	def __init__(self, target, sync:bool=False, **kwargs):
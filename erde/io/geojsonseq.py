@@ -1,17 +1,302 @@
-"""Line-delimited GeoJSON"""
+"""
+Line-delimited GeoJSON (GeoJSONSeq): one feature per line.
+
+By default (`engine='native'`) files are read and written without GDAL. Lines are parsed with orjson (if it's installed, otherwise with json), and the geometries of a chunk are built with one `shapely.from_ragged_array` call per geometry type. The writer encodes properties with `DataFrame.to_json` and geometries with `shapely.to_geojson`, each in one vectorized call. Compressed files (`.geojsonl.gz`, `.bz2`, `.zst`) are (de)compressed in a background thread.
+"""
+from . import check_path_exists
+from .base import FileWriterMixin
+from .compression import PATH_SUFFIX, compression_of, open_compressed
+from .csv import ESTIMATE_SAMPLE, _ByteRange, _next_row_start
 from .geojson import GeoJsonReader, GeoJsonWriter, GeoJsonDriver
+from .gpkg import GpkgReader
+from itertools import accumulate, chain
+import geopandas as gpd
+import io
+import numpy as np
+import os
+import pandas as pd
 
 FIONA_DRIVER = 'GeoJSONSeq'
-PATH_REGEXP = r'^(?P<file_path>(?:.*/)?(?P<file_own_name>.*)\.(?P<extension>geojsonl\.json|geojsonl))$'
+PATH_REGEXP = r'^(?P<file_path>(?:.*/)?(?P<file_own_name>.*)\.(?P<extension>geojsonl\.json|geojsonl)' + PATH_SUFFIX + ')$'
+CRS = 'EPSG:4326'  # GeoJSON coordinates are always WGS84
+ENGINES = ('native', 'fiona')
+# nesting depth of coordinates lists of geometry types, that are built from ragged arrays
+COORDINATES_DEPTH = {'Point': 0, 'LineString': 1, 'MultiPoint': 1, 'Polygon': 2, 'MultiLineString': 2, 'MultiPolygon': 3}
+
+
+def _json():
+	"""Returns (loads, dumps) of orjson, if it's installed, or of json. Both work with bytes."""
+	try:
+		import orjson
+		return orjson.loads, orjson.dumps
+	except ImportError:
+		import json
+		return json.loads, lambda obj: json.dumps(obj).encode()
+
+
+def _offsets(lengths):
+	return np.fromiter(chain((0,), accumulate(lengths)), dtype=np.int64)
+
+
+def _ragged(geometries, geometry_type):
+	"""Builds geometries of one type from their GeoJSON dicts: coordinates lists are flattened into one array and offsets."""
+	import shapely
+	nested = [g['coordinates'] for g in geometries]
+	depth = COORDINATES_DEPTH[geometry_type]
+	if depth == 0:
+		coords = np.array(nested, dtype=np.float64)
+		if coords.ndim != 2:
+			raise ValueError('points with different dimensions')
+
+		return shapely.points(coords)
+
+	offsets = []
+	for _ in range(depth):
+		offsets.append(_offsets(map(len, nested)))
+		nested = list(chain.from_iterable(nested))
+
+	coords = np.array(nested, dtype=np.float64)
+	if coords.ndim != 2:
+		raise ValueError('coordinates with different dimensions')
+
+	return shapely.from_ragged_array(getattr(shapely.GeometryType, geometry_type.upper()), coords, tuple(offsets[::-1]))
+
+
+def _geometries(geometries):
+	"""Makes array of shapely geometries of GeoJSON geometry dicts. Each geometry type is built in one call, empty geometries and collections are parsed by `shapely.from_geojson`."""
+	import shapely
+	_, dumps = _json()
+	result = np.empty(len(geometries), dtype=object)
+	groups = {}
+	for i, g in enumerate(geometries):
+		groups.setdefault(g['type'], []).append(i)
+
+	for geometry_type, rows in groups.items():
+		group = [geometries[i] for i in rows]
+		try:
+			result[rows] = _ragged(group, geometry_type)
+		except (KeyError, ValueError, TypeError):
+			result[rows] = shapely.from_geojson([dumps(g) for g in group])
+
+	return result
+
+
+def _read_features(lines, columns=None):
+	"""Makes GeoDataFrame of GeoJSON features, one per line. Features without geometry are skipped, like fiona does. With `columns`, other properties are dropped."""
+	loads, _ = _json()
+	features = [loads(line) for line in lines if line.strip()]
+	features = [f for f in features if f.get('geometry') is not None]
+	properties = [f.get('properties') or {} for f in features]
+	if columns is not None:
+		properties = [{k: v for k, v in p.items() if k in columns} for p in properties]
+
+	df = pd.DataFrame.from_records(properties, nrows=len(properties)) if len(features) else pd.DataFrame()
+	geometry = gpd.GeoSeries(_geometries([f['geometry'] for f in features]), crs=CRS)
+	return gpd.GeoDataFrame(df, geometry=geometry, crs=CRS)
+
+
+def _dump_features(df):
+	"""Returns GeoJSON features of the dataframe rows as one text, a line per feature. Properties are encoded by pandas, and geometries by shapely, in one vectorized call each."""
+	import shapely
+	if df.crs is not None and not df.crs.equals(CRS):
+		df = df.to_crs(CRS)
+
+	geometries = shapely.to_geojson(np.asarray(df.geometry.values))
+	properties = pd.DataFrame(df.drop(columns=df.geometry.name))
+	if len(properties.columns) > 0:
+		# JSON strings can't have raw line breaks, so lines are records
+		properties = properties.to_json(orient='records', lines=True, date_format='iso', force_ascii=False, default_handler=str).rstrip('\n').split('\n')
+	else:
+		properties = ['{}'] * len(df)
+
+	return ''.join(f'{{"type": "Feature", "properties": {p}, "geometry": {"null" if g is None else g}}}\n' for p, g in zip(properties, geometries))
+
 
 class GeoJsonSeqReader(GeoJsonReader):
+	"""Reads GeoJSONSeq files. With `engine='native'`, chunks of lines are parsed as JSON directly (see module docs), `columns` drops the other properties and `where` is applied with `DataFrame.query`. Rows are counted only if `len()` is called, `estimated_rows` is taken from the size of the first lines. Compressed files are read natively only.
+
+	With `workers=N`, the file is split into N equal byte ranges, each parsed in its own process (not for compressed files). Each worker moves its range bounds to the next line starts (JSON strings can't have raw line breaks), so the file is not scanned beforehand. In unordered mode, the index of each range starts from its start byte, so it's unique, but not continuous.
+
+	With `engine='fiona'`, the file is read through GDAL GeoJSONSeq driver, and `where` is OGR SQL, as in other OGR formats. By default, the native engine is used, unless there's `where` condition. Compressed files with `where` need `engine='native'` explicitly (the condition is a pandas query then).
+	"""
 	fiona_driver = FIONA_DRIVER
 	source_regexp = PATH_REGEXP
+	can_partition = True
+	compression = None
+	_total_rows = None
+
+	def __init__(self, source, geometry_filter=None, chunk_size:int=10_000, sync:bool=False, pbar:bool=True, engine:str=None, **kwargs):
+		self.compression = compression_of(source)
+		if engine is None:
+			# where is OGR SQL, unless native engine is asked explicitly
+			if kwargs.get('where') is not None and self.compression:
+				raise ValueError(f"compressed file {source} can be read only with native engine, where OGR SQL can't be applied; to filter it with pandas query, pass engine='native'")
+
+			engine = 'native' if kwargs.get('where') is None else 'fiona'
+
+		if engine not in ENGINES:
+			raise ValueError(f"engine must be one of: {', '.join(ENGINES)}, got '{engine}'")
+
+		self.engine = engine
+		if engine == 'fiona':
+			if self.compression:
+				raise ValueError(f'compressed file {source} can be read only with native engine')
+
+			super().__init__(source, geometry_filter, chunk_size, sync, pbar, **kwargs)
+			return
+
+		check_path_exists(source)
+		super(GpkgReader, self).__init__(source, geometry_filter, chunk_size, sync, pbar, **kwargs)
+		if self.compression and self.workers > 1:
+			raise ValueError(f'compressed file {source} can\'t be read with several workers')
+
+		with self._open() as f:
+			first = _read_features([f.readline()])
+
+		self.crs = first.crs
+		self.fieldnames = list(first)
+		self._check_columns(self.fieldnames)
+		self.schema = {'properties': {k: first[k].dtype for k in self.fieldnames if k != 'geometry'}, 'geometry': first.geom_type.iloc[0] if len(first) else None}
+		self.total_bytes = os.path.getsize(self.source)
+
+	def _open(self):
+		if self.compression:
+			return open_compressed(self.source)
+
+		return open(self.source, 'rb')
+
+	@property
+	def total_rows(self):
+		if self._total_rows is None and self.engine == 'native':
+			with self._open() as f:
+				self._total_rows = sum(1 for line in f if line.strip())
+
+		return self._total_rows
+
+	@total_rows.setter
+	def total_rows(self, value):
+		self._total_rows = value
+
+	@property
+	def estimated_rows(self):
+		"""Number of rows estimated by the file size and the average length of lines in its first megabyte. Exact if the file is smaller, or if rows were already counted, compressed files are counted."""
+		if self._total_rows is not None or self.compression or self.engine == 'fiona':
+			return self.total_rows
+
+		with open(self.source, 'rb') as f:
+			sample = f.read(ESTIMATE_SAMPLE)
+
+		if len(sample) >= self.total_bytes:
+			return self.total_rows
+
+		sample = sample[:sample.rfind(b'\n') + 1]
+		rows = sum(1 for line in sample.splitlines() if line.strip())
+		return round(self.total_bytes * rows / len(sample)) if rows else self.total_rows
+
+	def partitions(self):
+		"""Splits the file into `workers` byte ranges (at most one per estimated row): (index start, index stop, start byte, stop byte), the last one has stop byte None. The bounds are approximate, the worker moves them to the next line starts. Byte offsets are used as index starts in unordered mode: lines are at least 1 byte long, so the index is unique."""
+		if self.workers == 1 or self.engine == 'fiona':
+			return super().partitions()
+
+		parts = max(min(self.workers, self.estimated_rows), 1)
+		step = self.total_bytes / parts
+		starts = [round(step * i) for i in range(parts)]
+		return [(start, stop, start, stop) for start, stop in zip(starts, starts[1:] + [None])]
+
+	def _rows_pbar(self):
+		if self.engine == 'fiona':
+			return super()._rows_pbar()
+
+		if self._partition is None:
+			return self._pbar(desc=f'bytes of {self.source}', total=self.total_bytes, unit='B')
+
+		start_byte, stop_byte = self._partition[2:]
+		return self._pbar(desc=f'bytes {start_byte}-{stop_byte or ""} of {self.source}', total=(stop_byte or self.total_bytes) - start_byte, unit='B')
+
+	def _read_sync(self):
+		if self.engine == 'fiona':
+			yield from super()._read_sync()
+			return
+
+		from itertools import islice
+		columns = None if self.columns is None else set(self.columns)
+		for geometry_filter in self.geometry_filter_pbar:
+			with self._open() as f, self._rows_pbar() as reader_bar:
+				# progress is tracked by position in the file, compressed files are read by another thread, ahead of the parser
+				position = f.raw.compressed_tell if self.compression else f.tell
+				start_byte = 0
+				if self._partition is not None:
+					start_byte, stop_byte = self._partition[2:]
+					start_byte = start_byte and _next_row_start(f, start_byte)
+					stop_byte = stop_byte and _next_row_start(f, stop_byte)
+					if start_byte >= self.total_bytes or (stop_byte is not None and start_byte >= stop_byte):
+						continue  # the range is inside one line, which the previous worker reads
+
+					f = io.BufferedReader(_ByteRange(f, start_byte, stop_byte))
+
+				while True:
+					if self.emergency_stop.value: return
+					lines = list(islice(f, self.chunk_size))
+					reader_bar.update(position() - start_byte - reader_bar.n)
+					if len(lines) == 0: break
+
+					gdf = _read_features(lines, columns)
+					if self.where is not None:
+						gdf = gdf.query(self.where)
+
+					gdf = self._filter_chunk(gdf, geometry_filter)
+					if len(gdf) == 0: continue
+
+					gdf.index = self._range_index(gdf)
+					yield gdf
+
 
 class GeoJsonSeqWriter(GeoJsonWriter):
+	"""Writes GeoJSONSeq files. With `engine='native'` (default), features of each chunk are encoded in bulk (see module docs) and written as text. If the path ends with `.gz`, `.bz2` or `.zst`, the file is compressed in a background thread. With `engine='fiona'`, features are written through GDAL."""
 	fiona_driver = FIONA_DRIVER
 	target_regexp = PATH_REGEXP
 
+	def __init__(self, target, sync:bool=False, engine:str='native', **kwargs):
+		if engine not in ENGINES:
+			raise ValueError(f"engine must be one of: {', '.join(ENGINES)}, got '{engine}'")
+
+		super().__init__(target, sync, **kwargs)
+		self.compression = compression_of(target)
+		if engine == 'fiona' and self.compression:
+			raise ValueError(f'compressed file {target} can be written only with native engine')
+
+		self.engine = engine
+
+	def _write_sync(self, df):
+		if self.engine == 'fiona':
+			return super()._write_sync(df)
+
+		if df is None or len(df) == 0:
+			return
+
+		self._open_handler(df)
+		self._handler.write(_dump_features(df))
+
+	def _open_handler(self, df=None):
+		if self.engine == 'fiona':
+			return super()._open_handler(df)
+
+		if self._handler is None:
+			self._handler = open_compressed(self.target, 'w') if self.compression else open(self.target, 'w', encoding='utf-8')
+
+	def _close_handler(self):
+		if self.engine == 'fiona':
+			return super()._close_handler()
+
+		self._open_handler()
+		self._handler.close()
+
+	def _cancel(self):
+		if self.engine == 'fiona':
+			return super()._cancel()
+
+		FileWriterMixin._cancel(self)
+
 
 class GeoJsonSeqDriver(GeoJsonDriver):
 	reader = GeoJsonSeqReader
@@ -19,4 +304,23 @@ class GeoJsonSeqDriver(GeoJsonDriver):
 	path_regexp = PATH_REGEXP
 	fiona_driver = FIONA_DRIVER
 
+	@classmethod
+	def read_df(cls, path, path_match, crs=None, *args, columns=None, **kwargs):
+		"""Reads the whole file natively. With other options (e.g. `bbox`), it's read by `geopandas.read_file`."""
+		if args or kwargs:
+			return super().read_df(path, path_match, crs, *args, columns=columns, **kwargs)
+
+		with (open_compressed(path) if compression_of(path) else open(path, 'rb')) as f:
+			df = _read_features(f, None if columns is None else set(columns))
+
+		if crs is not None:
+			df.crs = crs
+
+		return df
+
+	@classmethod
+	def write_df(cls, df, path, path_match, *args, **kwargs):
+		with GeoJsonSeqWriter(path, sync=True, **kwargs) as wr:
+			wr(df)
+
 driver = GeoJsonSeqDriver
@@ -1,6 +1,7 @@
 from . import check_path_exists
 from .base import BaseDriver, BaseReader, BaseWriter
 from collections import OrderedDict
+from contextlib import closing
 from erde import dprint
 from time import sleep
 import fiona
@@ -11,15 +12,45 @@ import re
 
 FIONA_DRIVER = 'GPKG'
 PATH_REGEXP = r'^(?P<file_path>(?:.*/)?(?P<file_name>(?:.*/)?(?P<file_own_name>.*)\.(?P<extension>gpkg)))(?:\:(?P<layer_name>[a-z0-9_-]+))?$'
+ENGINES = ('fiona', 'pyogrio')
+
+# GDAL config options set while writing in bulk mode: sqlite journal kept in memory, no fsync, 512 MB page cache
+BULK_CONFIG = {'OGR_SQLITE_JOURNAL': 'MEMORY', 'OGR_SQLITE_SYNCHRONOUS': 'OFF', 'OGR_SQLITE_CACHE': '512'}
+RTREE_BATCH = 100_000  # rows read at once to compute bounds for R-tree index
+
+# R-tree index DDL, as GDAL makes it. {t} is table name, {c} geometry column, {i} primary key column
+RTREE_SQL = (
+	'CREATE VIRTUAL TABLE "rtree_{t}_{c}" USING rtree(id, minx, maxx, miny, maxy)',
+	'CREATE TRIGGER "rtree_{t}_{c}_insert" AFTER INSERT ON "{t}" WHEN (new."{c}" NOT NULL AND NOT ST_IsEmpty(NEW."{c}")) BEGIN INSERT OR REPLACE INTO "rtree_{t}_{c}" VALUES (NEW."{i}",ST_MinX(NEW."{c}"), ST_MaxX(NEW."{c}"),ST_MinY(NEW."{c}"), ST_MaxY(NEW."{c}")); END',
+	'CREATE TRIGGER "rtree_{t}_{c}_update1" AFTER UPDATE OF "{c}" ON "{t}" WHEN OLD."{i}" = NEW."{i}" AND (NEW."{c}" NOTNULL AND NOT ST_IsEmpty(NEW."{c}")) BEGIN INSERT OR REPLACE INTO "rtree_{t}_{c}" VALUES (NEW."{i}",ST_MinX(NEW."{c}"), ST_MaxX(NEW."{c}"),ST_MinY(NEW."{c}"), ST_MaxY(NEW."{c}")); END',
+	'CREATE TRIGGER "rtree_{t}_{c}_update2" AFTER UPDATE OF "{c}" ON "{t}" WHEN OLD."{i}" = NEW."{i}" AND (NEW."{c}" ISNULL OR ST_IsEmpty(NEW."{c}")) BEGIN DELETE FROM "rtree_{t}_{c}" WHERE id = OLD."{i}"; END',
+	'CREATE TRIGGER "rtree_{t}_{c}_update3" AFTER UPDATE ON "{t}" WHEN OLD."{i}" != NEW."{i}" AND (NEW."{c}" NOTNULL AND NOT ST_IsEmpty(NEW."{c}")) BEGIN DELETE FROM "rtree_{t}_{c}" WHERE id = OLD."{i}"; INSERT OR REPLACE INTO "rtree_{t}_{c}" VALUES (NEW."{i}",ST_MinX(NEW."{c}"), ST_MaxX(NEW."{c}"),ST_MinY(NEW."{c}"), ST_MaxY(NEW."{c}")); END',
+	'CREATE TRIGGER "rtree_{t}_{c}_update4" AFTER UPDATE ON "{t}" WHEN OLD."{i}" != NEW."{i}" AND (NEW."{c}" ISNULL OR ST_IsEmpty(NEW."{c}")) BEGIN DELETE FROM "rtree_{t}_{c}" WHERE id IN (OLD."{i}", NEW."{i}"); END',
+	'CREATE TRIGGER "rtree_{t}_{c}_delete" AFTER DELETE ON "{t}" WHEN old."{c}" NOT NULL BEGIN DELETE FROM "rtree_{t}_{c}" WHERE id = OLD."{i}"; END',
+	'CREATE TABLE IF NOT EXISTS gpkg_extensions (table_name TEXT,column_name TEXT,extension_name TEXT NOT NULL,definition TEXT NOT NULL,scope TEXT NOT NULL,CONSTRAINT ge_tce UNIQUE (table_name, column_name, extension_name))',
+	"INSERT INTO gpkg_extensions (table_name, column_name, extension_name, definition, scope) VALUES ('{t}', '{c}', 'gpkg_rtree_index', 'http://www.geopackage.org/spec120/#extension_rtree', 'write-only')",
+)
 
 
 class GpkgReader(BaseReader):
+	"""Reads GeoPackage layers in chunks.
+
+	With `engine='fiona'` (default) features are read one by one through fiona. With `engine='pyogrio'`, each chunk is read as an Arrow batch, and WKB geometries are decoded in one vectorized call, which is much faster on large layers (requires GDAL >= 3.6 and pyarrow).
+
+	`columns` are passed to OGR as the list of fields to read, and `where` as the attribute filter (OGR SQL, e.g. `"population > 1000"`), with both engines.
+	"""
 	fiona_driver = FIONA_DRIVER
 	source_regexp = PATH_REGEXP
+	engine = 'fiona'
+	can_partition = True
 
-	def __init__(self, source, geometry_filter=None, chunk_size: int = 10_000, sync: bool = False, pbar: bool = True, **kwargs):
+	def __init__(self, source, geometry_filter=None, chunk_size: int = 10_000, sync: bool = False, pbar: bool = True, engine: str = 'fiona', **kwargs):
 		check_path_exists(source)
+		if engine not in ENGINES:
+			raise ValueError(f"engine must be one of: {', '.join(ENGINES)}, got '{engine}'")
+
 		super().__init__(source, geometry_filter, chunk_size, sync, pbar, **kwargs)
+		self.engine = engine
 
 		g = self.source_match.groupdict()
 		self.source = g['file_path']
@@ -56,22 +87,33 @@ class GpkgReader(BaseReader):
 		if self.crs is not None and self.crs != '':
 			self.crs = pyproj.crs.CRS(self.crs)
 		self.fieldnames = list(self.schema['properties']) + ['geometry']
+		self._check_columns(self.fieldnames)
 		self.total_rows = len(tmp_handler)
 		self.bounds = tmp_handler.bounds
 
 	def _read_sync(self):
 		# works in background process. memory not shared with the main
+		if self.engine == 'pyogrio':
+			yield from self._read_arrow()
+			return
+
 		import fiona
 		from shapely.geometry import shape
 
 		# чтение файла через fiona быстрее, чем gpd.read_file с отступом
 		# потому что на больших файлах на каждый кусок приходится пропускать
 		# много строк каждый раз
-		with fiona.open(self.source, layer=self.layername, driver=self.fiona_driver, **self.kwargs) as self._handler:
+		partition = self._attribute_filter(self._partition_filter())
+		rows_slice = (partition.pop('start'), partition.pop('stop')) if 'start' in partition else ()
+		fields = {} if self.columns is None else {'include_fields': self._fields()}
+		# closing() instead of collection's own context manager, which would hold GDAL environment until the generator is closed:
+		# if it's left unfinished and then garbage-collected, the environment is dropped in the middle of some other fiona call
+		with closing(fiona.open(self.source, layer=self.layername, driver=self.fiona_driver, **fields, **self.kwargs)) as self._handler:
 			for geometry_filter in self.geometry_filter_pbar:
 				self._stopped_iteration = False
-				iterator = self._handler.filter(mask=geometry_filter.__geo_interface__ if geometry_filter is not None else None)
-				with self._pbar(desc=f'rows in {self.source}', total=self.total_rows) as reader_bar:
+				# OGR takes the candidates from the spatial index by bbox, exact match is checked for the whole chunk below
+				iterator = self._handler.filter(*rows_slice, bbox=geometry_filter.bounds if geometry_filter is not None else None, **partition)
+				with self._rows_pbar() as reader_bar:
 					while not self._stopped_iteration:
 						if self.emergency_stop.value: return
 
@@ -94,11 +136,102 @@ class GpkgReader(BaseReader):
 
 						if len(rows) == 0: continue
 
-						gdf = gpd.GeoDataFrame(rows, crs=self.crs, index=self._range_index(rows))
+						gdf = self._filter_chunk(gpd.GeoDataFrame(rows, crs=self.crs), geometry_filter)
+						if len(gdf) == 0:
+							reader_bar.update(len(rows))
+							continue
+
+						gdf.index = self._range_index(gdf)
+						if self.emergency_stop.value: return
+						yield gdf
+						reader_bar.update(len(rows))
+
+	def _read_arrow(self):
+		# background process. each chunk comes from GDAL as an Arrow record batch (columnar),
+		# so no per-row dicts and shapes are made, and WKB is decoded for the whole chunk at once
+		from pyogrio.raw import open_arrow
+
+		partition = self._attribute_filter(self._partition_filter())
+		if self.columns is not None:
+			partition['columns'] = self._fields()
+
+		if 'start' in partition:
+			# Arrow stream can skip rows, but can't stop, so the end of the range is cut here
+			partition['skip_features'] = partition.pop('start')
+			stop = partition.pop('stop')
+			rows_limit = None if stop is None else stop - partition['skip_features']
+		else:
+			rows_limit = None
+
+		for geometry_filter in self.geometry_filter_pbar:
+			batch_size = self.chunk_size or max(self.total_rows, 1)
+			# only the bbox goes to OGR (it uses the spatial index), exact match is checked for the whole chunk below
+			bbox = geometry_filter.bounds if geometry_filter is not None else None
+			rows_left = rows_limit
+			with open_arrow(self.source, layer=self.layername, bbox=bbox, batch_size=batch_size, **partition, **self.kwargs) as (meta, batches):
+				geom_col = meta['geometry_name'] or 'wkb_geometry'
+				with self._rows_pbar() as reader_bar:
+					for batch in batches:
+						if self.emergency_stop.value: return
+						if rows_left is not None:
+							if rows_left <= 0: break
+							batch = batch.slice(0, rows_left)
+							rows_left -= batch.num_rows
+
+						data = batch.to_pandas()
+						wkb = data.pop(geom_col)
+						# fiona skips empty geometries, do the same here
+						not_empty = wkb.notna().values
+						if not not_empty.all():
+							data, wkb = data[not_empty], wkb[not_empty]
+
+						if len(data) == 0: continue
+
+						data['geometry'] = gpd.GeoSeries.from_wkb(wkb.values, index=data.index, crs=self.crs)
+						gdf = self._filter_chunk(gpd.GeoDataFrame(data, crs=self.crs), geometry_filter)
+						if len(gdf) == 0: continue
+
+						gdf.index = self._range_index(gdf)
 						if self.emergency_stop.value: return
 						yield gdf
 						reader_bar.update(len(gdf))
 
+	def _fields(self):
+		return [c for c in self.columns if c != 'geometry']
+
+	def _attribute_filter(self, partition):
+		"""Adds `where` condition to the partition filter, if both exist, they're combined."""
+		conditions = [c for c in (self.where, partition.pop('where', None)) if c is not None]
+		if conditions:
+			partition['where'] = ' AND '.join(f'({c})' for c in conditions)
+
+		return partition
+
+	def _partition_filter(self):
+		"""Makes filter parameters to read only rows of `self._partition`. In GeoPackage, the range is turned into a condition on fid (sqlite primary key), so that it's looked up in the table index, instead of skipping all the rows before it. Other formats get `start` and `stop` row numbers."""
+		if self._partition is None:
+			return {}
+
+		start, stop = self._partition
+		if self.fiona_driver != FIONA_DRIVER:
+			return {'start': start, 'stop': stop}
+
+		import sqlite3
+		with closing(sqlite3.connect(self.source)) as conn:
+			fid = next(col[1] for col in conn.execute(f"pragma table_info('{self.layername}')") if col[5])
+
+			def fid_at(offset):
+				row = conn.execute(f'select "{fid}" from "{self.layername}" order by "{fid}" limit 1 offset {offset}').fetchone()
+				return row and row[0]
+
+			start_fid = fid_at(start)
+			stop_fid = None if stop is None else fid_at(stop)
+
+		if start_fid is None:
+			return {'where': '0 = 1'}
+
+		return {'where': f'"{fid}" >= {start_fid}' + ('' if stop_fid is None else f' AND "{fid}" < {stop_fid}')}
+
 	def stats(self):
 		# make sqlite connection and get min, max, avg.
 		import sqlite3
@@ -118,24 +251,41 @@ class GpkgReader(BaseReader):
 
 
 class GpkgWriter(BaseWriter):
+	"""Writes dataframes into a GeoPackage layer.
+
+	With `engine='pyogrio'` (default), each chunk is appended with `pyogrio.write_dataframe`: geometries are turned into WKB and attributes are passed as arrays, and each chunk is written in one transaction. With `engine='fiona'`, chunks are written by fiona record by record, through an open collection.
+
+	With `bulk=True`, the layer is made without spatial index, sqlite is set up for bulk load (see `BULK_CONFIG`), and the R-tree index is made once when the writer is closed, instead of being updated on each insert. The resulting file is the same, but if the process is killed, the file may be corrupt.
+	"""
 	fiona_driver = FIONA_DRIVER
 	target_regexp = PATH_REGEXP
+	engine = 'pyogrio'
+	bulk = False
+	_layer_created = False
 
-	def __init__(self, target, sync: bool = False, **kwargs):
+	def __init__(self, target, sync: bool = False, engine: str = 'pyogrio', bulk: bool = False, **kwargs):
 		gpkg_match = re.match(self.target_regexp, target)
 		if not gpkg_match:
 			raise ValueError(f'filename {target} is not GeoPackage path')
+		if engine not in ENGINES:
+			raise ValueError(f"engine must be one of: {', '.join(ENGINES)}, got '{engine}'")
 
 		super().__init__(target, sync, **kwargs)
 		g = gpkg_match.groupdict()
 		self.target = g['file_path']
 		self.layername = g['layer_name'] or g['file_own_name']
+		self.engine = engine
+		self.bulk = bulk
 
 	def _write_sync(self, df):
 		dprint('gpkg write sync')
 		if df is None or len(df) == 0:
 			return
 
+		if self.engine == 'pyogrio':
+			self._write_columns(df)
+			return
+
 		#dicts_to_json(df, inplace=True)
 		dprint('gpkg write sync made dicts')
 		self._open_handler(df)
@@ -144,7 +294,33 @@ class GpkgWriter(BaseWriter):
 		dprint('gpkg write sync records done')
 		# replace by df.to_file(mode='a') later
 
+	def _write_columns(self, df, **kwargs):
+		import pyogrio
+		# the first chunk creates (or replaces) the layer, the next ones are appended to it
+		dprint(f'gpkg writing {len(df)} records with pyogrio, append={self._layer_created}')
+		if not self.bulk:
+			pyogrio.write_dataframe(df, self.target, layer=self.layername, driver=self.fiona_driver, append=self._layer_created, **kwargs)
+		else:
+			if not self._layer_created:
+				kwargs['layer_options'] = {'SPATIAL_INDEX': 'NO'}
+
+			# config options are global in GDAL, so they're restored after writing
+			old_config = {k: pyogrio.get_gdal_config_option(k) for k in BULK_CONFIG}
+			pyogrio.set_gdal_config_options(BULK_CONFIG)
+			try:
+				pyogrio.write_dataframe(df, self.target, layer=self.layername, driver=self.fiona_driver, append=self._layer_created, **kwargs)
+			finally:
+				pyogrio.set_gdal_config_options(old_config)
+
+		self._layer_created = True
+
 	def _open_handler(self, df=None):
+		if self.engine == 'pyogrio':
+			# nothing to keep open, but the layer must exist even if nothing was written
+			if not self._layer_created:
+				self._write_columns(gpd.GeoDataFrame(geometry=gpd.GeoSeries([])), geometry_type='Point')
+			return
+
 		if self._handler is not None:
 			dprint('gpkg open handler not opening')
 			return
@@ -167,17 +343,70 @@ class GpkgWriter(BaseWriter):
 		if df is not None and df.crs is not None:
 			crs_ = df.crs.to_string()
 		dprint(f'opening fiona handler, target {self.target}')
-		self._handler = fiona.open(self.target, 'w', layer=self.layername, crs=crs_, driver=self.fiona_driver, schema=schema)
+		if self.bulk:
+			with fiona.Env(**BULK_CONFIG):
+				self._handler = fiona.open(self.target, 'w', layer=self.layername, crs=crs_, driver=self.fiona_driver, schema=schema, SPATIAL_INDEX='NO')
+		else:
+			self._handler = fiona.open(self.target, 'w', layer=self.layername, crs=crs_, driver=self.fiona_driver, schema=schema)
 
 	def _close_handler(self):
 		dprint('gpkg close handler need to open handler')
 		self._open_handler()
 		dprint('gpkg close handler closing')
-		self._handler.close()
+		if self._handler is not None:
+			self._handler.close()
 		self._handler = None
+		if self.bulk:
+			self._create_spatial_index()
+
+	def _create_spatial_index(self):
+		"""Makes R-tree index of the layer written in bulk mode. The virtual table, triggers and extension record are the same as GDAL makes, and the bounds of all geometries are inserted in one transaction, instead of a trigger call per feature."""
+		import numpy as np
+		import shapely
+		import sqlite3
+
+		dprint('gpkg creating spatial index')
+		with closing(sqlite3.connect(self.target)) as conn:
+			conn.execute('pragma journal_mode = MEMORY')
+			conn.execute('pragma synchronous = OFF')
+			row = conn.execute('select column_name from gpkg_geometry_columns where table_name = ?', (self.layername,)).fetchone()
+			has_index = conn.execute("select count(*) from sqlite_master where type = 'table' and name = 'gpkg_extensions'").fetchone()[0] and \
+				conn.execute("select count(*) from gpkg_extensions where table_name = ? and extension_name = 'gpkg_rtree_index'", (self.layername,)).fetchone()[0]
+			if row is None or has_index:
+				return
+
+			geom = row[0]
+			fid = next(col[1] for col in conn.execute(f"pragma table_info('{self.layername}')") if col[5])
+			rtree = f'rtree_{self.layername}_{geom}'
+			with conn:
+				for sql in RTREE_SQL:
+					conn.execute(sql.format(t=self.layername, c=geom, i=fid))
+
+				fids, bounds = [], []
+				rows = conn.execute(f'select "{fid}", "{geom}" from "{self.layername}" where "{geom}" is not null')
+				while True:
+					batch = rows.fetchmany(RTREE_BATCH)
+					if len(batch) == 0: break
+
+					batch_fids, blobs = zip(*batch)
+					batch_bounds = shapely.bounds(shapely.from_wkb([_gpkg_wkb(b) for b in blobs]))
+					# empty geometries are not indexed
+					not_empty = ~np.isnan(batch_bounds[:, 0])
+					fids.append(np.array(batch_fids, dtype=np.int64)[not_empty])
+					bounds.append(batch_bounds[not_empty])
+
+				if len(fids) == 0:
+					return  # no geometries, the index stays empty
+
+				# rows sorted along x make a tighter tree and fewer node splits while inserting
+				fids, bounds = np.concatenate(fids), np.concatenate(bounds)
+				order = np.argsort(bounds[:, 0] + bounds[:, 2], kind='stable')
+				conn.executemany(f'insert into "{rtree}" values (?, ?, ?, ?, ?)', zip(fids[order].tolist(), *bounds[order][:, [0, 2, 1, 3]].T.tolist()))
 
 	def _cancel(self):
 		sleep(0)
+		# the layer is deleted anyway, no need to index it
+		self.bulk = False
 		self._close_handler()
 		dprint('gpkg cancel closed')
 		import fiona
@@ -190,6 +419,16 @@ class GpkgWriter(BaseWriter):
 			os.unlink(self.target)
 
 
+def _gpkg_wkb(blob):
+	"""Cuts WKB geometry out of GeoPackage binary (header with optional envelope + WKB). Returns None for empty geometry."""
+	flags = blob[3]
+	if flags & 0b10000:
+		return None
+
+	envelope_size = (0, 32, 48, 48, 64)[(flags >> 1) & 0b111]
+	return blob[8 + envelope_size:]
+
+
 class GpkgDriver(BaseDriver):
 	reader = GpkgReader
 	writer = GpkgWriter
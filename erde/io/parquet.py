@@ -0,0 +1,329 @@
+"""
+GeoParquet: columnar files, where geometries are stored as WKB, and GeoParquet metadata (geometry columns, crs, bbox) is in the `geo` key of the file metadata.
+
+Requires pyarrow.
+"""
+from . import check_path_exists
+from .base import BaseDriver, BaseReader, BaseWriter, FileWriterMixin
+import geopandas as gpd
+import json
+import numpy as np
+import pandas as pd
+
+PATH_REGEXP = r'^.*\.(parquet|geoparquet)$'
+GEOPARQUET_VERSION = '1.1.0'
+BBOX_COLUMN = 'bbox'  # covering column with bounding box of each row's geometry
+BBOX_FIELDS = ('xmin', 'ymin', 'xmax', 'ymax')
+DEFAULT_CRS = 'OGC:CRS84'  # crs when it's not set in metadata, by GeoParquet spec
+PENDING_ROWS = 100_000  # rows kept in memory by writers, until null columns get types
+
+
+def _geometry_columns(df):
+	return [c for c in df if isinstance(df[c].dtype, gpd.array.GeometryDtype)]
+
+
+def _to_arrow(df, bbox=True):
+	"""Makes Arrow table of the dataframe: geometry columns become WKB, and `bbox` struct column (bounds of the active geometry) is added, unless `bbox=False` or there's such column already."""
+	import pyarrow as pa
+	import shapely
+	geometry_columns = _geometry_columns(df)
+	data = pd.DataFrame(df)
+	for col in geometry_columns:
+		data[col] = shapely.to_wkb(np.asarray(df[col].values))
+
+	table = pa.Table.from_pandas(data, preserve_index=False)
+	if bbox and isinstance(df, gpd.GeoDataFrame) and BBOX_COLUMN not in df:
+		bounds = shapely.bounds(np.asarray(df.geometry.values))
+		# empty and missing geometries have NaN bounds, they're nulls in the file, so that they don't spoil statistics
+		fields = [pa.array(bounds[:, i], mask=np.isnan(bounds[:, i]), type=pa.float64()) for i in range(4)]
+		table = table.append_column(BBOX_COLUMN, pa.StructArray.from_arrays(fields, names=BBOX_FIELDS))
+
+	return table
+
+
+def _geo_metadata(df, bbox_column=False):
+	"""Makes GeoParquet metadata of the dataframe geometry columns, or None if it has no geometry. It's written before the data, so geometry types are not listed (empty list means any types), and the dataset bbox is not set."""
+	geometry_columns = _geometry_columns(df)
+	if not isinstance(df, gpd.GeoDataFrame) or len(geometry_columns) == 0:
+		return None
+
+	columns = {}
+	for col in geometry_columns:
+		crs = df[col].crs
+		columns[col] = {'encoding': 'WKB', 'geometry_types': [], 'crs': None if crs is None else crs.to_json_dict()}
+
+	if bbox_column:
+		columns[df.geometry.name]['covering'] = {'bbox': {f: [BBOX_COLUMN, f] for f in BBOX_FIELDS}}
+
+	return {'version': GEOPARQUET_VERSION, 'primary_column': df.geometry.name, 'columns': columns}
+
+
+def _read_geo_metadata(schema):
+	"""Returns `geo` metadata of Arrow schema, or None."""
+	if schema.metadata is None or b'geo' not in schema.metadata:
+		return None
+
+	return json.loads(schema.metadata[b'geo'])
+
+
+def _column_crs(column_meta):
+	import pyproj
+	crs = column_meta.get('crs', DEFAULT_CRS)
+	return crs if crs is None else pyproj.CRS.from_user_input(crs)
+
+
+def _covering_column(geo):
+	"""Name of bbox covering column of the primary geometry, or None."""
+	covering = geo['columns'][geo['primary_column']].get('covering', {}).get('bbox')
+	return covering and covering['xmin'][0]
+
+
+def _to_geodataframe(df, geo, crs=None):
+	"""Decodes WKB geometry columns of pandas dataframe (read from Arrow), each with one vectorized call, and drops the bbox covering column."""
+	import shapely
+	if geo is None:
+		return df
+
+	covering = _covering_column(geo)
+	if covering is not None and covering in df:
+		df = df.drop(columns=covering)
+
+	for col, meta in geo['columns'].items():
+		if col in df:
+			df[col] = gpd.GeoSeries(shapely.from_wkb(df[col].values), index=df.index, crs=_column_crs(meta))
+
+	if geo['primary_column'] not in df:
+		return df
+
+	return gpd.GeoDataFrame(df, geometry=geo['primary_column'])
+
+
+def _bbox_mask(table, covering, bounds):
+	"""Arrow boolean mask of the table rows, whose bbox covering values intersect `bounds`. Rows with null bbox (empty geometries) don't match."""
+	import pyarrow.compute as pc
+	bbox = table[covering]
+	fxmin, fymin, fxmax, fymax = bounds
+	return pc.and_(pc.and_(pc.less_equal(pc.struct_field(bbox, 'xmin'), fxmax), pc.greater_equal(pc.struct_field(bbox, 'xmax'), fxmin)),
+		pc.and_(pc.less_equal(pc.struct_field(bbox, 'ymin'), fymax), pc.greater_equal(pc.struct_field(bbox, 'ymax'), fymin)))
+
+
+def _row_groups_in_bbox(metadata, covering, bounds, row_groups):
+	"""Selects row groups that may have rows in `bounds`, by statistics of bbox covering column. Row groups without statistics are kept."""
+	fxmin, fymin, fxmax, fymax = bounds
+	paths = {f'{covering}.{f}': f for f in BBOX_FIELDS}
+	result = []
+	for i in row_groups:
+		group = metadata.row_group(i)
+		stats = {}
+		for j in range(group.num_columns):
+			column = group.column(j)
+			if column.path_in_schema in paths and column.is_stats_set and column.statistics.has_min_max:
+				stats[paths[column.path_in_schema]] = column.statistics
+
+		if len(stats) == 4 and (stats['xmin'].min > fxmax or stats['ymin'].min > fymax or stats['xmax'].max < fxmin or stats['ymax'].max < fymin):
+			continue
+
+		result.append(i)
+
+	return result
+
+
+class ParquetReader(BaseReader):
+	"""Reads GeoParquet files by record batches of `chunk_size` rows. Only `columns` (and geometry) are read from the file, and `where` is applied to each chunk with `DataFrame.query` before geometries are decoded.
+
+	With `geometry_filter`, row groups are skipped by the statistics of bbox covering column (GeoParquet 1.1, written by `ParquetWriter`), the rows of the other groups are filtered by the bbox values, and only the remaining geometries are decoded and checked exactly. Files without bbox column are read completely.
+
+	With `workers=N`, row groups are split between workers.
+	"""
+	source_regexp = PATH_REGEXP
+	can_partition = True
+
+	def __init__(self, source, geometry_filter=None, chunk_size: int = 10_000, sync: bool = False, pbar: bool = True, **kwargs):
+		import pyarrow.parquet as pq
+		check_path_exists(source)
+		super().__init__(source, geometry_filter, chunk_size, sync, pbar, **kwargs)
+
+		parquet_file = pq.ParquetFile(self.source)
+		self.geo = _read_geo_metadata(parquet_file.schema_arrow)
+		self.covering = None if self.geo is None else _covering_column(self.geo)
+		self.geometry_columns = [] if self.geo is None else list(self.geo['columns'])
+		if self.geo is not None:
+			self.crs = _column_crs(self.geo['columns'][self.geo['primary_column']])
+		elif self.geometry_filter != [None]:
+			raise ValueError(f'{source} has no GeoParquet metadata, can\'t filter it by geometry')
+
+		self.fieldnames = [c for c in parquet_file.schema_arrow.names if c != self.covering]
+		self._check_columns(self.fieldnames)
+		metadata = parquet_file.metadata
+		self.total_rows = metadata.num_rows
+		self.row_group_rows = [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)]
+
+	def partitions(self):
+		"""Splits row groups between workers: (start row, stop row, first row group, stop row group)."""
+		if self.workers == 1:
+			return [None]
+
+		groups = len(self.row_group_rows)
+		bounds = sorted({groups * i // self.workers for i in range(self.workers)})
+		rows = np.cumsum([0] + self.row_group_rows).tolist()
+		stops = bounds[1:] + [groups]
+		return [(rows[a], rows[b] if b < groups else None, a, b) for a, b in zip(bounds, stops)]
+
+	def _rows_pbar(self):
+		if self._partition is None:
+			return self._pbar(desc=f'rows in {self.source}', total=self.total_rows)
+
+		start, stop, *_ = self._partition
+		return self._pbar(desc=f'rows {start}-{stop or ""} in {self.source}', total=(stop or self.total_rows) - start)
+
+	def _read_sync(self):
+		import pyarrow as pa
+		import pyarrow.parquet as pq
+
+		parquet_file = pq.ParquetFile(self.source)
+		row_groups = range(len(self.row_group_rows)) if self._partition is None else range(*self._partition[2:])
+		columns = None
+		if self.columns is not None:
+			columns = [c for c in self.fieldnames if c in self.columns or c in self.geometry_columns]
+
+		for geometry_filter in self.geometry_filter_pbar:
+			bounds = None if geometry_filter is None else geometry_filter.bounds
+			read_columns, groups = columns, list(row_groups)
+			if bounds is not None and self.covering is not None:
+				groups = _row_groups_in_bbox(parquet_file.metadata, self.covering, bounds, groups)
+				if columns is not None:
+					read_columns = columns + [self.covering]
+
+			if len(groups) == 0:
+				continue
+
+			with self._rows_pbar() as reader_bar:
+				for batch in parquet_file.iter_batches(batch_size=self.chunk_size or max(self.total_rows, 1), row_groups=groups, columns=read_columns):
+					if self.emergency_stop.value: return
+					reader_bar.update(batch.num_rows)
+					table = pa.Table.from_batches([batch])
+					if bounds is not None and self.covering is not None:
+						table = table.filter(_bbox_mask(table, self.covering, bounds))
+
+					data = table.to_pandas()
+					if self.where is not None:
+						data = data.query(self.where)
+
+					if len(data) == 0: continue
+
+					gdf = self._filter_chunk(_to_geodataframe(data, self.geo), geometry_filter)
+					if len(gdf) == 0: continue
+
+					gdf.index = self._range_index(gdf)
+					yield gdf
+
+
+def _null_fields(schema):
+	import pyarrow as pa
+	return [f.name for f in schema if pa.types.is_null(f.type)]
+
+
+def _widen_nulls(schema, table):
+	"""Gives the null fields of the schema their types in the table. Other fields and the metadata are kept."""
+	import pyarrow as pa
+	nulls = set(_null_fields(schema))
+	return pa.unify_schemas([schema, pa.schema([f for f in table.schema if f.name in nulls])])
+
+
+class ArrowSchemaMixin:
+	"""Writer of a file with Arrow schema in the header: subclasses make the file with `_new_file(schema)` and append a table with `_write_table(table)`.
+
+	Columns and their types are taken from the first dataframe, but a column without values in it has null type. Then the chunks are kept in memory until other chunks give types to all such columns (or until there are `PENDING_ROWS` rows), and the file is made with these types. Columns that are still null then stay null.
+	"""
+	_pending = None
+
+	def _make_schema(self, df):
+		self.fieldnames = list(df)
+		schema = _to_arrow(df, self.bbox).schema  # types of empty object columns can't be known, so the whole chunk is converted
+		geo = _geo_metadata(df, BBOX_COLUMN in schema.names and BBOX_COLUMN not in self.fieldnames)
+		if geo is not None:
+			schema = schema.with_metadata({**(schema.metadata or {}), b'geo': json.dumps(geo).encode()})
+
+		self.schema = schema
+		self._pending = []
+
+	def _open_handler(self, df=None):
+		if self._handler is not None:
+			return
+
+		if self._pending is None:
+			self._make_schema(df if df is not None else gpd.GeoDataFrame(geometry=gpd.GeoSeries([])))
+
+		self._handler = self._new_file(self.schema)
+		for table in self._pending:
+			self._write_table(table.cast(self.schema))
+		self._pending = []
+
+	def _write_sync(self, df):
+		if df is None or len(df) == 0:
+			return
+
+		if self._pending is None:
+			self._make_schema(df)
+
+		table = _to_arrow(df.reindex(columns=self.fieldnames), self.bbox).select(self.schema.names)
+		if self._handler is not None:
+			self._write_table(table.cast(self.schema))
+			return
+
+		self.schema = _widen_nulls(self.schema, table)
+		self._pending.append(table)
+		if not _null_fields(self.schema) or sum(len(t) for t in self._pending) >= PENDING_ROWS:
+			self._open_handler()
+
+	def _close_handler(self):
+		self._open_handler()
+		self._handler.close()
+
+
+class ParquetWriter(ArrowSchemaMixin, FileWriterMixin, BaseWriter):
+	"""Writes GeoParquet file, one row group per chunk. Geometries are written as WKB, and each row gets bbox of its geometry in `bbox` column, which readers use to skip row groups (GeoParquet 1.1 bbox covering). Columns and their types are taken from the first dataframe, other columns are skipped (columns without values get types from the next chunks, see `ArrowSchemaMixin`).
+
+	GeoParquet metadata (geometry columns, crs and bbox covering) is made by the first dataframe.
+	"""
+	target_regexp = PATH_REGEXP
+
+	def __init__(self, target, sync: bool = False, compression: str = 'snappy', bbox: bool = True, **kwargs):
+		super().__init__(target, sync, **kwargs)
+		self.compression = compression
+		self.bbox = bbox
+
+	def _new_file(self, schema):
+		import pyarrow.parquet as pq
+		return pq.ParquetWriter(self.target, schema, compression=self.compression)
+
+	def _write_table(self, table):
+		self._handler.write_table(table, row_group_size=len(table))
+
+
+class ParquetDriver(BaseDriver):
+	path_regexp = PATH_REGEXP
+	reader = ParquetReader
+	writer = ParquetWriter
+
+	@classmethod
+	def read_df(cls, path, path_match, crs=None, columns=None, *args, **kwargs):
+		import pyarrow.parquet as pq
+		parquet_file = pq.ParquetFile(path)
+		geo = _read_geo_metadata(parquet_file.schema_arrow)
+		if columns is not None and geo is not None:
+			columns = list(columns) + [c for c in geo['columns'] if c not in columns]
+
+		df = _to_geodataframe(parquet_file.read(columns=columns).to_pandas(), geo)
+		if crs is not None:
+			df.crs = crs
+
+		return df
+
+	@classmethod
+	def write_df(cls, df, path, path_match, *args, **kwargs):
+		with ParquetWriter(path, sync=True, **kwargs) as wr:
+			wr(df)
+
+
+driver = ParquetDriver
@@ -0,0 +1,116 @@
+"""
+Shared memory transport of dataframes between background reader/writer processes and the main process.
+
+By default, chunks are put into `multiprocessing.Queue` as they are, which means each dataframe is pickled, sent through a pipe and unpickled, and shapely geometries are pickled one by one. With `transport='shm'`, the dataframe is serialized once into an Arrow IPC buffer in `multiprocessing.shared_memory` (geometries as WKB column), and only a small `ShmChunk` handle goes through the queue.
+
+Requires pyarrow. Dataframes that Arrow can't serialize (e.g. with shapely objects in a non-geometry column) are sent through the queue as usual.
+"""
+
+SHM_TRANSPORT = 'shm'
+QUEUE_TRANSPORT = 'queue'
+TRANSPORTS = (QUEUE_TRANSPORT, SHM_TRANSPORT)
+
+
+class ShmChunk:
+	"""Handle of a dataframe stored in shared memory. Only this object is pickled and sent through the queue."""
+	def __init__(self, name, size, geometry_columns, geometry_name):
+		self.name = name
+		self.size = size
+		self.geometry_columns = geometry_columns  # {column name: crs}
+		self.geometry_name = geometry_name
+
+
+def check_transport(transport):
+	if transport not in TRANSPORTS:
+		raise ValueError(f"transport must be one of: {', '.join(TRANSPORTS)}, got '{transport}'")
+
+	if transport == SHM_TRANSPORT:
+		# the tracker must be started by the main process, otherwise a background process will start its own one,
+		# which will try to unlink the blocks already unlinked by the consumer
+		from multiprocessing import resource_tracker
+		resource_tracker.ensure_running()
+
+
+def dump_chunk(df):
+	"""Writes dataframe to a new shared memory block and returns its `ShmChunk` handle. If Arrow can't serialize the dataframe, returns the dataframe itself."""
+	from geopandas.array import GeometryDtype
+	from multiprocessing.shared_memory import SharedMemory
+	import geopandas as gpd
+	import pandas as pd
+	import pyarrow as pa
+
+	geometry_columns = {k: df[k].crs for k, dtype in df.dtypes.items() if isinstance(dtype, GeometryDtype)}
+	geometry_name = None
+	if isinstance(df, gpd.GeoDataFrame) and df._geometry_column_name in geometry_columns:
+		geometry_name = df._geometry_column_name
+
+	data = pd.DataFrame(df).assign(**{k: df[k].to_wkb() for k in geometry_columns}) if geometry_columns else df
+
+	try:
+		table = pa.Table.from_pandas(data)
+	except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+		return df
+
+	# mock stream only counts bytes, so that the data is serialized once, directly into shared memory
+	mock = pa.MockOutputStream()
+	with pa.ipc.new_stream(mock, table.schema) as writer:
+		writer.write_table(table)
+
+	size = mock.size()
+	shm = SharedMemory(create=True, size=size)
+	try:
+		sink = pa.FixedSizeBufferWriter(pa.py_buffer(shm.buf))
+		with pa.ipc.new_stream(sink, table.schema) as writer:
+			writer.write_table(table)
+		sink.close()
+		del sink, writer
+	except:
+		shm.close()
+		shm.unlink()
+		raise
+
+	shm.close()
+	return ShmChunk(shm.name, size, geometry_columns, geometry_name)
+
+
+def load_chunk(item):
+	"""Reads a dataframe from shared memory and frees the block. Other objects are returned as they are."""
+	if not isinstance(item, ShmChunk):
+		return item
+
+	from multiprocessing.shared_memory import SharedMemory
+	import geopandas as gpd
+	import pyarrow as pa
+
+	shm = SharedMemory(name=item.name)
+	try:
+		# Arrow reads the buffers in place, the only copy is made when columns are converted into pandas blocks
+		with pa.ipc.open_stream(pa.py_buffer(shm.buf)[:item.size]) as reader:
+			df = reader.read_all().to_pandas()
+		del reader
+	finally:
+		shm.close()
+		shm.unlink()
+
+	for k, crs in item.geometry_columns.items():
+		df[k] = gpd.GeoSeries.from_wkb(df[k].values, index=df.index, crs=crs)
+
+	if item.geometry_name is not None:
+		return gpd.GeoDataFrame(df, geometry=item.geometry_name, crs=item.geometry_columns[item.geometry_name])
+
+	return df
+
+
+def release_chunk(item):
+	"""Frees a shared memory block without reading it (e.g. when the queue is drained on emergency stop)."""
+	if not isinstance(item, ShmChunk):
+		return
+
+	from multiprocessing.shared_memory import SharedMemory
+	try:
+		shm = SharedMemory(name=item.name)
+	except FileNotFoundError:
+		return
+
+	shm.close()
+	shm.unlink()
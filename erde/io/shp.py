@@ -26,6 +26,7 @@ class ShpReader(GeoJsonReader):
 class ShpWriter(GeoJsonWriter):
 	fiona_driver = FIONA_DRIVER
 	target_regexp = PATH_REGEXP
+	engine = 'fiona'
 	layername = None
 
 	def __init__(self, target, sync:bool=False, **kwargs):
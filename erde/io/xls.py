@@ -1,20 +1,186 @@
+"""
+Excel workbooks (xlsx), read and written by openpyxl in streaming (read-only and write-only) modes, so that the whole workbook is never held in memory.
+
+Path may have sheet name after colon: `data.xlsx:sheet_name`. Without it, the last sheet is read (as `pd.read_excel` did), and the sheet is named as the file.
+"""
 from . import check_path_exists
-from .base import BaseDriver
-from erde.io import _try_gdf
+from .base import BaseDriver, BaseReader, BaseWriter, FileWriterMixin
+from .csv import _encode_geometry
+from erde.io import _decode_geometry, _try_gdf
+import geopandas as gpd
+import os
 import pandas as pd
+import re
+
+PATH_REGEXP = r'^(?P<path>.*\.xlsx?)(?:\:(?P<sheet>[a-z0-9_-]+))?$'
+GEOMETRY_COLUMNS = ('geometry', 'WKT')
+LONLAT_COLUMNS = (('lon', 'lat'), ('lng', 'lat'), ('longitude', 'latitude'))  # points are made of these columns, if there's no geometry column
+MAX_ROWS = 1_048_576  # rows in Excel sheet, including header
+
+
+def _open_sheet(path, sheet=None):
+	"""Opens workbook in read-only mode, returns (workbook, worksheet). Without sheet name, the last sheet is taken."""
+	import openpyxl
+	workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+	if sheet is None:
+		sheet = workbook.sheetnames[-1]
+	elif sheet not in workbook.sheetnames:
+		workbook.close()
+		raise ValueError(f"sheet {sheet} not found in {path}. Sheets available are: {', '.join(workbook.sheetnames)}")
+
+	return workbook, workbook[sheet]
+
+
+class XlsReader(BaseReader):
+	"""Reads Excel sheets by `chunk_size` rows, iterating the rows in openpyxl read-only mode. The first row is the header.
+
+	If there's `geometry` or `WKT` column (WKT or hex WKB), it's decoded for the whole chunk at once. Otherwise, if there are lon/lat columns (see `LONLAT_COLUMNS`), points are made of them in WGS84. `columns` selects columns after a chunk is made, `where` is applied with `DataFrame.query` before geometries are decoded. Sheets have no spatial index, so `geometry_filter` is checked on each chunk.
+	"""
+	fiona_driver = 'Excel'
+	source_regexp = PATH_REGEXP
+
+	def __init__(self, source, geometry_filter=None, chunk_size: int = 10_000, sync: bool = False, pbar: bool = True, **kwargs):
+		super().__init__(source, geometry_filter, chunk_size, sync, pbar, **kwargs)
+		self.source, self.sheet = self.source_match['path'], self.source_match['sheet']
+		check_path_exists(self.source)
+
+		workbook, worksheet = _open_sheet(self.source, self.sheet)
+		try:
+			self.sheet = worksheet.title
+			header = next(worksheet.iter_rows(max_row=1, values_only=True), ())
+			self.header = [str(c) for c in header]
+			self.total_rows = worksheet.max_row - 1 if worksheet.max_row else None  # from sheet dimensions, which may be missing
+		finally:
+			workbook.close()
+
+		self.geom_col = next((c for c in GEOMETRY_COLUMNS if c in self.header), None)
+		self.lonlat = None
+		if self.geom_col is None:
+			self.lonlat = next(((x, y) for x, y in LONLAT_COLUMNS if x in self.header and y in self.header), None)
+			if self.lonlat is not None:
+				self.crs = 'EPSG:4326'
+
+		self.fieldnames = [c for c in self.header if c != self.geom_col] + (['geometry'] if self.geom_col or self.lonlat else [])
+		self._check_columns(self.fieldnames)
+
+	def _make_chunk(self, rows):
+		df = pd.DataFrame.from_records(rows, columns=self.header).infer_objects()
+		if self.where is not None:
+			df = df.query(self.where)
+
+		if self.geom_col is not None:
+			try:
+				geometry = _decode_geometry(df.pop(self.geom_col))
+			except ValueError:
+				return df
+
+			df = gpd.GeoDataFrame(df, geometry=gpd.GeoSeries(geometry, index=df.index), crs=self.crs)
+		elif self.lonlat is not None:
+			x, y = self.lonlat
+			df = gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(pd.to_numeric(df[x], errors='coerce'), pd.to_numeric(df[y], errors='coerce'), crs=self.crs))
+
+		if self.columns is not None:
+			df = df[[c for c in df if c in self.columns or c == 'geometry']]
+
+		return df
+
+	def _read_sync(self):
+		from itertools import islice
+		for geometry_filter in self.geometry_filter_pbar:
+			workbook, worksheet = _open_sheet(self.source, self.sheet)
+			try:
+				rows = worksheet.iter_rows(min_row=2, values_only=True)
+				with self._rows_pbar() as reader_bar:
+					while True:
+						if self.emergency_stop.value: return
+						chunk = list(islice(rows, self.chunk_size))
+						if len(chunk) == 0: break
+						reader_bar.update(len(chunk))
+
+						df = self._make_chunk(chunk)
+						if isinstance(df, gpd.GeoDataFrame):
+							df = self._filter_chunk(df, geometry_filter)
+						if len(df) == 0: continue
+
+						df.index = self._range_index(df)
+						yield df
+			finally:
+				workbook.close()
+
+
+class XlsWriter(FileWriterMixin, BaseWriter):
+	"""Writes dataframes to an Excel sheet in openpyxl write-only mode: rows are streamed to a temporary file, and the workbook is assembled when the writer is closed. Columns are taken from the first dataframe, other columns are skipped. Geometry is written as WKT in `geometry` column.
+
+	A sheet can't have more than 1 048 576 rows, ValueError is raised if there are more.
+	"""
+	target_regexp = PATH_REGEXP
+
+	def __init__(self, target, sync: bool = False, **kwargs):
+		super().__init__(target, sync, **kwargs)
+		match = re.match(PATH_REGEXP, target)
+		assert match, f'filename {target} is not Excel path'
+		self.target, self.sheet = match['path'], match['sheet'] or os.path.splitext(os.path.basename(match['path']))[0][:31]
+		self.rows = 0
+
+	def _open_handler(self, df=None):
+		if self._handler is not None:
+			return
+
+		import openpyxl
+		if df is None:
+			df = pd.DataFrame()
+
+		self.fieldnames = list(df)
+		self._handler = openpyxl.Workbook(write_only=True)
+		self.worksheet = self._handler.create_sheet(self.sheet)
+		self.worksheet.append(self.fieldnames)
+
+	def _write_sync(self, df):
+		if df is None or len(df) == 0:
+			return
+
+		self._open_handler(df)
+		self.rows += len(df)
+		if self.rows >= MAX_ROWS:
+			raise ValueError(f'Excel sheet can\'t have more than {MAX_ROWS - 1} rows')
+
+		if isinstance(df, gpd.GeoDataFrame):
+			df = _encode_geometry(df)
+
+		df = df.reindex(columns=self.fieldnames).astype(object)
+		for row in df.where(df.notna(), None).itertuples(index=False, name=None):
+			self.worksheet.append(row)
+
+	def _close_handler(self):
+		self._open_handler()
+		if os.path.exists(self.target):
+			os.unlink(self.target)
+
+		self._handler.save(self.target)
+
 
 class XlsDriver(BaseDriver):
-	path_regexp = r'^(?P<path>.*\.xlsx?)(?:\:(?P<sheet>[a-z0-9_-]+))?$'
+	path_regexp = PATH_REGEXP
+	reader = XlsReader
+	writer = XlsWriter
 
 	@classmethod
 	def read_df(cls, path, path_match, *args, **kwargs):
-		check_path_exists(path)
-		path, sheet = path_match['path'], path_match['sheet']
-		excel_dict = pd.read_excel(path, sheet_name=sheet, engine='openpyxl', **kwargs)  # OrderedDict of dataframes
-		return _try_gdf(excel_dict.popitem()[1])  # pop item, last=False, returns (key, value) tuple
+		"""Reads the sheet through `XlsReader`. With other options, it's read by `pd.read_excel`."""
+		if args or kwargs:
+			check_path_exists(path_match['path'])
+			path, sheet = path_match['path'], path_match['sheet']
+			excel = pd.read_excel(path, sheet_name=sheet, engine='openpyxl', **kwargs)  # OrderedDict of dataframes, if sheet is None
+			return _try_gdf(excel.popitem()[1] if isinstance(excel, dict) else excel)  # pop item, last=False, returns (key, value) tuple
+
+		reader = XlsReader(path, chunk_size=None, sync=True, pbar=False)
+		chunks = list(reader)  # one chunk of all the rows
+		return chunks[0] if chunks else pd.DataFrame(columns=reader.fieldnames)
 
 	@classmethod
-	def write_df(cls, df, path, *args, **kwargs):
-		raise NotImplementedError()
+	def write_df(cls, df, path, path_match, *args, **kwargs):
+		with XlsWriter(path, sync=True, **kwargs) as wr:
+			wr(df)
+
 
 driver = XlsDriver
@@ -0,0 +1,154 @@
+"""
+Persistent cache of router responses, so that repeated runs don't request the same routes again. Route responses are stored whole, table responses are stored by cells (source-destination pairs), so that a table request may take some cells from the cache and request only the rest.
+
+The cache is an SQLite file. Entries are keyed by hash of router URL, request params and coordinates rounded to `PRECISION` digits (OSRM polylines have 5, so it makes no difference for table requests).
+"""
+from erde import CONFIG
+import hashlib
+import json
+import os
+import threading
+import time
+
+PRECISION = 6  # digits of coordinates in keys, about 0.1 m
+SCHEMA = """
+create table if not exists entries (
+	key text primary key,
+	value text not null,
+	created real not null,
+	accessed real not null
+);
+create index if not exists entries_accessed on entries (accessed);
+"""
+
+
+def _option(key):
+	return CONFIG.get('cache', {}).get(key)
+
+
+def cache_path(name):
+	"""Path of the cache file. A name without directory and extension is put in CONFIG['cache']['path'] directory."""
+	if os.path.dirname(name) or os.path.splitext(name)[1]:
+		return name
+
+	return os.path.join(os.path.expanduser(_option('path') or '.'), f'{name}.sqlite')
+
+
+def round_coords(coords):
+	"""Rounds sequence of (x, y) to the key precision, as a list of lists, ready for `make_key`."""
+	return [[round(x, PRECISION), round(y, PRECISION)] for x, y, *_ in coords]
+
+
+def make_key(*parts):
+	"""Hash of JSON-serializable parts (dicts are serialized with sorted keys)."""
+	return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class ResponseCache:
+	"""SQLite key-value cache of JSON values, shared by threads of the process.
+
+	Entries older than `ttl` seconds are not returned and are deleted by `evict`. When there are more than `max_entries`, `evict` deletes the least recently read ones. Numbers of hits and misses are counted in `hits` and `misses`.
+
+	Parameters
+	----------
+	name : str
+		Path to SQLite file, or a name of cache in CONFIG['cache']['path'] directory.
+	ttl : float, optional
+		Entry lifetime in seconds. Default is CONFIG['cache']['ttl'], None means forever.
+	max_entries : int, optional
+		Default is CONFIG['cache']['max_entries'], None means unlimited.
+	"""
+	def __init__(self, name, ttl=None, max_entries=None):
+		import sqlite3
+
+		self.path = cache_path(name)
+		self.ttl = ttl if ttl is not None else _option('ttl')
+		self.max_entries = max_entries if max_entries is not None else _option('max_entries')
+		self.hits = self.misses = 0
+
+		if os.path.dirname(self.path):
+			os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+		# one connection used by all threads, serialized by the lock
+		self._lock = threading.Lock()
+		self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+		self._conn.execute('pragma journal_mode=wal')
+		self._conn.execute('pragma synchronous=normal')
+		self._conn.executescript(SCHEMA)
+
+	def __repr__(self):
+		return f'<ResponseCache {self.path}: {self.hits} hits, {self.misses} misses>'
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def close(self):
+		if self._conn is not None:
+			from erde import dprint
+			dprint(self)
+			self.evict()
+			self._conn.close()
+			self._conn = None
+
+	@property
+	def stats(self):
+		return {'hits': self.hits, 'misses': self.misses}
+
+	def _min_created(self, now):
+		return now - self.ttl if self.ttl is not None else float('-inf')
+
+	def get_many(self, keys):
+		"""Returns dict of found values by keys. Missing and expired keys are not in it."""
+		keys = list(keys)
+		now = time.time()
+		result = {}
+		with self._lock:
+			# sqlite has a limit of variables in a statement, hence the batches
+			for i in range(0, len(keys), 500):
+				batch = keys[i:i + 500]
+				marks = ','.join('?' * len(batch))
+				rows = self._conn.execute(f'select key, value from entries where created >= ? and key in ({marks})', (self._min_created(now), *batch)).fetchall()
+				result.update((k, json.loads(v)) for k, v in rows)
+
+			if result:
+				self._conn.execute('begin')
+				self._conn.executemany('update entries set accessed = ? where key = ?', ((now, k) for k in result))
+				self._conn.execute('commit')
+
+			self.hits += len(result)
+			self.misses += len(set(keys)) - len(result)
+
+		return result
+
+	def get(self, key, default=None):
+		return self.get_many([key]).get(key, default)
+
+	def put_many(self, items):
+		"""Stores (key, value) pairs, replacing the old values."""
+		now = time.time()
+		with self._lock:
+			self._conn.execute('begin')
+			self._conn.executemany('insert or replace into entries (key, value, created, accessed) values (?, ?, ?, ?)', ((k, json.dumps(v), now, now) for k, v in items))
+			self._conn.execute('commit')
+
+	def put(self, key, value):
+		self.put_many([(key, value)])
+
+	def evict(self):
+		"""Deletes expired entries, and the least recently read ones above `max_entries`. Returns number of deleted entries."""
+		with self._lock:
+			deleted = 0
+			if self.ttl is not None:
+				deleted += self._conn.execute('delete from entries where created < ?', (self._min_created(time.time()),)).rowcount
+
+			if self.max_entries is not None:
+				deleted += self._conn.execute('delete from entries where key in (select key from entries order by accessed desc limit -1 offset ?)', (self.max_entries,)).rowcount
+
+			return deleted
+
+	def __len__(self):
+		with self._lock:
+			return self._conn.execute('select count(*) from entries').fetchone()[0]
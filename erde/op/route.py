@@ -4,6 +4,9 @@ import sys
 
 
 ANNOTATIONS = 'duration,distance'
+ENGINES = ('threads', 'async')
+CACHED_CODES = ('Ok', 'NoRoute')  # responses that don't change on retry are cached
+CONNECTION_ERROR_MESSAGE = 'Can\'t connect or decode JSON. Multiple retries were made, if they didn\'t help, there\'s a problem with network, URLs or requests rate (OSRM may stop responding if requested too often)'
 
 
 def raw_route(route, mode, retries=10, **params):
@@ -26,6 +29,20 @@ def raw_route(route, mode, retries=10, **params):
 		Response JSON parsed as dictionary.
 
 	"""
+	url, params = _route_request(route, mode, params)
+	resp = utils.get_retry(url, params, retries)
+	return resp.json()
+
+
+async def raw_route_async(session, route, mode, retries=10, **params):
+	"""Same as `raw_route`, but requests the router through aiohttp session."""
+	url, params = _route_request(route, mode, params)
+	resp = await utils.get_retry_async(session, url, params, retries)
+	return resp.json()
+
+
+def _route_request(route, mode, params):
+	"""Makes URL and params of route request."""
 	host = CONFIG['routers'].get(mode, mode)
 	params = {
 		'overview': 'simplified',
@@ -38,12 +55,10 @@ def raw_route(route, mode, retries=10, **params):
 	}
 
 	coordinates = ';'.join(f'{c[0]},{c[1]}' for c in route.coords)
-	url = f'{host}/route/v1/driving/{coordinates}'
-	resp = utils.get_retry(url, params, retries)
-	return resp.json()
+	return f'{host}/route/v1/driving/{coordinates}', params
 
 
-def route_row(waypoints, mode, overview='simplified', alternatives=1, annotations=ANNOTATIONS, **params):
+def route_row(waypoints, mode, overview='simplified', alternatives=1, annotations=ANNOTATIONS, cache=None, **params):
 	"""Routes a row from dataframe or a LineString and outputs the path as a list of dicts that can be turned into GeoDataFrame.
 
 	Parameters
@@ -60,6 +75,8 @@ def route_row(waypoints, mode, overview='simplified', alternatives=1, annotation
 		Number of alternative routes to return.
 	annotations : string, default 'duration'.
 		Additional metadata for each route coordinate. Possible values (may be multiple separated by comma): true, false, nodes, distance, duration, datasources, weight, speed.
+	cache : erde.op.cache.ResponseCache, optional
+		Responses cache. Cached responses are used instead of requests, and new responses are stored in it.
 	**params : keyword arguments
 		Parameters to URL (e.g. 'exclude').
 
@@ -69,45 +86,24 @@ def route_row(waypoints, mode, overview='simplified', alternatives=1, annotation
 		Each list item is alternative route (by default there's 1), each dictionary contains the original extra items from waypoints, plus the main route data: duration (sec), geometry (LineString), distance (m), nodes (list of nodes) if annotations contain 'nodes'.
 
 	"""
-	from shapely.geometry import LineString
 	from time import sleep
 	import requests
-	import pandas as pd
-
-	metadata = waypoints.to_dict() if isinstance(waypoints, pd.Series) else {'geometry': waypoints}
-	route_line = metadata.pop('geometry')
 
+	metadata, route_line = _split_waypoints(waypoints)
 	try:
 		sleep(0) # yield to other threads
-		data = raw_route(route_line, mode, overview=overview, annotations=annotations, alternatives=alternatives, **params)
+		params = {'overview': overview, 'annotations': annotations, 'alternatives': alternatives, **params}
+		key = _cache_key(route_line, mode, params) if cache is not None else None
+		data = cache.get(key) if cache is not None else None
+		if data is None:
+			data = raw_route(route_line, mode, **params)
+			_cache_put(cache, key, data)
 		sleep(0)
-
-		result = []
-		for alt, route in enumerate(data.get('routes', [])[:alternatives], start=1):
-			route_geom = route_line if overview in (False, 'false', 'False') else LineString(utils.decode_poly(route['geometry']))
-			route_result = {
-				**metadata,
-				'alternative': alt,
-				'duration': route['duration'],
-				'distance': route['distance'],
-				'geometry': route_geom
-			}
-
-			if overview == 'full' and 'nodes' in annotations:
-				nds = []
-				for leg in route['legs']:
-					n = leg['annotation']['nodes']
-					# annotations always have start-end edges fully,
-					# even when waypoint projects on a node (a corner), the edge before or after is repeated in adjacent legs
-					nds.extend(n[2:] if n[:2] == nds[-2:] else n)
-				route_result['nodes'] = nds
-			result.append(route_result)
-		sleep(0)
-		return result
+		return _route_result(data, metadata, route_line, overview, alternatives, annotations)
 	except (requests.exceptions.ConnectionError, requests.exceptions.ConnectTimeout, requests.models.complexjson.JSONDecodeError):
 		# if with all multiple retries things don't work, something is wrong,
 		# no point to suppress the requests further
-		print('Can\'t connect or decode JSON. Multiple retries were made, if they didn\'t help, there\'s a problem with network, URLs or requests rate (OSRM may stop responding if requested too often)', file=sys.stderr)
+		print(CONNECTION_ERROR_MESSAGE, file=sys.stderr)
 		raise
 		# how to mark it as not-connected?
 	except:
@@ -115,18 +111,107 @@ def route_row(waypoints, mode, overview='simplified', alternatives=1, annotation
 		raise
 
 
+async def route_row_async(session, waypoints, mode, overview='simplified', alternatives=1, annotations=ANNOTATIONS, cache=None, **params):
+	"""Same as `route_row`, but requests the router through aiohttp session. Used by `engine='async'`."""
+	import aiohttp
+	import asyncio
+	import json
+
+	metadata, route_line = _split_waypoints(waypoints)
+	try:
+		params = {'overview': overview, 'annotations': annotations, 'alternatives': alternatives, **params}
+		key = _cache_key(route_line, mode, params) if cache is not None else None
+		data = cache.get(key) if cache is not None else None
+		if data is None:
+			data = await raw_route_async(session, route_line, mode, **params)
+			_cache_put(cache, key, data)
+		return _route_result(data, metadata, route_line, overview, alternatives, annotations)
+	except (aiohttp.ClientConnectionError, asyncio.TimeoutError, json.JSONDecodeError):
+		print(CONNECTION_ERROR_MESSAGE, file=sys.stderr)
+		raise
+
+
+def _cache_key(route_line, mode, params):
+	from .cache import make_key, round_coords
+	params = {k: v for k, v in params.items() if k != 'retries'}
+	return make_key('route', CONFIG['routers'].get(mode, mode), round_coords(route_line.coords), params)
+
+
+def _cache_put(cache, key, data):
+	if cache is not None and data.get('code') in CACHED_CODES:
+		cache.put(key, data)
+
+
+def _split_waypoints(waypoints):
+	"""Returns (extra columns dict, route line) of route_row input."""
+	import pandas as pd
+	metadata = waypoints.to_dict() if isinstance(waypoints, pd.Series) else {'geometry': waypoints}
+	route_line = metadata.pop('geometry')
+	return metadata, route_line
+
+
+def _route_result(data, metadata, route_line, overview, alternatives, annotations):
+	"""Makes route_row result items of the router response."""
+	from shapely.geometry import LineString
+
+	result = []
+	for alt, route in enumerate(data.get('routes', [])[:alternatives], start=1):
+		route_geom = route_line if overview in (False, 'false', 'False') else LineString(utils.decode_poly(route['geometry']))
+		route_result = {
+			**metadata,
+			'alternative': alt,
+			'duration': route['duration'],
+			'distance': route['distance'],
+			'geometry': route_geom
+		}
+
+		if overview == 'full' and 'nodes' in annotations:
+			nds = []
+			for leg in route['legs']:
+				n = leg['annotation']['nodes']
+				# annotations always have start-end edges fully,
+				# even when waypoint projects on a node (a corner), the edge before or after is repeated in adjacent legs
+				nds.extend(n[2:] if n[:2] == nds[-2:] else n)
+			route_result['nodes'] = nds
+		result.append(route_result)
+
+	return result
+
+
 @autocli
-def main(input_data: read_stream, mode, overview='full', annotations=ANNOTATIONS, alternatives:int=1, threads:int=10, retries=10) -> write_stream:
+def main(input_data: read_stream, mode, overview='full', annotations=ANNOTATIONS, alternatives:int=1, threads:int=10, retries=10, timeout:float=None, engine='threads', concurrency:int=100, cache_name=None) -> write_stream:
+	"""Routes each row of input data through its waypoints (LineString geometries).
+
+	With `engine='threads'` (default), requests are made by `threads` threads. With `engine='async'`, they're made by one asyncio event loop (requires aiohttp), with up to `concurrency` requests in flight.
+
+	With `cache_name` (path to SQLite file or a name in CONFIG['cache']['path']), responses are cached, and the cached routes are not requested again.
+	"""
+	from contextlib import ExitStack
 	import functools
 	import itertools
 
-	fn = functools.partial(route_row, mode=mode, overview=overview, annotations=annotations, alternatives=alternatives, retries=retries)
+	if engine not in ENGINES:
+		raise ValueError(f"engine must be one of: {', '.join(ENGINES)}, got '{engine}'")
+
 	rows = (r for i, r in input_data.iterrows())
-	if threads == 1:
-		result = map(fn, rows)
-	else:
-		from concurrent.futures import ThreadPoolExecutor
-		with ThreadPoolExecutor(max_workers=threads) as tpe:
-			result = tpe.map(fn, rows)
-
-	return gpd.GeoDataFrame(itertools.chain(*result), crs=4326)
+	with ExitStack() as stack:
+		cache = None
+		if cache_name is not None:
+			from .cache import ResponseCache
+			cache = stack.enter_context(ResponseCache(cache_name))
+
+		if engine == 'async':
+			utils.setup_http(timeout=timeout)
+			fn = functools.partial(route_row_async, mode=mode, overview=overview, annotations=annotations, alternatives=alternatives, retries=retries, cache=cache)
+			return gpd.GeoDataFrame(itertools.chain(*utils.map_async(fn, rows, concurrency)), crs=4326)
+
+		# threads share keep-alive connections to the router, one per thread
+		utils.setup_http(pool_size=threads, timeout=timeout)
+		fn = functools.partial(route_row, mode=mode, overview=overview, annotations=annotations, alternatives=alternatives, retries=retries, cache=cache)
+		if threads == 1:
+			result = map(fn, rows)
+		else:
+			from concurrent.futures import ThreadPoolExecutor
+			result = stack.enter_context(ThreadPoolExecutor(max_workers=threads)).map(fn, rows)
+
+		return gpd.GeoDataFrame(itertools.chain(*result), crs=4326)
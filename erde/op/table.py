@@ -1,13 +1,24 @@
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
 from erde import CONFIG, autocli, write_stream, utils
 from functools import partial
-from itertools import product
+from itertools import chain
 
 from yaargh import CommandError
 import geopandas as gpd
+import numpy as np
 import pandas as pd
 import urllib
 
+ENGINES = ('process', 'async')
+
+
+class RequestTooLarge(RuntimeError):
+	"""The router refused a table request as too large: either the URL is too long (`kind='url'`, HTTP 413/414), or the table has too many cells (`kind='cells'`, OSRM TooBig error)."""
+	def __init__(self, message, kind):
+		super().__init__(message)
+		self.kind = kind
+
 
 def _tolist(data, name='sources'):
 	"""Extracts list of Points from list/df with geometries/list, so that table_route could accept any kind of data."""
@@ -51,7 +62,20 @@ def _route_chunk(data, host_url, annotations='duration', retries=10, extra_param
 		Additional params. See https://github.com/Project-OSRM/osrm-backend/blob/master/docs/http.md#table-service
 
 	"""
-	# offsets are used to make correct indice of the result dataframe
+	encoded_url = _chunk_url(data, host_url, annotations, extra_params)
+	resp = utils.get_retry(encoded_url, {}, retries)
+	return _chunk_result(data, resp, annotations)
+
+
+async def _route_chunk_async(session, data, host_url, annotations='duration', retries=10, extra_params=None):
+	"""Same as `_route_chunk`, but requests the router through aiohttp session. For internal use."""
+	encoded_url = _chunk_url(data, host_url, annotations, extra_params)
+	resp = await utils.get_retry_async(session, encoded_url, {}, retries)
+	return _chunk_result(data, resp, annotations)
+
+
+def _chunk_url(data, host_url, annotations='duration', extra_params=None):
+	"""Makes encoded URL of table request of the chunk."""
 	from polyline import encode as encode_poly
 
 	sources, destinations, sources_offset, destinations_offset = data
@@ -79,10 +103,26 @@ def _route_chunk(data, host_url, annotations='duration', retries=10, extra_param
 
 	encoded_params = urllib.parse.quote_plus(urllib.parse.urlencode(params))
 	# if we pass url and params separately to requests.get, it will make a malformed URL
-	encoded_url = f'{host_url}/table/v1/driving/polyline({encoded})?{encoded_params}'
-	resp = utils.get_retry(encoded_url, {}, retries)
+	return f'{host_url}/table/v1/driving/polyline({encoded})?{encoded_params}'
+
+
+def _response_code(resp):
+	try:
+		return resp.json().get('code')
+	except Exception:
+		return None
+
+
+def _chunk_result(data, resp, annotations='duration'):
+	"""Checks the router response and makes the DataFrame of chunk results."""
+	# offsets are used to make correct indice of the result dataframe
+	sources, destinations, sources_offset, destinations_offset = data
+	if resp.status_code in (413, 414):
+		raise RequestTooLarge(f'OSRM server responded with {resp.status_code} code, the URL is too long. Content: {resp.content}', 'url')
 
 	if resp.status_code != 200:
+		if _response_code(resp) == 'TooBig':
+			raise RequestTooLarge(f'OSRM server responded that the table is too big. Content: {resp.content}', 'cells')
 		raise RuntimeError(f'OSRM server responded with {resp.status_code} code. Content: {resp.content}')
 
 	resp_data = resp.json()
@@ -112,17 +152,247 @@ def _route_chunk(data, host_url, annotations='duration', retries=10, extra_param
 	result_df['geometry'] = result_df['source'].map({i: g for i, g in enumerate(sources)})
 	result_df['geometry_dest'] = result_df['destination'].map({i: g for i, g in enumerate(destinations)})
 
-	# shift back by the given offset
-	result_df['destination'] = result_df['destination'].astype(int) + destinations_offset
-	result_df['source'] = result_df['source'].astype(int) + sources_offset
+	# shift back by the given offset (or take the positions, if the chunk is made of separate points)
+	result_df['destination'] = _positions(destinations_offset, len(destinations))[result_df['destination'].astype(int).values]
+	result_df['source'] = _positions(sources_offset, len(sources))[result_df['source'].astype(int).values]
 	return result_df
 
 
-def table_route(sources, destinations, router, max_table_size=2_000, threads=10, annotations='duration', pbar=True, cache_name=None, executor='process', extra_params=None):
+def _positions(offset, count):
+	"""Positions of chunk points in the whole sources/destinations list. Offset is the position of the first point, or a list of positions."""
+	if isinstance(offset, int):
+		return np.arange(offset, offset + count)
+	return np.asarray(offset)
+
+
+def _cells_prefix(host_url, annotations, extra_params):
+	"""Common part of cache keys of the table cells."""
+	from .cache import make_key
+	return make_key('table', host_url, annotations, extra_params or {})
+
+
+def _point_keys(points):
+	from .cache import PRECISION
+	return [f'{p.x:.{PRECISION}f},{p.y:.{PRECISION}f}' for p in points]
+
+
+def _cached_chunk(cache, data, prefix, annotations):
+	"""Takes the chunk cells from the cache.
+
+	Returns
+	-------
+	(DataFrame, tuple or None)
+		Dataframe of cached cells (as made by `_route_chunk`), and the chunk data of the sub-matrix to request (rows and columns with missing cells), or None, if all the cells are cached.
+	"""
+	sources, destinations, sources_offset, destinations_offset = data
+	source_keys, destination_keys = _point_keys(sources), _point_keys(destinations)
+	keys = [f'{prefix}|{s}|{d}' for s in source_keys for d in destination_keys]
+	found = cache.get_many(keys)
+	hit = np.array([k in found for k in keys], dtype=bool).reshape(len(sources), len(destinations))
+
+	missing_rows, missing_cols = np.flatnonzero(~hit.all(axis=1)), np.flatnonzero(~hit.all(axis=0))
+	# cached cells of the requested sub-matrix are requested again, not to be yielded twice
+	take = hit.copy()
+	take[np.ix_(missing_rows, missing_cols)] = False
+
+	source_positions, destination_positions = _positions(sources_offset, len(sources)), _positions(destinations_offset, len(destinations))
+	columns = ['source', 'destination', *annotations.split(','), 'source_snap', 'destination_snap']
+	records = []
+	for i, j in zip(*np.nonzero(take)):
+		value = found[keys[i * len(destinations) + j]]
+		records.append((source_positions[i], destination_positions[j], *(value[c] for c in columns[2:])))
+
+	cached_df = pd.DataFrame.from_records(records, columns=columns)
+	for c in annotations.split(','):
+		cached_df[c] = cached_df[c].astype(float)
+
+	rows, cols = np.nonzero(take)
+	cached_df['geometry'] = pd.Series([sources[i] for i in rows], dtype=object)
+	cached_df['geometry_dest'] = pd.Series([destinations[j] for j in cols], dtype=object)
+
+	if len(missing_rows) == 0:
+		return cached_df, None
+
+	request = ([sources[i] for i in missing_rows], [destinations[j] for j in missing_cols], source_positions[missing_rows].tolist(), destination_positions[missing_cols].tolist())
+	return cached_df, request
+
+
+def _cache_chunk(cache, df, prefix, annotations):
+	"""Stores the cells of `_route_chunk` result in the cache."""
+	columns = [*annotations.split(','), 'source_snap', 'destination_snap']
+	keys = (f'{prefix}|{s}|{d}' for s, d in zip(_point_keys(df['geometry']), _point_keys(df['geometry_dest'])))
+	values = ({c: v for c, v in zip(columns, row)} for row in df[columns].itertuples(index=False, name=None))
+	cache.put_many(zip(keys, values))
+
+
+def _slice_offset(offset, start, stop):
+	return offset + start if isinstance(offset, int) else offset[start:stop]
+
+
+def _split_chunk(data):
+	"""Splits chunk data in halves by the longer side, or returns None, if it's one cell."""
+	sources, destinations, sources_offset, destinations_offset = data
+	if len(sources) >= len(destinations):
+		if len(sources) == 1:
+			return None
+		h = len(sources) // 2
+		return ((sources[:h], destinations, _slice_offset(sources_offset, 0, h), destinations_offset),
+			(sources[h:], destinations, _slice_offset(sources_offset, h, None), destinations_offset))
+
+	h = len(destinations) // 2
+	return ((sources, destinations[:h], sources_offset, _slice_offset(destinations_offset, 0, h)),
+		(sources, destinations[h:], sources_offset, _slice_offset(destinations_offset, h, None)))
+
+
+def _observation(data, seconds=None, exc=None):
+	"""What `TablePlan.observe` takes: (cells, points, seconds, error), where error is None, 'timeout', 'url' or 'cells'."""
+	sources, destinations = data[:2]
+	error = None if exc is None else getattr(exc, 'kind', 'timeout')
+	return len(sources) * len(destinations), len(sources) + len(destinations), seconds, error
+
+
+def _joined_blocks(data, exc, results):
+	df = pd.concat([df for df, _ in results], ignore_index=True)
+	return df, [_observation(data, exc=exc)] + [o for _, observations in results for o in observations]
+
+
+def _route_block(data, host_url, annotations='duration', retries=10, extra_params=None):
+	"""Routes chunk with `_route_chunk`. If the router refuses it as too large, or doesn't respond in time, the chunk is split in halves, which are routed the same way.
+
+	Returns
+	-------
+	(DataFrame, list of observations for `TablePlan.observe`)
+	"""
+	from time import perf_counter
+	import requests
+
+	start = perf_counter()
+	try:
+		df = _route_chunk(data, host_url, annotations, retries, extra_params)
+	except (RequestTooLarge, requests.exceptions.ReadTimeout) as exc:
+		halves = _split_chunk(data)
+		if halves is None:
+			raise
+		return _joined_blocks(data, exc, [_route_block(h, host_url, annotations, retries, extra_params) for h in halves])
+
+	return df, [_observation(data, perf_counter() - start)]
+
+
+async def _route_block_async(session, data, host_url, annotations='duration', retries=10, extra_params=None):
+	"""Same as `_route_block`, but requests the router through aiohttp session, and the halves are requested concurrently."""
+	from time import perf_counter
+	import aiohttp
+	import asyncio
+
+	start = perf_counter()
+	try:
+		df = await _route_chunk_async(session, data, host_url, annotations, retries, extra_params)
+	except (RequestTooLarge, asyncio.TimeoutError) as exc:
+		halves = _split_chunk(data)
+		# connection timeouts are retried by get_retry_async, they're not about the request size
+		if halves is None or isinstance(exc, aiohttp.ClientConnectionError):
+			raise
+		results = await asyncio.gather(*(_route_block_async(session, h, host_url, annotations, retries, extra_params) for h in halves))
+		return _joined_blocks(data, exc, results)
+
+	return df, [_observation(data, perf_counter() - start)]
+
+
+def _block_shape(rows, cols, max_cells, max_points):
+	"""Chooses block size (rows, columns) to split rows x cols table into, with at most `max_cells` cells and `max_points` points (rows + columns) in a block.
+
+	Each source is sent once per column of blocks, and each destination is sent once per row of blocks, so the number of points sent for the whole table is minimized: `rows * ceil(cols / c) + cols * ceil(rows / r)`. Without limits by the other side, blocks are near-square. Of equal options, the one with fewer requests is taken.
+	"""
+	max_cells, max_points = max(int(max_cells), 1), max(int(max_points), 2)
+	r = np.arange(1, min(rows, max_cells, max_points - 1) + 1)
+	c = np.minimum(np.minimum(cols, max_cells // r), max_points - r)
+	row_blocks, col_blocks = -(-rows // r), -(-cols // c)
+	points = rows * col_blocks + cols * row_blocks
+	best = np.lexsort((row_blocks * col_blocks, points))[0]
+	return int(r[best]), int(c[best])
+
+
+def _url_points(sources, destinations, host_url, annotations, extra_params, max_url_length):
+	"""Estimates how many points may be in a request with URL not longer than `max_url_length`, by URLs of a sample of points."""
+	if max_url_length is None:
+		return len(sources) + len(destinations)
+
+	sample = (sources[:100], destinations[:100], 0, 0)
+	base = len(_chunk_url((sources[:1], destinations[:1], 0, 0), host_url, annotations, extra_params))
+	sample_points = len(sample[0]) + len(sample[1])
+	# point numbers in larger blocks have more digits, hence +2 bytes
+	per_point = (len(_chunk_url(sample, host_url, annotations, extra_params)) - base) / max(sample_points - 2, 1) + 2
+	return max(int((max_url_length - base) / per_point) + 2, 2)
+
+
+class TablePlan:
+	"""Plans blocks of a table request (rows x cols), adapting their size to the router responses.
+
+	Blocks are cut by bands of rows, with `_block_shape`, so that they have at most `max_table_size` cells and `max_points` points. The results of requests (see `_observation`) change the limits of the next blocks:
+
+	* a too long URL (HTTP 413/414) limits the points to half of the refused block;
+	* OSRM TooBig error limits the cells to half of the refused block;
+	* a timeout halves the cells, but this limit may grow back;
+	* with `target_latency`, blocks are sized to be routed in about that many seconds, by the observed cells per second, but they grow or shrink no more than 2 times at once, and never above the limits.
+
+	Parameters
+	----------
+	rows, cols : int
+		Numbers of sources and destinations.
+	max_table_size : int
+	max_points : int, optional
+		Maximum points (sources + destinations) in a request, see `_url_points`.
+	target_latency : float, optional
+		Seconds a request should take.
+	"""
+	def __init__(self, rows, cols, max_table_size, max_points=None, target_latency=None):
+		self.rows, self.cols = rows, cols
+		self.max_cells = max_table_size
+		self.max_points = max_points if max_points is not None else rows + cols
+		self.cells = max_table_size  # current limit of cells, <= max_cells
+		self.target_latency = target_latency
+		self.speed = None  # cells per second, moving average
+
+	@property
+	def shape(self):
+		return _block_shape(self.rows, self.cols, min(self.cells, self.max_cells), self.max_points)
+
+	def blocks(self):
+		"""Yields (start row, stop row, start column, stop column) of the blocks. The size of the next block is taken with the current limits."""
+		row = 0
+		while row < self.rows:
+			stop = min(row + self.shape[0], self.rows)
+			height = stop - row
+			col = 0
+			while col < self.cols:
+				width = max(min(self.cols, min(self.cells, self.max_cells) // height, self.max_points - height), 1)
+				yield row, stop, col, min(col + width, self.cols)
+				col += width
+			row = stop
+
+	def observe(self, observations):
+		for cells, points, seconds, error in observations:
+			if error == 'url':
+				self.max_points = min(self.max_points, max(points // 2, 2))
+			elif error == 'cells':
+				self.max_cells = min(self.max_cells, max(cells // 2, 1))
+			elif error == 'timeout':
+				self.cells = max(min(self.cells, cells // 2), 1)
+			elif self.target_latency is not None and seconds:
+				speed = cells / seconds
+				self.speed = speed if self.speed is None else .7 * self.speed + .3 * speed
+				self.cells = int(min(max(self.speed * self.target_latency, self.cells / 2), self.cells * 2))
+
+			self.cells = max(min(self.cells, self.max_cells), 1)
+
+
+def table_route(sources, destinations, router, max_table_size=2_000, threads=10, annotations='duration', pbar=True, cache_name=None, executor='process', extra_params=None, timeout=None, engine='process', concurrency=100, max_url_length=None, target_latency=10):
 	"""Makes table routes between 2 sets of points (between all pairs of them), splitting requests more or less optimally to fit into max-table-size parameter.
 
 	OSRM may set an arbitrary limit on how many cells the table can have, and deny larger requests. With smaller `max_table_size`, table will be split into more smaller requests, and then the results will be concatenated. If possible, set it on the server to 100_000, this will work much faster.
 
+	The table is split into near-square blocks, so that fewer points are sent in total (see `TablePlan`). Blocks refused by the router as too large (HTTP 413/414, OSRM TooBig) or timed out are split in halves and requested again, and the next blocks are made smaller. Blocks are also sized by the observed latency.
+
 	If sources/destinations have indice, the resulting dataframe will have them too.
 
 	Parameters
@@ -137,6 +407,18 @@ def table_route(sources, destinations, router, max_table_size=2_000, threads=10,
 		maximum number of sources*destinations in a single request.
 	threads : int, default 10
 		Number of threads
+	cache_name : str, optional
+		Path to SQLite file, or a name of cache in CONFIG['cache']['path'] directory, to cache the cells (see `erde.op.cache`). Cached cells are yielded first, and then only the rows and columns with missing cells are requested.
+	timeout : float, optional
+		Seconds to wait for each response. Default is CONFIG['http']['timeout'].
+	engine : string, {'process', 'async'}, default 'process'
+		'process' makes requests in `threads` processes, which also parse the responses. 'async' makes them in one asyncio event loop in this process (requires aiohttp), which suits many small requests to a remote router better.
+	concurrency : int, default 100
+		Maximum number of requests in flight with `engine='async'`.
+	max_url_length : int, optional
+		Maximum length of request URL, e.g. 8192 for a router behind nginx with default settings. By default, the length is limited only after the router refuses a long URL.
+	target_latency : float, default 10
+		Seconds a request should take, blocks are made smaller or larger (up to `max_table_size`) to fit it. None turns it off.
 
 	Yields
 	------
@@ -159,39 +441,95 @@ def table_route(sources, destinations, router, max_table_size=2_000, threads=10,
 	if ann_set & {'duration', 'distance'} != ann_set:
 		raise ValueError("annotations must be one of these: 'duration', 'distance', or 'duration,distance' (order does not matter)")
 
-	mts = max_table_size
-	host_url = CONFIG['routers'].get(router, router)
+	if engine not in ENGINES:
+		raise ValueError(f"engine must be one of: {', '.join(ENGINES)}, got '{engine}'")
 
-	total_rows, total_cols = rows, cols = len(sources), len(destinations)
-	if cols * rows > mts:
-		if rows < cols:
-			# split by sources
-			rows = max(mts // cols, 1)  # max(,1) beacuse if 1 row does not fit, then at least split by 1 row
-			cols = min(mts, cols)
+	host_url = CONFIG['routers'].get(router, router)
+	total_rows, total_cols = len(sources), len(destinations)
+	max_points = _url_points(sources, destinations, host_url, annotations, extra_params, max_url_length)
+	plan = TablePlan(total_rows, total_cols, max_table_size, max_points, target_latency)
+	slices = ((sources[s0:s1], destinations[d0:d1], s0, d0) for s0, s1, d0, d1 in plan.blocks())
+
+	with ExitStack() as stack:
+		t = stack.enter_context(tqdm(total=total_rows * total_cols, desc='Table routing', disable=(not pbar)))
+		cache = None
+		cached_dfs = []
+		if cache_name is not None:
+			# cached cells are yielded as soon as possible, and only the sub-matrices of missing cells are requested
+			from .cache import ResponseCache
+			cache = stack.enter_context(ResponseCache(cache_name))
+			prefix = _cells_prefix(host_url, annotations, extra_params)
+
+			def _lookup(slices):
+				for data in slices:
+					cached_df, data = _cached_chunk(cache, data, prefix, annotations)
+					if len(cached_df) > 0:
+						cached_dfs.append(cached_df)
+					if data is not None:
+						yield data
+
+			slices = _lookup(slices)
+
+		if engine == 'async':
+			utils.setup_http(timeout=timeout)
+			async def _route_async(session, data):
+				try:
+					return await _route_block_async(session, data, host_url=host_url, annotations=annotations, extra_params=extra_params)
+				except Exception as exc:
+					print(f'generated an exception: {exc}')
+
+			results = (r for r in utils.map_async(_route_async, slices, concurrency, ordered=False) if r is not None)
 		else:
-			cols = max(mts // rows, 1)
-			rows = min(mts, rows)
+			_route_partial = partial(_route_block, host_url=host_url, annotations=annotations, extra_params=extra_params)
+			ppe = stack.enter_context(ProcessPoolExecutor(max_workers=threads, initializer=utils.setup_http, initargs=(1, timeout)))
+			# a few blocks per worker are in flight, the next ones are planned after the results
+			results = _completed(ppe, _route_partial, slices, threads * 2)
+
+		# the last empty item yields the cached cells left
+		for df, observations in chain(results, [(None, [])]):
+			plan.observe(observations)
+			if df is not None:
+				if cache is not None:
+					_cache_chunk(cache, df, prefix, annotations)
+				t.update(len(df))
+				yield df
+
+			while cached_dfs:
+				cached_df = cached_dfs.pop(0)
+				t.update(len(cached_df))
+				yield cached_df
+
+			if cache is not None:
+				t.set_postfix(cache.stats)
 
-	_route_partial = partial(_route_chunk, host_url=host_url, annotations=annotations, extra_params=extra_params)
 
-	with tqdm(total=total_rows * total_cols, desc='Table routing', disable=(not pbar)) as t, ProcessPoolExecutor(max_workers=threads) as ppe:
-		combos = list(product(range(0, total_rows, rows), range(0, total_cols, cols)))
-		slices = ((sources[s:s + rows], destinations[d:d + cols], s, d) for s, d in combos)
+def _completed(executor, fn, items, max_pending):
+	"""Submits items to the executor, keeping up to `max_pending` of them in flight, so that the next items are made after the results of the previous ones. Yields the results as they complete, skipping (and printing) exceptions."""
+	from concurrent.futures import FIRST_COMPLETED, wait
 
-		# process/thread/an instance of executor
-		jobs = {ppe.submit(_route_partial, s): s for s in slices}
-		for j in as_completed(jobs):
+	items = iter(items)
+	pending = set()
+	while True:
+		for item in items:
+			pending.add(executor.submit(fn, item))
+			if len(pending) >= max_pending:
+				break
+
+		if not pending:
+			return
+
+		done, pending = wait(pending, return_when=FIRST_COMPLETED)
+		for j in done:
 			try:
-				df = j.result()
+				result = j.result()
 			except Exception as exc:
 				print(f'generated an exception: {exc}')
 			else:
-				t.update(len(df))
-				yield df
+				yield result
 
 
 @autocli
-def main(sources: gpd.GeoDataFrame, destinations: gpd.GeoDataFrame, router, annotations='duration', threads: int = 10, mts: int = 2000, keep_columns=None) -> write_stream:
+def main(sources: gpd.GeoDataFrame, destinations: gpd.GeoDataFrame, router, annotations='duration', threads: int = 10, mts: int = 2000, keep_columns=None, timeout: float = None, engine='process', concurrency: int = 100, cache_name=None, max_url_length: int = None) -> write_stream:
 	"""Makes table route requests between sources and destinations. Outputs the result as a GDF with LineString between each pair.
 
 	Parameters
@@ -208,13 +546,23 @@ def main(sources: gpd.GeoDataFrame, destinations: gpd.GeoDataFrame, router, anno
 		Max table size, i.e. len(sources) * len(destinations). OSRM server handles only requests smaller than a particular amount (set in osrm-routed CLI options), and with this setting requests are split into many.
 	keep_columns : string
 		Comma-separated names of columns to take from sources & destinations GeoDataFrames and put into the result.
+	timeout : float, optional
+		Seconds to wait for each response.
+	engine : string, {'process', 'async'}, default 'process'
+		Run requests in processes, or in asyncio event loop (requires aiohttp).
+	concurrency : int, default 100
+		Maximum number of requests in flight with async engine.
+	cache_name : string, optional
+		SQLite file or cache name, to take the cells from, and to store the new ones.
+	max_url_length : int, optional
+		Maximum length of request URL (e.g. 8192 for nginx defaults).
 
 	Yields
 	------
 	GeoDataFrame
 
 	"""
-	t = table_route(sources['geometry'], destinations['geometry'], router, annotations=annotations, max_table_size=mts, threads=threads)
+	t = table_route(sources['geometry'], destinations['geometry'], router, annotations=annotations, max_table_size=mts, threads=threads, timeout=timeout, engine=engine, concurrency=concurrency, cache_name=cache_name, max_url_length=max_url_length)
 
 	if keep_columns is not None:
 		keep_columns = keep_columns.split(',')
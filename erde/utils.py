@@ -1,6 +1,7 @@
 from shapely.geometry import LineString, Point
 import geopandas as gpd
 import pandas as pd
+import threading
 
 
 def transform(obj, crs_from, crs_to):
@@ -101,8 +102,58 @@ def lonlat2gdf(df):
 	return gpd.GeoDataFrame(df, crs=4326)
 
 
+_sessions = {}  # (process id, scheme://host:port) -> requests.Session
+_sessions_lock = threading.Lock()
+_http_options = {}  # overrides of CONFIG['http'] in this process, see setup_http
+
+
+def setup_http(pool_size=None, timeout=None):
+	"""Sets connection pool size and requests timeout for this process, and drops the sessions made before. Used as executors' initializer, so that each worker process has its own connections.
+
+	Parameters
+	----------
+	pool_size : int, optional
+		Connections kept open per host. Should be not less than the number of threads making requests, otherwise the threads wait for a free connection. Default is CONFIG['http']['pool_size'].
+	timeout : float, optional
+		Seconds to wait for a response. Default is CONFIG['http']['timeout'].
+	"""
+	with _sessions_lock:
+		_http_options.clear()
+		_http_options.update({k: v for k, v in (('pool_size', pool_size), ('timeout', timeout)) if v is not None})
+		_sessions.clear()
+
+
+def _http_option(key):
+	from erde import CONFIG
+	return _http_options.get(key, CONFIG.get('http', {}).get(key))
+
+
+def http_session(url):
+	"""Returns requests.Session for the host of the URL, with a pool of keep-alive connections, shared by all threads of the process. A forked process gets new sessions, and doesn't use the sockets of the parent."""
+	from urllib.parse import urlsplit
+	import os
+	import requests
+
+	parts = urlsplit(url)
+	key = (os.getpid(), f'{parts.scheme}://{parts.netloc}')
+	session = _sessions.get(key)
+	if session is not None:
+		return session
+
+	with _sessions_lock:
+		if key not in _sessions:
+			pool_size = _http_option('pool_size')
+			session = requests.Session()
+			# pool_block: threads wait for a free connection, instead of opening extra ones that are closed after the request
+			adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+			session.mount(key[1], adapter)
+			_sessions[key] = session
+
+		return _sessions[key]
+
+
 def get_retry(url, params, retries=10, timeout=None):
-	"""Requests any URL with GET params, with 10 retries.
+	"""Requests any URL with GET params, with 10 retries. Connections are kept alive and reused through the pooled session of the host (see `http_session`).
 
 	Parameters
 	----------
@@ -111,7 +162,7 @@ def get_retry(url, params, retries=10, timeout=None):
 		GET parameters as dictionary. Values may be lists.
 	retries : int
 	timeout : float, optional
-		Number of seconds to wait, may be less than 1.
+		Number of seconds to wait, may be less than 1. Default is set by `setup_http` or CONFIG['http']['timeout'].
 
 	Returns
 	-------
@@ -121,10 +172,13 @@ def get_retry(url, params, retries=10, timeout=None):
 	from time import sleep
 	import requests
 
+	if timeout is None:
+		timeout = _http_option('timeout')
+
 	for try_num in range(retries + 1):
 		sleep(try_num)
 		try:
-			return requests.get(url, params=params, timeout=timeout)
+			return http_session(url).get(url, params=params, timeout=timeout)
 		except (requests.exceptions.ConnectionError, requests.exceptions.ConnectTimeout):
 			dprint('could not connect', end='')
 			if try_num == retries - 1:
@@ -133,6 +187,102 @@ def get_retry(url, params, retries=10, timeout=None):
 			dprint('retrying', try_num)
 
 
+class AsyncResponse:
+	"""Response of `get_retry_async`, read completely, with the part of requests.Response interface used by the routing ops."""
+	def __init__(self, status_code, content):
+		self.status_code = status_code
+		self.content = content
+
+	def json(self):
+		import json
+		return json.loads(self.content)
+
+
+async def get_retry_async(session, url, params, retries=10, timeout=None):
+	"""Requests any URL with GET params through aiohttp session, with 10 retries, like `get_retry`. The URL must be already encoded.
+
+	Returns
+	-------
+	AsyncResponse object
+	"""
+	from erde import dprint
+	import aiohttp
+	import asyncio
+	import yarl
+
+	if timeout is None:
+		timeout = _http_option('timeout')
+
+	for try_num in range(retries + 1):
+		await asyncio.sleep(try_num)
+		try:
+			async with session.get(yarl.URL(url, encoded=True), params=params or None, timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+				return AsyncResponse(resp.status, await resp.read())
+		except aiohttp.ClientConnectionError:
+			# like get_retry, retries only failed connections, not the responses that timed out
+			dprint('could not connect', end='')
+			if try_num == retries:
+				raise
+
+			dprint('retrying', try_num)
+
+
+def map_async(fn, items, concurrency=100, ordered=True):
+	"""Runs coroutine function `fn(session, item)` for each of the items in an event loop, with up to `concurrency` of them in flight, and yields the results. The items are taken lazily, so they may be a generator. Requires aiohttp.
+
+	Parameters
+	----------
+	fn : coroutine function
+		Takes aiohttp.ClientSession and an item.
+	items : iterable
+	concurrency : int, default 100
+		Maximum number of coroutines running (and connections to a host) at once.
+	ordered : bool, default True
+		Yield results in the order of items. Otherwise, as soon as they're ready.
+	"""
+	import aiohttp
+	import asyncio
+
+	async def make_session():
+		connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=concurrency)
+		return aiohttp.ClientSession(connector=connector)
+
+	loop = asyncio.new_event_loop()
+	session = loop.run_until_complete(make_session())
+	items = enumerate(items)
+	pending = {}  # task -> item number
+	results = {}
+	next_number = 0
+	try:
+		while True:
+			for number, item in items:
+				pending[loop.create_task(fn(session, item))] = number
+				if len(pending) >= concurrency:
+					break
+
+			if not pending:
+				break
+
+			done, _ = loop.run_until_complete(asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED))
+			for task in done:
+				number = pending.pop(task)
+				if not ordered:
+					yield task.result()
+				else:
+					results[number] = task.result()
+
+			while next_number in results:
+				yield results.pop(next_number)
+				next_number += 1
+	finally:
+		for task in pending:
+			task.cancel()
+		if pending:
+			loop.run_until_complete(asyncio.wait(pending))
+		loop.run_until_complete(session.close())
+		loop.close()
+
+
 def lookup(left_df, right_df, column_names, left_on, right_on, suffixes=('', '_right'), how='left'):
 
 	if isinstance(column_names, str):
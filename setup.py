@@ -41,4 +41,5 @@ setup(
 	packages=find_packages(exclude=['tests.py']),
 	entry_points={'console_scripts': ['erde = erde:entrypoint']},
 	install_requires=requirements,
+	extras_require={'async': ['aiohttp']},  # engine='async' of route and table
 )
@@ -0,0 +1,78 @@
+from erde.op import route
+from erde.op.cache import ResponseCache, cache_path, make_key
+from shapely.geometry import LineString
+from unittest import mock
+import time
+
+
+def test_cache_path():
+	with mock.patch.dict('erde.op.cache.CONFIG', {'cache': {'path': '/tmp/erde-cache'}}):
+		assert cache_path('nightly') == '/tmp/erde-cache/nightly.sqlite'
+		assert cache_path('nightly.db') == 'nightly.db'
+		assert cache_path('/var/cache/routes') == '/var/cache/routes'
+
+
+def test_get_put(tmp_path):
+	path = str(tmp_path / 'c.sqlite')
+	with ResponseCache(path) as c:
+		assert c.get('a') is None
+		c.put_many([('a', {'x': 1}), ('b', [1, float('nan')])])
+		assert c.get('a') == {'x': 1}
+		assert c.get_many(['a', 'b', 'c']).keys() == {'a', 'b'}
+		assert c.stats == {'hits': 3, 'misses': 2}
+
+	# persists between runs
+	with ResponseCache(path) as c:
+		assert len(c) == 2
+		assert c.get('a') == {'x': 1}
+
+	assert make_key('a', {'x': 1, 'y': 2}) == make_key('a', {'y': 2, 'x': 1})
+	assert make_key('a', {'x': 1}) != make_key('b', {'x': 1})
+
+
+def test_eviction(tmp_path):
+	path = str(tmp_path / 'c.sqlite')
+	with ResponseCache(path, ttl=0.2) as c:
+		c.put('a', 1)
+		assert c.get('a') == 1
+		time.sleep(0.3)
+		# expired entries are not returned, even before eviction
+		assert c.get('a') is None
+		assert c.evict() == 1
+
+	with ResponseCache(path, max_entries=2) as c:
+		for k in 'abc':
+			c.put(k, k)
+			time.sleep(0.01)
+		c.get('a')  # b is the least recently used now
+
+	with ResponseCache(path) as c:
+		assert len(c) == 2
+		assert c.get('b') is None
+		assert c.get('a') == 'a'
+
+
+def test_route_cache(tmp_path):
+	line = LineString([[83.1019860, 54.8300436], [83.1035095, 54.8306369]])
+	resp = {'code': 'Ok', 'routes': [{'geometry': 'w~smImzezNCDEDGASWKQKUEO[}AGo@Ai@?Y?OMC', 'distance': 133.5, 'duration': 106.8, 'legs': []}]}
+
+	with ResponseCache(str(tmp_path / 'c.sqlite')) as c:
+		m = mock.Mock(return_value=resp)
+		with mock.patch('erde.op.route.raw_route', m):
+			first = route.route_row(line, 'http://localhost', cache=c)
+			assert route.route_row(line, 'http://localhost', cache=c) == first
+			assert m.call_count == 1
+
+			# other params or router make other requests
+			route.route_row(line, 'http://localhost', overview='full', cache=c)
+			route.route_row(line, 'http://localhost:5001', cache=c)
+			assert m.call_count == 3
+
+		assert c.stats == {'hits': 1, 'misses': 3}
+
+		# errors are not cached
+		m = mock.Mock(return_value={'code': 'TooBig', 'message': 'Too many coordinates'})
+		with mock.patch('erde.op.route.raw_route', m):
+			route.route_row(line, 'http://localhost', alternatives=2, cache=c)
+			route.route_row(line, 'http://localhost', alternatives=2, cache=c)
+			assert m.call_count == 2
@@ -0,0 +1,61 @@
+from erde import read_df, read_stream, write_df, write_stream
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+d = 'tests/io/data/'
+
+polygons = read_df(d + 'polygons.gpkg')
+polygons['n'] = np.arange(len(polygons), dtype='float64')
+
+def test_read_write():
+	path = '/tmp/test-arrow.arrow'
+	with write_stream(path) as wr:
+		for i in range(0, len(polygons), 10):
+			wr(polygons[i:i + 10])
+
+	gdf = gpd.read_feather(path)
+	assert gdf.crs == polygons.crs
+	assert list(gdf) == list(polygons)
+
+	df = read_df(path)
+	assert df.crs == polygons.crs
+	assert df.geometry.geom_equals(polygons.geometry).all()
+	assert (df['n'] == polygons['n']).all()
+
+	df = pd.concat(read_stream(path, chunk_size=7))
+	assert df.index.equals(polygons.index)
+	assert df.geometry.geom_equals(polygons.geometry).all()
+
+	df = pd.concat(read_stream(path, columns=['n'], where='n >= 30'))
+	assert set(df) == {'n', 'geometry'}
+	assert len(df) == (polygons['n'] >= 30).sum()
+
+	with read_stream(path, chunk_size=2, workers=3, ordered=False) as rd:
+		df = pd.concat(rd)
+
+	assert df.index.is_unique
+	assert sorted(df['n']) == list(polygons['n'])
+
+def test_null_first_chunk():
+	import pyarrow as pa
+	path = '/tmp/test-arrow-nulls.arrow'
+	df = polygons[:30].copy()
+	df['note'] = [None] * 20 + ['a'] * 10
+	with write_stream(path) as wr:
+		for i in range(0, len(df), 10):
+			wr(df[i:i + 10])
+
+	with pa.ipc.open_file(path) as f:
+		assert f.num_record_batches == 3
+		assert f.schema.field('note').type == 'string'
+
+	assert read_df(path)['note'].equals(df['note'])
+
+def test_geometry_filter():
+	area = polygons.geometry[3].buffer(.001)
+	expected = set(polygons[polygons.intersects(area)]['id'])
+	for path, options in (('/tmp/test-arrow.feather', {}), ('/tmp/test-arrow-bbox.feather', {'bbox': True, 'compression': 'zstd'})):
+		write_df(polygons, path, **options)
+		df = pd.concat(read_stream(path, area, columns=['id']))
+		assert set(df['id']) == expected
@@ -71,3 +71,155 @@ def test_rows_correct():
 
 	x = csv.CsvReader(tmp_path)
 	assert len(x) == df_len
+
+
+def test_geometry_filter():
+	import pandas as pd
+	points = read_df(d + 'blocks-points.csv')
+	points.crs = 4326
+	# overlapping circles around some of the points
+	filters = gpd.GeoDataFrame(geometry=points.geometry[:20].buffer(.01).values, crs=4326)
+	expected = gpd.sjoin(points, filters, predicate='intersects')
+	assert len(expected) > 0
+
+	result = pd.concat(read_stream(d + 'blocks-points.csv', filters.geometry.values[0], chunk_size=10))
+	assert len(result) == (expected['index_right'] == 0).sum()
+
+	for dedup in (False, True):
+		result = pd.concat(read_stream(d + 'blocks-points.csv', filters, chunk_size=10, batch_filter=True, dedup=dedup))
+		assert result.index.is_unique
+		if dedup:
+			assert len(result) == expected.index.nunique()
+		else:
+			assert sorted(result['filter_index']) == sorted(expected['index_right'])
+
+
+def test_geometry_formats():
+	import pandas as pd
+	points = read_df(d + 'blocks-points.csv')
+	for geometry_format in ('wkt', 'wkb'):
+		path = f'/tmp/test-geometry-{geometry_format}.csv'
+		with write_stream(path, geometry_format=geometry_format) as wr:
+			for i in range(0, len(points), 10):
+				wr(points[i:i + 10])
+
+		with open(path) as f:
+			header, first_row = f.readline(), f.readline()
+		assert header.strip() == 'geometry'
+		assert first_row.startswith('POINT' if geometry_format == 'wkt' else '01')
+
+		for df in (read_df(path), pd.concat(read_stream(path, chunk_size=7))):
+			assert df.geometry.geom_equals_exact(points.geometry, 1e-12).all()
+
+	with pytest.raises(ValueError):
+		csv.CsvWriter('/tmp/test.csv', geometry_format='geojson')
+
+
+def test_lazy_rows_count():
+	import numpy as np
+	path = '/tmp/test-lazy-rows.csv'
+	df = gpd.GeoDataFrame({'a': np.arange(100_000)}, geometry=gpd.points_from_xy(np.random.rand(100_000), np.random.rand(100_000)))
+	df.to_wkt().to_csv(path, index=False)
+
+	rd = csv.CsvReader(path)
+	assert rd._total_rows is None  # not counted in constructor
+	assert abs(rd.estimated_rows - len(df)) < len(df) * .05
+	assert rd._total_rows is None
+	assert len(rd) == len(df)
+	assert rd.estimated_rows == len(df)
+
+	# small file is counted exactly
+	assert csv.CsvReader(d + 'points.csv').estimated_rows == len(read_df(d + 'points.csv'))
+
+
+def test_workers_byte_ranges():
+	import pandas as pd
+	# values with line breaks and quotes must not be split between partitions
+	path = '/tmp/test-multiline.csv'
+	df = read_df(d + 'blocks-points.csv')
+	df['text'] = ['line\n"quoted"\nline' if i % 3 == 0 else f'value {i}' for i in range(len(df))]
+	csv.CsvDriver.write_df(df, path, None)
+
+	expected = pd.concat(read_stream(path, chunk_size=5))
+	for workers in (2, 7):
+		with read_stream(path, chunk_size=5, sync=False, workers=workers) as rd:
+			partitions = rd.partitions()
+			result = pd.concat(rd)
+
+		assert partitions[0][2] == len('geometry,text\n') and partitions[-1][3] is None
+		assert [p[3] for p in partitions[:-1]] == [p[2] for p in partitions[1:]]
+		assert result.index.equals(expected.index)
+		assert result['text'].equals(expected['text'])
+		assert result.geometry.geom_equals(expected.geometry).all()
+		assert partitions[0][4]  # aligned by the quote-aware scan
+
+
+def test_workers_resync():
+	import pandas as pd
+	from unittest import mock
+	# without line breaks in values, the file is split at nominal offsets, and workers find row starts
+	path = '/tmp/test-resync.csv'
+	df = read_df(d + 'blocks-points.csv')
+	df['text'] = [f'"value" {i}' * (i % 5) for i in range(len(df))]
+	csv.CsvDriver.write_df(df, path, None)
+
+	expected = pd.concat(read_stream(path, chunk_size=5))
+	for workers in (2, 7, len(df) * 3):
+		with mock.patch('erde.io.csv._row_starts') as row_starts, read_stream(path, chunk_size=5, sync=False, workers=workers) as rd:
+			partitions = rd.partitions()
+			result = pd.concat(rd)
+
+		row_starts.assert_not_called()
+		assert not partitions[0][4]
+		assert result.index.equals(expected.index)
+		assert result['text'].fillna('').equals(expected['text'].fillna(''))
+		assert result.geometry.geom_equals(expected.geometry).all()
+
+	with read_stream(path, chunk_size=5, sync=False, workers=7, ordered=False) as rd:
+		result = pd.concat(rd)
+
+	assert result.index.is_unique
+	assert sorted(result['text'].fillna('')) == sorted(expected['text'].fillna(''))
+
+
+def test_workers_late_multiline():
+	import pandas as pd
+	# line breaks in quoted values after the first megabyte can't be found before splitting, workers fail instead of returning broken rows
+	path = '/tmp/test-late-multiline.csv'
+	rows = csv.ESTIMATE_SAMPLE // 6
+	df = pd.DataFrame({'text': ['value'] * rows, 'geometry': ['POINT (1 2)'] * rows})
+	df.loc[rows // 2 - 1000:rows // 2 + 1000, 'text'] = 'line\n' * 100  # around the middle, where 2 workers split the file
+	df.to_csv(path, index=False)
+
+	with read_stream(path, sync=False, workers=2) as rd:
+		assert not rd.partitions()[0][4]
+		with pytest.raises(ValueError):
+			pd.concat(rd)
+
+	assert len(pd.concat(read_stream(path))) == rows
+
+
+def test_compressed():
+	import pandas as pd
+	from erde import write_df
+	src = read_df(d + 'points.csv')
+	for ext in ('gz', 'bz2', 'zst'):
+		path = f'/tmp/test-compressed.csv.{ext}'
+		with write_stream(path, geometry_format='wkb') as wr:
+			wr(src[:4])
+			wr(src[4:])
+
+		with open(path, 'rb') as f:
+			assert b'fid' not in f.read()  # really compressed
+
+		df = pd.concat(read_stream(path, chunk_size=3))
+		assert df.index.equals(src.index)
+		assert df.geometry.geom_equals(src.geometry).all()
+		assert len(csv.CsvReader(path)) == len(src)
+
+		write_df(src, path)
+		df = read_df(path)
+		pd.testing.assert_frame_equal(df.drop(columns='geometry'), src.drop(columns='geometry'))
+
+	with pytest.raises(ValueError):
+		read_stream(path, workers=2)
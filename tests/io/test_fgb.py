@@ -0,0 +1,92 @@
+from erde import read_df, read_stream, write_df
+from erde.io.fgb import FgbFile, _to_datetime
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+
+d = 'tests/io/data/'
+
+polygons = read_df(d + 'polygons.gpkg')
+
+def test_read():
+	import pyogrio
+
+	path = '/tmp/test-fgb.fgb'
+	no_index = '/tmp/test-fgb-no-index.fgb'
+	write_df(polygons, path)
+	pyogrio.write_dataframe(polygons, no_index, layer_options={'SPATIAL_INDEX': 'NO'})
+	assert FgbFile(path).nodes is not None
+	assert FgbFile(no_index).nodes is None
+
+	area = polygons.geometry[3].buffer(.001)
+	expected = set(polygons[polygons.intersects(area)]['id'])
+	for p in (path, no_index):
+		fiona_df = gpd.read_file(p, engine='fiona')
+		df = read_df(p)
+		assert list(df) == list(fiona_df)
+		assert df.crs == fiona_df.crs
+		assert (df['id'] == fiona_df['id']).all()
+		assert df.geometry.geom_equals(fiona_df.geometry).all()
+
+		assert set(read_df(p, bbox=area.bounds)['id']) == set(gpd.read_file(p, bbox=area.bounds)['id'])
+		for bbox in (list(area.bounds), np.array(area.bounds), area, gpd.GeoSeries([area])):
+			assert set(read_df(p, bbox=bbox)['id']) == set(read_df(p, bbox=area.bounds)['id'])
+		assert set(pd.concat(read_stream(p, area, chunk_size=3))['id']) == expected
+
+		with read_stream(p, chunk_size=4, workers=3, columns=[]) as rd:
+			df = pd.concat(rd)
+
+		assert list(df) == ['geometry']
+		assert df.geometry.geom_equals(fiona_df.geometry).all()
+
+def test_types():
+	import pyogrio
+	from shapely.geometry import GeometryCollection, LineString, MultiLineString, MultiPoint, MultiPolygon, Point, Polygon
+
+	geometries = [Point(1, 2), LineString([(0, 0), (1, 1)]), Polygon([(0, 0), (1, 0), (1, 1)], [[(.5, .1), (.9, .1), (.9, .5)]]),
+		MultiPoint([(0, 0), (3, 3)]), MultiLineString([[(0, 0), (1, 1)], [(2, 2), (3, 3)]]),
+		MultiPolygon([Polygon([(0, 0), (1, 0), (1, 1)]), Polygon([(5, 5), (6, 5), (6, 6)])]), GeometryCollection([Point(0, 0), LineString([(1, 1), (2, 2)])])]
+	df = gpd.GeoDataFrame({'i': np.arange(7), 'f': np.linspace(0, 1, 7), 'b': [True, False] * 3 + [True], 's': list('abcdefg')}, geometry=geometries, crs=3857)
+	path = '/tmp/test-fgb-types.fgb'
+	pyogrio.write_dataframe(df, path)
+
+	result = read_df(path)
+	fiona_df = gpd.read_file(path, engine='fiona')
+	assert result.crs == df.crs
+	assert result.geometry.geom_equals_exact(fiona_df.geometry, 0).all()
+	assert result.drop(columns='geometry').equals(fiona_df.drop(columns='geometry'))
+
+	assert pd.concat(read_stream(path, where='i > 3'))['i'].tolist() == fiona_df[fiona_df['i'] > 3]['i'].tolist()
+
+	# where is OGR SQL by default, and pandas query with native engine
+	assert sorted(pd.concat(read_stream(path, where="s IN ('a', 'c') OR s LIKE 'g%'"))['s']) == ['a', 'c', 'g']
+	assert pd.concat(read_stream(path, where="s == 'b'", engine='native'))['s'].tolist() == ['b']
+
+def test_datetime():
+	import pyogrio
+	from shapely.geometry import Point
+
+	times = pd.DatetimeIndex([pd.Timestamp('2020-01-02 03:04:05.123'), pd.Timestamp('2021-06-07 08:09:10'), pd.NaT])
+	df = gpd.GeoDataFrame({'naive': times, 'utc': times.tz_localize('UTC'), 'msk': times.tz_localize('Europe/Moscow')}, geometry=[Point(0, 0)] * 3, crs=4326)
+	path = '/tmp/test-fgb-datetime.fgb'
+	pyogrio.write_dataframe(df, path)
+
+	# same dtypes as from geopandas (pyogrio parses DateTime columns, it has milliseconds precision)
+	expected = gpd.read_file(path, engine='pyogrio')
+	for result in (read_df(path), pd.concat(read_stream(path))):
+		for col in ('naive', 'utc', 'msk'):
+			pd.testing.assert_series_equal(result[col], expected[col].dt.as_unit('ns'))
+
+	# different offsets are converted to UTC
+	mixed = _to_datetime(pd.Series(['2020-01-02T03:04:05+03:00', '2020-01-02T03:04:05+01:00', None]))
+	assert str(mixed.dtype) == 'datetime64[ns, UTC]'
+	assert mixed.tolist()[:2] == [pd.Timestamp('2020-01-02T00:04:05Z'), pd.Timestamp('2020-01-02T02:04:05Z')]
+
+def test_bad_file():
+	path = '/tmp/not-an-fgb.fgb'
+	with open(path, 'w') as f:
+		f.write('')
+
+	with pytest.raises(RuntimeError):
+		read_stream(path)
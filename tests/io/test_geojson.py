@@ -8,3 +8,68 @@ def test_read_broken_geojson():
 
 	with pytest.raises(RuntimeError):
 		read_stream(path)
+
+
+def test_compressed_geojsonseq():
+	import pandas as pd
+	from erde import read_df, write_df, write_stream
+	src = read_df('tests/io/data/points.geojsonl.json')
+	for ext in ('gz', 'bz2', 'zst'):
+		path = f'/tmp/test-compressed.geojsonl.json.{ext}'
+		with write_stream(path) as wr:
+			wr(src[:4])
+			wr(src[4:])
+
+		df = pd.concat(read_stream(path, chunk_size=3))
+		assert list(df) == list(src)
+		assert df.index.equals(src.index)
+		assert df.geometry.geom_equals(src.geometry).all()
+		assert len(read_stream(path)) == len(src)
+
+		write_df(src, path)
+		df = read_df(path)
+		assert df.crs == src.crs
+		pd.testing.assert_frame_equal(df.drop(columns='geometry'), src.drop(columns='geometry'))
+
+	# OGR SQL can't be applied to compressed files
+	with pytest.raises(ValueError):
+		read_stream(path, where='fid > 2')
+
+	assert len(pd.concat(read_stream(path, where='fid > 2', engine='native'))) == (src['fid'] > 2).sum()
+
+
+def test_native_geojsonseq():
+	import geopandas as gpd
+	import pandas as pd
+	from erde import read_df, write_df
+
+	src = gpd.read_file('tests/io/data/houses.geojsonl.json', engine='fiona')
+	df = read_df('tests/io/data/houses.geojsonl.json')
+	assert list(df) == list(src)
+	pd.testing.assert_frame_equal(df.drop(columns='geometry'), src.drop(columns='geometry'))
+	assert df.geometry.geom_equals(src.geometry).all()
+
+	polygons = read_df('tests/io/data/polygons.gpkg')
+	path = '/tmp/test-native.geojsonl.json'
+	write_df(polygons, path)
+	result = gpd.read_file(path, engine='fiona')
+	assert (result['id'] == polygons['id']).all()
+	assert result.geometry.geom_equals_exact(polygons.geometry, 0).all()
+
+	df = pd.concat(read_stream(path, columns=[], where='geometry.area > 0', engine='native'))
+	assert list(df) == ['geometry']
+
+	# where is OGR SQL by default
+	ids = sorted(polygons['id'])[:3]
+	df = pd.concat(read_stream(path, where=f"id IN ({', '.join(repr(i) for i in ids)}) OR id IS NULL"))
+	assert sorted(df['id']) == ids
+
+	for workers, ordered in ((3, True), (3, False), (len(polygons) - 1, True)):
+		with read_stream(path, chunk_size=5, workers=workers, ordered=ordered) as rd:
+			assert len(rd.partitions()) == workers
+			df = pd.concat(rd)
+
+		assert df.index.is_unique
+		assert sorted(df['id']) == sorted(polygons['id'])
+		if ordered:
+			assert df.index.equals(polygons.index)
@@ -4,6 +4,7 @@ from time import sleep
 import errno
 import geopandas as gpd
 import os
+import pandas as pd
 import pytest
 
 
@@ -166,3 +167,176 @@ def test_read_stats():
 	print(rd.stats())
 	print(next(rd))
 
+
+
+def test_read_pyogrio_engine():
+	from erde import read_stream
+	import pandas as pd
+
+	for chunk_size in (3, 10, None):
+		fiona_df = pd.concat(read_stream(match_points, chunk_size=chunk_size))
+		chunks = list(read_stream(match_points, chunk_size=chunk_size, engine='pyogrio'))
+		if chunk_size is not None:
+			assert all(len(df) <= chunk_size for df in chunks)
+
+		arrow_df = pd.concat(chunks)
+		assert isinstance(arrow_df, gpd.GeoDataFrame)
+		assert arrow_df.index.equals(fiona_df.index)
+		assert set(arrow_df) == set(fiona_df)
+		assert arrow_df['name'].equals(fiona_df['name'])
+		assert arrow_df.geometry.geom_equals(fiona_df.geometry).all()
+		assert arrow_df.crs == fiona_df.crs
+
+	filter_df = read_df(d + 'match-simple-polys.geojson')
+	for test_filter in (filter_df, filter_df['geometry'].unary_union):
+		for s in (True, False):
+			with read_stream(match_points, test_filter, sync=s, engine='pyogrio') as rd:
+				names = [n for df in rd for n in df['name'].tolist()]
+			assert sorted(names) == list('ACDFGI')
+
+	with pytest.raises(ValueError):
+		read_stream(match_points, engine='no-such-engine')
+
+
+def test_write_engines():
+	import fiona
+	old_df = read_df(match_points)
+	path = '/tmp/write-engines.gpkg'
+	silentremove(path)
+	for engine in ('fiona', 'pyogrio'):
+		with dr.write_stream(f'{path}:{engine}', sync=True, engine=engine) as w:
+			for df in dr.read_stream(match_points, chunk_size=3):
+				w(df)
+
+	# both layers stay in the file, and have the same data
+	assert set(fiona.listlayers(path)) == {'fiona', 'pyogrio'}
+	for engine in ('fiona', 'pyogrio'):
+		new_df = read_df(f'{path}:{engine}')
+		assert sorted(new_df['name'].tolist()) == sorted(old_df['name'].tolist())
+		assert new_df.crs == old_df.crs
+
+	# writing the layer again replaces it, not appends to it
+	with dr.write_stream(f'{path}:pyogrio', engine='pyogrio') as w:
+		w(old_df)
+
+	assert len(read_df(f'{path}:pyogrio')) == len(old_df)
+
+	with pytest.raises(ValueError):
+		dr.write_stream(path, engine='ogr')
+
+
+def test_write_bulk():
+	import sqlite3
+	from contextlib import closing
+	src = d + 'polygons.gpkg'
+	path = '/tmp/write-bulk.gpkg'
+	bbox = (83.05, 54.85, 83.1, 54.9)
+
+	def rtree(layer):
+		with closing(sqlite3.connect(path)) as conn:
+			assert conn.execute(f"select rtreecheck('rtree_{layer}_geom')").fetchone()[0] == 'ok'
+			triggers = [sql.replace(layer, '') for sql, in conn.execute(f"select sql from sqlite_master where type = 'trigger' and name like 'rtree_{layer}_%' order by name")]
+			# rtree keeps float32 values, which sqlite rounds outwards with some error
+			cells = pd.DataFrame(conn.execute(f'select * from rtree_{layer}_geom order by id').fetchall())
+			return triggers, cells
+
+	silentremove(path)
+	for engine in ('fiona', 'pyogrio'):
+		for bulk in (False, True):
+			layer = f'{engine}_{int(bulk)}'
+			with dr.write_stream(f'{path}:{layer}', engine=engine, bulk=bulk) as w:
+				for df in dr.read_stream(src, chunk_size=10):
+					w(df)
+
+	ref_triggers, ref_cells = rtree('fiona_0')
+	for layer in ('fiona_1', 'pyogrio_0', 'pyogrio_1'):
+		triggers, cells = rtree(layer)
+		assert triggers == ref_triggers
+		pd.testing.assert_frame_equal(cells, ref_cells, atol=1e-5)
+		assert len(read_df(f'{path}:{layer}', bbox=bbox)) == len(read_df(f'{path}:fiona_0', bbox=bbox)) > 0
+
+
+def test_write_bulk_no_geometries():
+	import sqlite3
+	from contextlib import closing
+	from shapely.geometry import Point
+	path = '/tmp/write-bulk-empty.gpkg'
+	silentremove(path)
+	frames = {'nulls': [None, None], 'empty': [Point(), Point()]}
+	for layer, geometries in frames.items():
+		with dr.write_stream(f'{path}:{layer}', bulk=True) as w:
+			w(gpd.GeoDataFrame({'a': [1, 2]}, geometry=geometries, crs=4326))
+
+		with closing(sqlite3.connect(path)) as conn:
+			# the index is made anyway, and it's empty
+			assert conn.execute(f'select count(*) from rtree_{layer}_geom').fetchone()[0] == 0
+
+		assert len(read_df(f'{path}:{layer}')) == 2
+
+
+def test_columns_where():
+	from erde import read_stream
+	src = d + 'polygons.gpkg'
+	ids = read_df(src)['id']
+	expected = sorted(ids[ids > '59400'])
+	for engine in ('fiona', 'pyogrio'):
+		for workers in (1, 2):
+			with read_stream(src, columns=['id'], where="id > '59400'", engine=engine, workers=workers, chunk_size=10) as rd:
+				result = pd.concat(list(rd))
+
+			assert set(result) == {'id', 'geometry'}
+			assert sorted(result['id']) == expected
+
+			with read_stream(src, columns=[], engine=engine) as rd:
+				assert list(next(rd)) == ['geometry']
+
+	with pytest.raises(ValueError):
+		read_stream(src, columns=['no_such_column'])
+
+
+def test_exact_filter():
+	from erde import read_stream, write_df
+	from shapely.geometry import Polygon
+	src = d + 'polygons.gpkg'
+	fgb = '/tmp/polygons.fgb'
+	df = read_df(src)
+	write_df(df, fgb)
+
+	minx, miny, maxx, maxy = df.total_bounds
+	triangle = Polygon([(minx, miny), (maxx, miny), (minx, maxy)])
+	expected = set(df[df.intersects(triangle)]['id'])
+	assert len(expected) < len(df)
+
+	for path, engines in ((src, ('fiona', 'pyogrio')), (fgb, ('native', 'fiona'))):
+		for engine in engines:
+			options = {'engine': engine}
+			result = pd.concat(list(read_stream(path, triangle, chunk_size=10, **options)))
+			assert set(result['id']) == expected
+			assert result.index.tolist() == list(range(len(result)))
+
+			# bbox covers the whole layer
+			result = pd.concat(list(read_stream(path, triangle, chunk_size=10, exact_filter=False, **options)))
+			assert len(result) == len(df)
+
+
+def test_batch_filter():
+	from erde import read_stream
+	src = d + 'polygons.gpkg'
+	df = read_df(src)
+	filters = gpd.GeoDataFrame(geometry=df.geometry.buffer(.001).values[:10], crs=df.crs)
+	expected = gpd.sjoin(df, filters, predicate='intersects')
+	expected_pairs = set(zip(expected['id'], expected['index_right']))
+	assert len(expected) > expected['id'].nunique()
+
+	for engine in ('fiona', 'pyogrio'):
+		for dedup in (False, True):
+			with read_stream(src, filters, chunk_size=7, engine=engine, batch_filter=True, dedup=dedup) as rd:
+				result = pd.concat(list(rd))
+
+			pairs = set(zip(result['id'], result['filter_index']))
+			assert result.index.tolist() == list(range(len(result)))
+			if dedup:
+				assert len(result) == expected['id'].nunique()
+				assert pairs.issubset(expected_pairs)
+			else:
+				assert pairs == expected_pairs
@@ -0,0 +1,85 @@
+from erde import read_df, read_stream, write_stream
+from erde.io.parquet import BBOX_COLUMN
+import geopandas as gpd
+import pandas as pd
+import pytest
+
+d = 'tests/io/data/'
+
+polygons = read_df(d + 'polygons.gpkg')
+
+def _write(path, df, chunk_size):
+	with write_stream(path) as wr:
+		for i in range(0, len(df), chunk_size):
+			wr(df[i:i + chunk_size])
+
+def test_read_write():
+	import pyarrow.parquet as pq
+
+	path = '/tmp/test-parquet.parquet'
+	_write(path, polygons, 10)
+	assert pq.ParquetFile(path).metadata.num_row_groups == 7
+
+	# files are readable by geopandas, bbox column is an ordinary column there
+	gdf = gpd.read_parquet(path)
+	assert gdf.crs == polygons.crs
+	assert BBOX_COLUMN in gdf
+
+	df = read_df(path)
+	assert list(df) == list(polygons)
+	assert df.crs == polygons.crs
+	assert df.geometry.geom_equals(polygons.geometry).all()
+
+	df = pd.concat(read_stream(path, chunk_size=3))
+	assert df.index.equals(polygons.index)
+	assert df.geometry.geom_equals(polygons.geometry).all()
+
+	df = pd.concat(read_stream(path, columns=['id'], where='id.str.startswith("593")'))
+	assert list(df) == ['id', 'geometry']
+	assert df['id'].str.startswith('593').all()
+	assert len(df) == polygons['id'].str.startswith('593').sum() > 0
+
+def test_null_first_chunk():
+	import pyarrow.parquet as pq
+	from erde.io import parquet
+
+	path = '/tmp/test-parquet-nulls.parquet'
+	df = polygons[:30].copy()
+	df['note'] = [None] * 20 + ['a'] * 10
+	_write(path, df, 10)
+	assert pq.ParquetFile(path).metadata.num_row_groups == 3
+	assert pq.ParquetFile(path).schema_arrow.field('note').type == 'string'
+	assert read_df(path)['note'].equals(df['note'])
+
+	# after PENDING_ROWS, the column stays null
+	with pytest.MonkeyPatch.context() as mp:
+		mp.setattr(parquet, 'PENDING_ROWS', 5)
+		_write(path, df[:20], 10)
+
+	assert pq.ParquetFile(path).schema_arrow.field('note').type == 'null'
+
+
+def test_geometry_filter():
+	from erde.io.parquet import _row_groups_in_bbox
+	import pyarrow.parquet as pq
+
+	path = '/tmp/test-parquet-filter.parquet'
+	_write(path, polygons, 5)
+	area = polygons.geometry[3].buffer(.001)
+	metadata = pq.ParquetFile(path).metadata
+	assert len(_row_groups_in_bbox(metadata, BBOX_COLUMN, area.bounds, range(metadata.num_row_groups))) < metadata.num_row_groups
+
+	df = pd.concat(read_stream(path, area, columns=['id']))
+	assert len(df) == polygons.intersects(area).sum()
+	assert set(df['id']) == set(polygons[polygons.intersects(area)]['id'])
+
+@pytest.mark.parametrize('ordered', [True, False])
+def test_workers(ordered):
+	path = '/tmp/test-parquet-workers.parquet'
+	_write(path, polygons, 5)
+	with read_stream(path, chunk_size=2, workers=3, ordered=ordered) as rd:
+		assert len(rd.partitions()) == 3
+		df = pd.concat(rd)
+
+	assert df.index.is_unique
+	assert sorted(df['id']) == sorted(polygons['id'])
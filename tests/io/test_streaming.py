@@ -15,3 +15,74 @@ def test_stream_reading():
 			assert io.select_driver(path)[0] == io.drivers[fmt]
 			with pytest.raises(FileNotFoundError):
 				read_stream(path)
+
+
+def test_shm_transport():
+	from erde import read_df, read_stream, write_stream
+	from erde.io import shm
+	from shapely.geometry import Point
+	import geopandas as gpd
+	import pandas as pd
+
+	for fmt in ['csv', 'gpkg']:
+		expected = pd.concat(read_stream(f'{d}lines.{fmt}', chunk_size=2))
+		with read_stream(f'{d}lines.{fmt}', chunk_size=2, sync=False, transport='shm') as rd:
+			result = pd.concat(rd)
+
+		assert isinstance(result, gpd.GeoDataFrame)
+		assert result.crs == expected.crs
+		assert result.index.equals(expected.index)
+		assert result.drop('geometry', axis=1).equals(expected.drop('geometry', axis=1))
+		assert result.geometry.geom_equals(expected.geometry).all()
+
+		with write_stream(f'/tmp/lines-shm.{fmt}', sync=False, transport='shm') as wr:
+			with read_stream(f'{d}lines.{fmt}', chunk_size=2, sync=False, transport='shm') as rd:
+				for df in rd:
+					wr(df)
+
+		assert len(read_df(f'/tmp/lines-shm.{fmt}')) == len(expected)
+
+	# extra geometry columns keep their type, objects arrow can't serialize go through the queue as is
+	df = gpd.GeoDataFrame({'a': [1, 2], 'geometry': [Point(1, 2), Point(3, 4)], 'dest': gpd.GeoSeries([Point(5, 6), Point(7, 8)], crs=3857)}, crs=4326)
+	result = shm.load_chunk(shm.dump_chunk(df))
+	assert result.crs == 4326 and result['dest'].crs == 3857
+	assert result.geometry.geom_equals(df.geometry).all() and result['dest'].geom_equals(df['dest']).all()
+
+	objects = pd.DataFrame({'a': [Point(1, 2), 1]})
+	assert shm.dump_chunk(objects) is objects
+
+	with pytest.raises(ValueError):
+		read_stream(f'{d}lines.gpkg', transport='pipe')
+
+
+def test_workers():
+	from erde import read_stream
+	from erde.io.base import BaseReader
+	import pandas as pd
+
+	for fmt in ['csv', 'gpkg', 'shp']:
+		path = f'{d}points.{fmt}'
+		expected = pd.concat(read_stream(path, chunk_size=3))
+		for workers in (2, 3, 20):
+			for ordered in (True, False):
+				with read_stream(path, chunk_size=3, sync=False, workers=workers, ordered=ordered) as rd:
+					assert len(rd.partitions()) == min(workers, len(expected))
+					result = pd.concat(rd)
+
+				if not ordered:
+					result = result.sort_index()
+					if fmt == 'csv':
+						# CSV ranges are indexed from their start bytes
+						assert result.index.is_unique
+						result.index = expected.index
+
+				assert result.index.equals(expected.index)
+				pd.testing.assert_frame_equal(result.drop('geometry', axis=1), expected.drop('geometry', axis=1), check_dtype=False)
+				assert result.geometry.geom_equals(expected.geometry).all()
+
+	with pytest.raises(ValueError):
+		read_stream(f'{d}points.gpkg', workers=0)
+
+	# a reader that can't read ranges of rows
+	with pytest.raises(ValueError):
+		BaseReader('mock source', workers=2)
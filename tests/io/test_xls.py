@@ -0,0 +1,46 @@
+from erde import read_df, read_stream, write_df, write_stream
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+
+d = 'tests/io/data/'
+
+def test_read():
+	df = read_df(d + 'points.xlsx')
+	assert isinstance(df, gpd.GeoDataFrame)
+	assert list(df) == ['fid', 'number', 'geometry']
+	assert len(df) == 8
+
+	chunks = list(read_stream(d + 'points.xlsx:points', chunk_size=3))
+	assert [len(c) for c in chunks] == [3, 3, 2]
+	result = pd.concat(chunks)
+	assert result.index.equals(df.index)
+	assert result.geometry.geom_equals(df.geometry).all()
+
+	result = pd.concat(read_stream(d + 'points.xlsx', columns=['fid'], where='fid > 4'))
+	assert list(result) == ['fid', 'geometry']
+	assert (result['fid'] > 4).all()
+
+	with pytest.raises(ValueError):
+		read_stream(d + 'points.xlsx:no_such_sheet')
+
+def test_write():
+	polygons = read_df(d + 'polygons.gpkg')
+	path = '/tmp/test-xls.xlsx'
+	with write_stream(path) as wr:
+		wr(polygons[:30])
+		wr(polygons[30:])
+
+	df = read_df(path)
+	assert list(df) == list(polygons)
+	assert df.geometry.geom_equals(polygons.geometry).all()
+	assert pd.read_excel(path, sheet_name=None).keys() == {'test-xls'}
+
+	# lon/lat columns become points
+	points = pd.DataFrame({'lon': [1.5, 2.5, 3.5], 'lat': [10.0, 20.0, 30.0], 'value': [1, np.nan, 3]})
+	write_df(points, path)
+	df = read_df(path)
+	assert df.crs == 4326
+	assert df.geometry.x.tolist() == points['lon'].tolist()
+	assert df['value'].isna().tolist() == [False, True, False]
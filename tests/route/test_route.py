@@ -17,7 +17,7 @@ def test_get_retry():
 		return len(called_urls) - 1
 
 	requested_urls = []
-	with mock.patch('requests.get', side_effect=new_get) as mm:
+	with mock.patch('requests.Session.get', side_effect=new_get) as mm:
 		for i in range(10):
 			url = f'http://localhost/{i}'
 			requested_urls.append(url)
@@ -39,18 +39,36 @@ def test_get_retry():
 		return resp
 
 	# 10 retries by default, should not raise exception
-	with mock.patch('requests.get', side_effect=err) as mm:
+	with mock.patch('requests.Session.get', side_effect=err) as mm:
 		assert utils.get_retry(url, {}) == ok
 
 	assert mm.call_count == 3
 
 	resps = [requests.exceptions.ConnectTimeout, requests.exceptions.ConnectionError, ok]
 	# connection timeout exhausts retries
-	with mock.patch('requests.get', side_effect=err) as mm:
+	with mock.patch('requests.Session.get', side_effect=err) as mm:
 		with pytest.raises(requests.exceptions.ConnectionError):
 			utils.get_retry(url, {}, retries=1)
 
 
+def test_http_session():
+	s1 = utils.http_session('http://localhost:5000/route/v1/driving/1,2;3,4')
+	assert utils.http_session('http://localhost:5000/table/v1/driving/') is s1
+	assert utils.http_session('http://localhost:5001/') is not s1
+
+	utils.setup_http(pool_size=3, timeout=1.5)
+	try:
+		s2 = utils.http_session('http://localhost:5000/')
+		assert s2 is not s1
+		assert s2.get_adapter('http://localhost:5000/')._pool_maxsize == 3
+		with mock.patch('requests.Session.get') as mm:
+			utils.get_retry('http://localhost:5000/', {})
+
+		assert mm.call_args[1]['timeout'] == 1.5
+	finally:
+		utils.setup_http()
+
+
 resp1 = """{"code":"Ok","waypoints":[{"distance":0.128545,"location":[83.101985,54.830043],"name":""},{"distance":1.494989,"location":[83.103487,54.830639],"name":""}],"routes":[{"legs":[{"steps":[],"weight":11.49,"distance":133.5,"summary":"","duration":106.8}],"weight_name":"routability","geometry":"w~smImzezNCDEDGASWKQKUEO[}AGo@Ai@?Y?OMC","weight":11.49,"distance":133.5,"duration":106.8}]}"""
 
 resp2 = """{"code":"Ok","waypoints":[{"distance":0.128545,"location":[83.101985,54.830043],"name":""},{"distance":1.494989,"location":[83.103487,54.830639],"name":""}],"routes":[{"legs":[{"steps":[],"weight":11.49,"distance":133.5,"annotation":{"nodes":[3395030499,3395030501,5179019511,3395030504,5179019510,3395030505,5179019509,3395030506,3395030507,6945546983,3395030511,3395030510,3395030509,3395030512]},"summary":"","duration":106.8}],"weight_name":"routability","geometry":"w~smImzezNCDEDGASWKQKUEO[}AGo@Ai@?Y?OMC","weight":11.49,"distance":133.5,"duration":106.8}]}"""
@@ -166,3 +184,32 @@ def test_main():
 	result_df.set_index(['r_id', 'alternative'], inplace=True)
 	assert all(expected_df['geometry'].geom_almost_equals(result_df['geometry']))
 
+
+	# asyncio engine gives the same result
+	pytest.importorskip('aiohttp')
+	m = mock.AsyncMock(side_effect=responses)
+	with mock.patch('erde.op.route.raw_route_async', m):
+		result_df = route.main(input_df, 'foot', alternatives=3, engine='async', concurrency=2)
+
+	assert m.call_count == len(responses)
+	result_df.set_index(['r_id', 'alternative'], inplace=True)
+	assert all(expected_df['geometry'].geom_almost_equals(result_df['geometry']))
+
+	with pytest.raises(ValueError):
+		route.main(input_df, 'foot', engine='wrong')
+
+
+def test_map_async():
+	pytest.importorskip('aiohttp')
+	import asyncio
+
+	in_flight = []
+	async def fn(session, item):
+		in_flight.append(item)
+		assert len(in_flight) <= 3
+		await asyncio.sleep((10 - item) / 1000)  # later items finish first
+		in_flight.remove(item)
+		return item * 2
+
+	assert list(utils.map_async(fn, range(10), concurrency=3)) == [i * 2 for i in range(10)]
+	assert sorted(utils.map_async(fn, iter(range(10)), concurrency=3, ordered=False)) == [i * 2 for i in range(10)]
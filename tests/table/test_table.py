@@ -1,6 +1,7 @@
 from contextlib import contextmanager
 from erde import read_df
 from erde.op import table
+from itertools import product
 from shapely.geometry import Point
 from unittest import mock
 import geopandas as gpd
@@ -161,7 +162,7 @@ def test_max_table_size():
 		(total_table + 1, 1),
 		(total_table // 2 + 1, 3),
 		(2 * one_row + 1, rows),
-		(one_row + 1, rows),
+		(one_row + 1, rows + 1),  # near-square blocks of 21x7 send fewer points than 7 columns of 166x1
 		(one_row // 2 + 1, rows * 2),
 	)
 	for i, (mts, check) in enumerate(combos):
@@ -175,6 +176,150 @@ def test_max_table_size():
 			assert len(res) == len(good_table)
 
 
+def test_request_count():
+	# same limits as in test_max_table_size, but counted with async engine, whose requests are made in this process
+	pytest.importorskip('aiohttp')
+	h, s = _get_ds()
+
+	async def _respond_async(session, url, params=None, retries=None):
+		return _respond(url, params, retries)
+
+	total_table = len(h) * len(s)
+	one_row = max(len(h), len(s))
+	rows = min(len(h), len(s))
+	combos = (
+		(total_table + 1, 1),
+		(total_table // 2 + 1, 3),
+		(2 * one_row + 1, rows),
+		(one_row + 1, rows + 1),  # near-square blocks of 21x7 send fewer points than 7 columns of 166x1
+		(one_row // 2 + 1, rows * 2),
+	)
+	for mts, check in combos:
+		for a, b in ((h, s), (s, h)):
+			calls = len(call_params)
+			with make_server(), mock.patch('erde.utils.get_retry_async', side_effect=_respond_async) as m:
+				res = pd.concat(table.table_route(a, b, 'local', max_table_size=mts, engine='async', pbar=False, concurrency=1))
+
+			assert 1 <= m.call_count <= check
+			assert (m.call_count > 1) == (check > 1)
+			assert all(len(p['sources'].split(';')) * len(p['destinations'].split(';')) <= mts for p in call_params[calls:])
+			assert len(res) == total_table
+			assert set(zip(res.source, res.destination)) == set(product(range(len(a)), range(len(b))))
+
+
+def test_async_engine():
+	pytest.importorskip('aiohttp')
+	h, s = _get_ds()
+
+	async def _respond_async(session, url, params=None, retries=None):
+		return _respond(url, params, retries)
+
+	mts = len(h) * len(s) // 3
+	with make_server() as m, mock.patch('erde.utils.get_retry_async', side_effect=_respond_async) as am:
+		res = pd.concat(table.table_route(h, s, 'local', max_table_size=mts, engine='async', concurrency=2))
+
+	m.assert_not_called()
+	assert am.call_count > 1
+	assert len(res) == len(h) * len(s)
+	assert set(zip(res.source, res.destination)) == set(product(range(len(h)), range(len(s))))
+
+	with pytest.raises(ValueError):
+		list(table.table_route(h, s, 'local', engine='wrong'))
+
+
+def test_cache(tmp_path):
+	pytest.importorskip('aiohttp')
+	h, s = _get_ds()
+
+	async def _respond_async(session, url, params=None, retries=None):
+		return _respond(url, params, retries)
+
+	kwargs = {'annotations': 'duration,distance', 'engine': 'async', 'pbar': False, 'cache_name': str(tmp_path / 'table.sqlite')}
+	with make_server(), mock.patch('erde.utils.get_retry_async', side_effect=_respond_async) as m:
+		first = pd.concat(table.table_route(h, s, 'local', max_table_size=len(h) * len(s) // 3, **kwargs))
+		calls = m.call_count
+		second = pd.concat(table.table_route(h, s, 'local', max_table_size=len(h) * len(s) // 3, **kwargs))
+		assert m.call_count == calls
+
+		first, second = (df.set_index(['source', 'destination']).sort_index() for df in (first, second))
+		assert list(first) == list(second)
+		np.testing.assert_array_equal(first['duration'], second['duration'])
+		assert all(first['geometry_dest'] == second['geometry_dest'])
+
+		# new destinations: only their columns are requested
+		s2 = pd.concat([s, s.iloc[:3].assign(geometry=s.geometry.iloc[:3].translate(.01))], ignore_index=True)
+		result = pd.concat(table.table_route(h, s2, 'local', **kwargs))
+		assert m.call_count == calls + 1
+		assert len(call_params[-1]['destinations'].split(';')) == 3
+
+	assert len(result) == len(h) * len(s2)
+	assert not result.set_index(['source', 'destination']).index.has_duplicates
+	assert set(result['destination'][result['geometry_dest'].isin(s2.geometry.iloc[-3:])]) == {7, 8, 9}
+
+
+def test_block_shape():
+	# fits in one request
+	assert table._block_shape(166, 7, 2000, 10_000) == (166, 7)
+	# large on both sides => near-square blocks
+	r, c = table._block_shape(10_000, 10_000, 2000, 10_000)
+	assert r * c <= 2000 and 0.5 < r / c < 2
+	# points limit (by URL length)
+	r, c = table._block_shape(10_000, 10_000, 100_000, 450)
+	assert r * c <= 100_000 and r + c <= 450
+	assert table._block_shape(5, 3, 1, 100) == (1, 1)
+
+
+def test_table_plan():
+	plan = table.TablePlan(100, 100, 2000)
+	blocks = list(plan.blocks())
+	assert sum((s1 - s0) * (d1 - d0) for s0, s1, d0, d1 in blocks) == 100 * 100
+	assert all((s1 - s0) * (d1 - d0) <= 2000 for s0, s1, d0, d1 in blocks)
+	assert len(blocks) < 10
+
+	# the router takes 4 seconds per block, target is 1 second => blocks get smaller, but not more than 2 times at once
+	plan = table.TablePlan(100, 100, 2000, target_latency=1)
+	it = plan.blocks()
+	s0, s1, d0, d1 = next(it)
+	plan.observe([((s1 - s0) * (d1 - d0), s1 - s0 + d1 - d0, 4.0, None)])
+	s0, s1, d0, d1 = next(it)
+	assert (s1 - s0) * (d1 - d0) <= 1000
+
+	# fast responses make blocks grow back, up to max_table_size
+	for i in range(10):
+		plan.observe([(1000, 70, 0.01, None)])
+	assert plan.cells == 2000
+
+	# too long URL and too big table are hard limits
+	plan.observe([(400, 40, None, 'url'), (1000, 70, None, 'cells')])
+	assert plan.max_points == 20 and plan.max_cells == 500
+	r, c = plan.shape
+	assert r + c <= 20 and r * c <= 500
+	plan.observe([(100, 20, 0.001, None)])
+	assert plan.cells == 500
+
+
+def test_split_refused():
+	pytest.importorskip('aiohttp')
+	h, s = _get_ds()
+
+	# the router refuses requests with more than 50 points
+	async def _respond_async(session, url, params=None, retries=None):
+		qs = urllib.parse.parse_qs(urllib.parse.unquote(re.match(r'^.*?\?(?P<qs>.*)$', url)['qs']))
+		if len(qs['sources'][0].split(';')) + len(qs['destinations'][0].split(';')) > 50:
+			return mock.Mock(status_code=414, content='414 Request-URI Too Large')
+		return _respond(url, params, retries)
+
+	calls = len(call_params)
+	with make_server(), mock.patch('erde.utils.get_retry_async', side_effect=_respond_async) as m:
+		result = pd.concat(table.table_route(h, s, 'local', engine='async', pbar=False, concurrency=1))
+
+	assert len(result) == len(h) * len(s)
+	assert not result.set_index(['source', 'destination']).index.has_duplicates
+	assert all(len(p['sources'].split(';')) + len(p['destinations'].split(';')) <= 50 for p in call_params[calls:])
+	# after the first refusals, the blocks are made small enough
+	assert m.call_count < len(h) * len(s) / 50
+
+
 def test_main():
 	h, s = _get_ds()
 	with make_server():
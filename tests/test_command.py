@@ -95,6 +95,70 @@ def test_cli_call():
 		def bad3(input_data: erde.read_stream) -> gpd.GeoDataFrame:
 			return input_data
 
-		for f in (bad1, bad2, bad3):
+		def bad4(input_data: erde.read_stream, where='north') -> erde.write_stream:
+			return input_data
+
+		for f in (bad1, bad2, bad3, bad4):
 			with pytest.raises(erde.ErdeDecoratorError):
 				erde.autocli(f)
+
+
+def _slow_identity(i, delay):
+	from time import sleep
+	sleep(delay * (5 - i % 5))
+	return i
+
+
+def _gen_identity(i):
+	yield i
+	yield i
+
+
+def test_map_jobs():
+	from erde import _map_jobs
+	args = [(i, .01) for i in range(20)]
+	assert list(_map_jobs(_slow_identity, args, {}, 4, keep_order=True)) == list(range(20))
+	assert sorted(_map_jobs(_slow_identity, args, {}, 4)) == list(range(20))
+
+	# generators are run to the end in the worker
+	assert list(_map_jobs(_gen_identity, [(i,) for i in range(3)], {}, 2, keep_order=True)) == [[0, 0], [1, 1], [2, 2]]
+
+
+def test_jobs_option():
+	import inspect
+
+	def stream_stream(input_data: erde.read_stream, radius: float = 1.0, **kwargs) -> erde.write_stream:
+		return input_data
+
+	dec = erde.autocli(stream_stream)._argh
+	params = inspect.signature(dec).parameters
+	assert list(params) == ['input_data', 'radius', 'jobs', 'keep_order', 'select', 'where', 'kwargs']
+
+	with mock.patch('erde.write_stream') as ws:
+		dec(d + 'points.csv', jobs=2, keep_order=True)
+
+	written = [c[0][0] for c in ws.return_value.__enter__.return_value.call_args_list]
+	assert sum(len(df) for df in written) == len(df)
+
+
+def test_select_where_options():
+	def stream_stream(input_data: erde.read_stream) -> erde.write_stream:
+		return input_data
+
+	dec = erde.autocli(stream_stream)._argh
+	with mock.patch('erde.write_stream') as ws:
+		dec(d + 'points.csv', select='fid', where='fid > 4')
+
+	written = [c[0][0] for c in ws.return_value.__enter__.return_value.call_args_list]
+	result = gpd.pd.concat(written)
+	assert list(result) == ['fid', 'geometry']
+	assert sorted(result['fid']) == [5, 6, 7, 8]
+
+def test_own_where_select():
+	# functions without read_stream input keep their own params named as streaming options
+	calls = []
+	def df_nothing(input_data: gpd.GeoDataFrame, where: str = 'all', select: str = None, jobs: int = 0):
+		calls.append((where, select, jobs))
+
+	erde.autocli(df_nothing)._argh(df, where='north', select='a', jobs=3)
+	assert calls == [('north', 'a', 3)]